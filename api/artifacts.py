@@ -0,0 +1,327 @@
+"""
+Local model artifacts and their download from an object store (GCS by default).
+
+Downloads are
+  parallel     — every missing file of a version is fetched concurrently
+  atomic       — bytes go to `<file>.part` and are renamed into place only after
+                 verification, so an interrupted start never leaves a bad artifact
+  verified     — against the store's MD5 (or CRC32C for composite objects)
+  resumable    — a leftover `.part` is continued with a ranged read
+  shared       — with ARTIFACT_CACHE_DIR set, files are kept once per host by
+                 content hash and hard-linked into each MODEL_DIR/<version>/
+
+A `.artifacts.json` manifest in each version directory records what was
+verified, so later starts check sizes locally and never touch the network.
+`LocalStore` serves a plain directory with the same interface (a mirror, or
+a fake bucket in tests).
+"""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from api.backends import optional_artifacts, serving_artifacts
+from api.model_config import (
+    ARTIFACT_CACHE_DIR, ARTIFACT_DOWNLOAD_WORKERS, ARTIFACT_OFFLINE, ARTIFACT_STORE, MODEL_DIR,
+)
+
+MANIFEST_NAME = ".artifacts.json"
+CHUNK_SIZE    = 1 << 20
+
+
+class MissingCredentialsError(RuntimeError):
+    """The store cannot be reached because no credentials are configured."""
+
+
+class ChecksumMismatchError(IOError):
+    """A downloaded or cached file does not match the store's size / checksum."""
+
+
+def artifact_dir(version: str) -> Path:
+    """Each version gets its own subdirectory to avoid filename clashes."""
+    return MODEL_DIR / version
+
+
+# -- Object stores --------------------------------------------------------------
+
+class StoredObject(NamedTuple):
+    name:   str                     # full object name, e.g. models/demo_v11.0/classifier.keras
+    size:   int
+    md5:    Optional[str] = None    # base64 digest, as GCS reports it
+    crc32c: Optional[str] = None    # base64 big-endian CRC32C
+
+
+class GCSStore:
+    """A GCS bucket (needs google-cloud-storage and application default credentials)."""
+
+    def __init__(self, bucket_name: str):
+        try:
+            from google.cloud import storage as gcs_lib
+        except ImportError as exc:
+            raise RuntimeError(
+                "google-cloud-storage is required to fetch model artifacts. "
+                "Add it to api/requirements.txt."
+            ) from exc
+        from google.auth.exceptions import DefaultCredentialsError
+        try:
+            self.client = gcs_lib.Client()
+        except DefaultCredentialsError as exc:
+            raise MissingCredentialsError(str(exc)) from exc
+        self.bucket = self.client.bucket(bucket_name)
+        self.url    = f"gs://{bucket_name}"
+
+    def list(self, prefix: str) -> list:
+        """The object named `prefix`, or every object under `prefix/` (a directory)."""
+        return [
+            StoredObject(blob.name, blob.size, blob.md5_hash, blob.crc32c)
+            for blob in self.client.list_blobs(self.bucket, prefix=prefix)
+            if blob.name == prefix or blob.name.startswith(prefix + "/")
+        ]
+
+    def download(self, name: str, fileobj, start: int = 0) -> None:
+        # raw_download: checksums are of the stored bytes, not a transcoded stream
+        self.bucket.blob(name).download_to_file(fileobj, start=start or None, raw_download=True)
+
+
+class LocalStore:
+    """A directory laid out like the bucket (file:// mirrors, fake store in tests)."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.url  = f"file://{self.root}"
+
+    def list(self, prefix: str) -> list:
+        path = self.root / prefix
+        files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+        return [
+            StoredObject(str(p.relative_to(self.root)), p.stat().st_size, _file_md5(p))
+            for p in files if p.is_file()
+        ]
+
+    def download(self, name: str, fileobj, start: int = 0) -> None:
+        with open(self.root / name, "rb") as src:
+            src.seek(start)
+            shutil.copyfileobj(src, fileobj, CHUNK_SIZE)
+
+
+def open_store(url: str = ARTIFACT_STORE):
+    """`gs://bucket` → GCSStore; `file:///dir` or a plain path → LocalStore."""
+    if url.startswith("gs://"):
+        return GCSStore(url[len("gs://"):].strip("/"))
+    return LocalStore(url[len("file://"):] if url.startswith("file://") else url)
+
+
+# -- Verification -----------------------------------------------------------------
+
+def _file_md5(path: Path) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode()
+
+
+def _file_crc32c(path: Path) -> str:
+    try:
+        import google_crc32c
+    except ImportError as exc:
+        raise RuntimeError(
+            "google-crc32c is required to verify composite GCS objects. "
+            "Add it to api/requirements.txt."
+        ) from exc
+    checksum = google_crc32c.Checksum()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            checksum.update(chunk)
+    return base64.b64encode(checksum.digest()).decode()
+
+
+def verify(path: Path, obj: StoredObject) -> bool:
+    """True if `path` has the object's size and checksum (MD5, else CRC32C)."""
+    if path.stat().st_size != obj.size:
+        return False
+    if obj.md5:
+        return _file_md5(path) == obj.md5
+    if obj.crc32c:
+        return _file_crc32c(path) == obj.crc32c
+    return True
+
+
+# -- Download ---------------------------------------------------------------------
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive lock so processes sharing a cache dir never write the same file."""
+    try:
+        import fcntl
+    except ImportError:     # Windows: no cross-process locking
+        yield
+        return
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _download_verified(store, obj: StoredObject, target: Path) -> None:
+    """Download `obj` to `target` via `<target>.part`, resuming a leftover part once."""
+    part = target.with_name(target.name + ".part")
+    for attempt in range(2):
+        start = part.stat().st_size if part.exists() and attempt == 0 else 0
+        if start > obj.size:
+            start = 0
+        with open(part, "ab" if start else "wb") as f:
+            if start < obj.size:
+                store.download(obj.name, f, start=start)
+        if verify(part, obj):
+            os.replace(part, target)
+            return
+        part.unlink()       # corrupt or from an older object generation: start over
+    raise ChecksumMismatchError(f"Checksum mismatch for {store.url}/{obj.name} after re-download")
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    """Atomically place `src` at `dest` (hard link, or copy across filesystems)."""
+    tmp = dest.with_name(dest.name + ".part")
+    if tmp.exists():
+        tmp.unlink()
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def fetch(store, obj: StoredObject, dest: Path, cache_dir: Path = None) -> None:
+    """Place a verified copy of `obj` at `dest`, going through the host cache if set."""
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.is_file() and verify(dest, obj):
+        return      # already there, e.g. copied by hand before the manifest existed
+    if cache_dir is None:
+        _download_verified(store, obj, dest)
+        return
+
+    # Content-addressed, so versions that ship the same file (e.g. the backbone) share it
+    key    = obj.md5 or obj.crc32c or obj.name
+    cached = cache_dir / hashlib.sha1(f"{key}:{obj.size}".encode()).hexdigest()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    with _file_lock(cached.with_name(cached.name + ".lock")):
+        # Full check: a cache entry of the right size can still be corrupt
+        if not (cached.exists() and verify(cached, obj)):
+            _download_verified(store, obj, cached)
+    _link_or_copy(cached, dest)
+
+
+def _load_manifest(dest_dir: Path) -> dict:
+    try:
+        return json.loads((dest_dir / MANIFEST_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_manifest(dest_dir: Path, manifest: dict) -> None:
+    tmp = dest_dir / (MANIFEST_NAME + ".part")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(tmp, dest_dir / MANIFEST_NAME)
+
+
+def _is_complete(dest_dir: Path, entry: dict, optional: bool = False) -> bool:
+    """
+    A manifest entry maps relative paths to sizes; every file must be present and whole.
+    An optional artifact the store did not have is recorded as an empty entry.
+    """
+    if entry is None:
+        return False
+    if not entry:
+        return optional
+    return all(
+        (dest_dir / rel).is_file() and (dest_dir / rel).stat().st_size == size
+        for rel, size in entry.items()
+    )
+
+
+def sync_artifacts(store, prefix: str, filenames, dest_dir: Path,
+                   cache_dir: Path = None, workers: int = ARTIFACT_DOWNLOAD_WORKERS,
+                   optional=()) -> list:
+    """
+    Make every name in `filenames` (files or SavedModel directories under
+    `prefix` in `store`) present and verified in `dest_dir`. Names in `optional`
+    may be missing from the store.
+
+    Returns the names that had to be fetched (empty when all were already verified).
+    """
+    dest_dir = Path(dest_dir)
+    manifest = _load_manifest(dest_dir)
+    missing  = [name for name in filenames
+                if not _is_complete(dest_dir, manifest.get(name), name in optional)]
+    if not missing:
+        return []
+
+    listings = {name: store.list(f"{prefix}/{name}") for name in missing}
+    empty = [name for name, objects in listings.items() if not objects and name not in optional]
+    if empty:
+        raise FileNotFoundError(f"Not found in {store.url}/{prefix}/: {', '.join(empty)}")
+    for name in [name for name, objects in listings.items() if not objects]:
+        print(f"Optional {name} not in {store.url}/{prefix}/; skipped")
+
+    jobs = [
+        (obj, dest_dir / obj.name[len(prefix) + 1:])
+        for objects in listings.values() for obj in objects
+    ]
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs)))) as pool:
+        # list() re-raises the first failure
+        list(pool.map(lambda job: fetch(store, *job, cache_dir=cache_dir), jobs))
+
+    for name, objects in listings.items():
+        manifest[name] = {obj.name[len(prefix) + 1:]: obj.size for obj in objects}
+    _save_manifest(dest_dir, manifest)
+    return [name for name in missing if listings[name]]
+
+
+def _use_unverified(version: str, dest_dir: Path, filenames, reason: str) -> None:
+    """Offline dev with hand-copied artifacts: serve them as they are, or fail."""
+    missing = [name for name in filenames if not (dest_dir / name).exists()]
+    if missing:
+        raise FileNotFoundError(f"[{version}] {reason} and not on disk: {', '.join(missing)}")
+    print(f"[{version}] WARNING: {reason}; using local files unverified")
+
+
+def maybe_download_from_gcs(version: str, config: dict, store=None,
+                            cache_dir=ARTIFACT_CACHE_DIR, offline: bool = ARTIFACT_OFFLINE) -> None:
+    """
+    Download missing or unverified artifacts for one model version.
+
+    Unverified local files are only used with `offline` set or when the store has
+    no credentials; any other failure (network, missing object, checksum) raises.
+    """
+    dest_dir  = artifact_dir(version)
+    filenames = list(serving_artifacts(config).values())
+    optional  = optional_artifacts(config)
+    required  = [name for name in filenames if name not in optional]
+    manifest  = _load_manifest(dest_dir)
+    if all(_is_complete(dest_dir, manifest.get(name), name in optional) for name in filenames):
+        return
+    if offline:
+        _use_unverified(version, dest_dir, required, "ARTIFACT_OFFLINE is set")
+        return
+
+    try:
+        store = store or open_store()
+    except MissingCredentialsError as exc:
+        _use_unverified(version, dest_dir, required, f"no credentials for the artifact store ({exc})")
+        return
+    print(f"[{version}] Syncing artifacts from {store.url}/{config['gcs_prefix']} …")
+    fetched = sync_artifacts(
+        store, config["gcs_prefix"], filenames, dest_dir,
+        cache_dir=Path(cache_dir) if cache_dir else None, optional=optional,
+    )
+    print(f"[{version}] Download complete ({', '.join(fetched)}).")
@@ -0,0 +1,274 @@
+"""
+Pluggable CPU inference backends.
+
+Every backend produces the same two runners (see api/inference.py):
+
+    feature_extractor(images)  -> (embeddings,)               # None for end-to-end models
+    heads(model_input)         -> (label_probs, macros_scaled)
+
+  keras        — .keras heads fused at load time + EfficientNetB0 built in-process
+                 from the local backbone weights artifact
+  saved_model  — feature_extractor.savedmodel/ + heads.savedmodel/ (pre-fused and
+                 pre-traced, so loading skips Keras deserialization and tracing)
+  tflite       — feature_extractor[.<q>].tflite + heads[.<q>].tflite
+  onnxruntime  — feature_extractor[.<q>].onnx   + heads[.<q>].onnx
+
+where <q> is the config's `quantization` ("dynamic" | "int8"), produced by
+`python -m api.export`.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+import joblib
+import tensorflow as tf
+from tensorflow.keras import layers, models
+from tensorflow.keras.applications import EfficientNetB0
+
+from api.heads import HEAD_KEYS, fuse_heads, run_separately, validate_fused
+from api.inference import make_runner, run_bucketed
+from api.model_config import INFERENCE_BUCKETS, INFERENCE_XLA
+from api.precision import check_drift, serving_precision, set_precision
+
+BACKENDS      = ("keras", "saved_model", "tflite", "onnxruntime")
+QUANTIZATIONS = (None, "dynamic", "int8")
+
+IMAGE_SIZE      = (224, 224)
+EXPORT_SUFFIXES = {"saved_model": ".savedmodel", "tflite": ".tflite", "onnxruntime": ".onnx"}
+# TFLite / ONNX Runtime threads per graph (api.serve overrides it per worker)
+NUM_THREADS     = int(os.environ.get("BACKEND_NUM_THREADS", os.cpu_count() or 1))
+
+
+def export_filenames(config: dict, backend: str = None, quantization: str = None) -> dict:
+    """Filenames of the exported graphs for a non-Keras backend."""
+    backend = backend or config["backend"]
+    if quantization is None:
+        quantization = config.get("quantization")
+    tag = f".{quantization}" if quantization and backend != "saved_model" else ""
+    ext = EXPORT_SUFFIXES[backend]
+
+    names = {"heads": f"heads{tag}{ext}"}
+    if config["input_type"] == "embeddings":
+        names["feature_extractor"] = f"feature_extractor{tag}{ext}"
+    return names
+
+
+def backbone_id(config: dict) -> str:
+    """Identify the embedding function, so caches never mix float32 and quantized embeddings."""
+    if config["backend"] == "keras":
+        precision = serving_precision(config)
+        return "efficientnetb0_gap/keras" + ("" if precision == "float32" else f".{precision}")
+    if not config.get("quantization"):
+        return f"efficientnetb0_gap/{config['backend']}"
+    return f"efficientnetb0_gap/{config['backend']}.{config['quantization']}"
+
+
+def index_backbone(config: dict) -> str:
+    """Backbone recorded by embedding stores and kNN indexes: embedding function and weights."""
+    return f"{backbone_id(config)}:{config['artifacts']['feature_extractor']}"
+
+
+def serving_artifacts(config: dict) -> dict:
+    """All artifact files the configured backend needs on disk."""
+    if config["backend"] == "keras":
+        return dict(config["artifacts"])
+    return {
+        "label_encoder": config["artifacts"]["label_encoder"],
+        "macro_scaler":  config["artifacts"]["macro_scaler"],
+        **export_filenames(config),
+    }
+
+
+def optional_artifacts(config: dict) -> set:
+    """
+    Filenames a version may lack in the store. Keras: the backbone weights, which
+    prefixes created before they were versioned don't have (Keras' ImageNet
+    download is used instead).
+    """
+    if config["backend"] == "keras" and "feature_extractor" in config["artifacts"]:
+        return {config["artifacts"]["feature_extractor"]}
+    return set()
+
+
+# -- Keras --------------------------------------------------------------------
+
+def build_feature_extractor(weights_path: Path = None) -> models.Model:
+    """
+    Frozen EfficientNetB0 → GAP, mapping (224, 224, 3) images to 1280-dim embeddings.
+
+    With `weights_path` (the versioned backbone artifact) nothing is fetched from
+    the network; without it Keras downloads the ImageNet weights (export, and
+    versions whose prefix has no backbone artifact yet).
+    """
+    base = EfficientNetB0(
+        weights=None if weights_path else "imagenet", include_top=False,
+        input_shape=(*IMAGE_SIZE, 3),
+    )
+    base.trainable = False
+    model = models.Sequential(
+        [base, layers.GlobalAveragePooling2D()],
+        name="feature_extractor",
+    )
+    if weights_path:
+        model.load_weights(str(weights_path))
+    return model
+
+
+def load_keras_heads(config: dict, art_dir: Path):
+    """Load the head models for `config` and fuse them; returns (fused, head_models)."""
+    mode = config["mode"]
+    head_models = {
+        key: tf.keras.models.load_model(str(art_dir / config["artifacts"][key]))
+        for key in HEAD_KEYS[mode]
+    }
+    return fuse_heads(mode, head_models), head_models
+
+
+def _load_keras(config: dict, art_dir: Path, version: str, shared: dict):
+    mode      = config["mode"]
+    precision = serving_precision(config)
+    jit       = config.get("jit_compile", INFERENCE_XLA)
+    if precision != (config.get("precision") or "float32"):
+        print(f"[{version}] WARNING: this CPU has no native {config['precision']} support; "
+              f"serving float32")
+
+    # --- Feature extractor (for head-only models, shared per backbone) ---
+    feature_extractor = None
+    if config["input_type"] == "embeddings":
+        key = backbone_id(config)
+        if key not in shared:
+            weights = art_dir / config["artifacts"]["feature_extractor"]
+            if not weights.exists():
+                print(f"[{version}] WARNING: no {weights.name} artifact; using Keras' ImageNet "
+                      f"download (run `python -m api.export {version} --backend keras` and upload it)")
+            backbone = build_feature_extractor(weights if weights.exists() else None)
+            set_precision(backbone, precision)
+            shared[key] = make_runner(backbone, jit_compile=jit)
+            print(f"[{version}] Feature extractor loaded (EfficientNetB0 → GAP → 1280, "
+                  f"{weights.name if weights.exists() else 'imagenet'}, "
+                  f"{precision}{', XLA' if jit else ''})")
+        feature_extractor = shared[key]
+
+    # --- Fuse heads into one multi-output graph, validated against the originals ---
+    fused, head_models = load_keras_heads(config, art_dir)
+    try:
+        max_diff = validate_fused(fused, mode, head_models)
+        print(f"[{version}] Fused {len(head_models)} head(s) "
+              f"into one graph (max diff {max_diff:.1e})")
+    except ValueError as exc:
+        if precision != "float32":
+            raise ValueError(f"{exc}; reduced precision needs the fused heads") from exc
+        print(f"[{version}] WARNING: {exc}; serving separate heads")
+        return feature_extractor, lambda batch: run_separately(mode, head_models, batch)
+
+    # --- Reduced precision: refused if the macros drift from float32 ---
+    if precision != "float32":
+        scaler = joblib.load(art_dir / config["artifacts"]["macro_scaler"])
+        drift  = check_drift(config, scaler, fused, precision,
+                             backbone=getattr(feature_extractor, "model", None))
+        set_precision(fused, precision)
+        print(f"[{version}] Serving {precision} (max macro drift {drift:.3f} g vs float32)")
+
+    return feature_extractor, make_runner(fused, jit_compile=jit)
+
+
+# -- SavedModel ---------------------------------------------------------------
+
+class SavedModelRunner:
+    """Run an exported SavedModel signature, padding batches to INFERENCE_BUCKETS."""
+
+    def __init__(self, path: Path, buckets=INFERENCE_BUCKETS):
+        self._loaded  = tf.saved_model.load(str(path))
+        self._fn      = self._loaded.signatures["serving_default"]
+        self._input   = list(self._fn.structured_input_signature[1])[0]
+        # Exported outputs are named output_0, output_1, ... in model output order
+        self._outputs = sorted(self._fn.structured_outputs,
+                               key=lambda name: int(name.rsplit("_", 1)[-1]))
+        self.buckets  = tuple(sorted(set(int(b) for b in buckets)))
+
+    def _call(self, chunk):
+        outputs = self._fn(**{self._input: tf.constant(chunk)})
+        return tuple(outputs[name].numpy() for name in self._outputs)
+
+    def __call__(self, batch):
+        return run_bucketed(batch, self.buckets, self._call)
+
+
+# -- TFLite -------------------------------------------------------------------
+
+class TFLiteRunner:
+    """Run a .tflite graph through its serving signature (inputs are resized per batch size)."""
+
+    def __init__(self, path: Path, num_threads: int = None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            Interpreter = tf.lite.Interpreter
+        interpreter = Interpreter(model_path=str(path), num_threads=num_threads or NUM_THREADS)
+        signature   = interpreter.get_signature_list()["serving_default"]
+        self._runner  = interpreter.get_signature_runner("serving_default")
+        self._input   = signature["inputs"][0]
+        # Exported outputs are named output_0, output_1, ... in model output order
+        self._outputs = sorted(signature["outputs"], key=lambda name: int(name.rsplit("_", 1)[-1]))
+        self._lock    = threading.Lock()     # interpreters are not thread-safe
+
+    def __call__(self, batch):
+        with self._lock:
+            outputs = self._runner(**{self._input: batch.astype("float32")})
+            return tuple(outputs[name] for name in self._outputs)
+
+
+# -- ONNX Runtime -------------------------------------------------------------
+
+class OnnxRunner:
+    """Run an .onnx graph with ONNX Runtime on CPU."""
+
+    def __init__(self, path: Path, num_threads: int = None):
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise RuntimeError(
+                "onnxruntime is required for backend='onnxruntime'. "
+                "Add it to api/requirements.txt."
+            ) from exc
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or NUM_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self._input = self.session.get_inputs()[0].name
+
+    def __call__(self, batch):
+        return tuple(self.session.run(None, {self._input: batch.astype("float32")}))
+
+
+_RUNNERS = {"saved_model": SavedModelRunner, "tflite": TFLiteRunner, "onnxruntime": OnnxRunner}
+
+
+def load_backend(config: dict, art_dir: Path, version: str, shared: dict = None):
+    """
+    Return (feature_extractor, heads) runners for the backend named in `config`.
+
+    `shared` maps backbone_id → feature extractor runner; versions on the same
+    backbone reuse one instance instead of loading EfficientNetB0 again.
+    """
+    shared  = {} if shared is None else shared
+    backend = config["backend"]
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Available: {', '.join(BACKENDS)}")
+    if backend == "keras":
+        return _load_keras(config, art_dir, version, shared)
+
+    runner_cls = _RUNNERS[backend]
+    files = export_filenames(config)
+    feature_extractor = None
+    if "feature_extractor" in files:
+        key = backbone_id(config)
+        if key not in shared:
+            shared[key] = runner_cls(art_dir / files["feature_extractor"])
+        feature_extractor = shared[key]
+    heads = runner_cls(art_dir / files["heads"])
+    print(f"[{version}] Loaded {backend} graphs ({', '.join(files.values())})")
+    return feature_extractor, heads
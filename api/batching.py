@@ -0,0 +1,112 @@
+"""
+Dynamic micro-batching for model inference.
+
+Concurrent /predict requests each submit one preprocessed image. A single
+worker thread collects them for up to `max_wait_ms` (or until
+`max_batch_size` are waiting), stacks them into one batch, runs the model
+once, and hands every request back its own row of the outputs.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Collect single-sample requests into batches for `batch_fn`.
+
+    `batch_fn` takes an array of shape (N, *item_shape) and returns a tuple
+    of arrays, each with leading dimension N. Every caller receives a tuple
+    with its own row of each output.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=5.0,
+                 name="micro-batcher"):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.batch_fn       = batch_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait_s     = max(float(max_wait_ms), 0.0) / 1000.0
+        self._queue   = queue.Queue()
+        self._closing = False
+        self._thread  = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: np.ndarray) -> Future:
+        """Queue one sample; the returned future resolves to its outputs."""
+        if self._closing:
+            raise RuntimeError("MicroBatcher is closed")
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    @property
+    def queue_depth(self) -> int:
+        """Requests waiting for the worker (approximate, for metrics)."""
+        return self._queue.qsize()
+
+    def __call__(self, item: np.ndarray):
+        """Blocking helper: submit one sample and wait for its outputs."""
+        return self.submit(item).result()
+
+    def close(self) -> None:
+        """Finish queued work and stop the worker thread."""
+        if self._closing:
+            return
+        self._closing = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    # -- Worker ---------------------------------------------------------------
+
+    def _collect(self) -> list:
+        """Block for the first request, then gather more until full or timed out."""
+        first = self._queue.get()
+        if first is _STOP:
+            return []
+
+        batch    = [first]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    entry = self._queue.get(timeout=remaining)
+                else:
+                    entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                self._queue.put(_STOP)      # handled after this batch
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+
+            # Requests cancelled while queued are dropped before inference.
+            batch = [(item, fut) for item, fut in batch
+                     if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            items, futures = zip(*batch)
+            try:
+                outputs = self.batch_fn(np.stack(items))
+            except Exception as exc:
+                for fut in futures:
+                    fut.set_exception(exc)
+                continue
+
+            for row, fut in enumerate(futures):
+                fut.set_result(tuple(out[row] for out in outputs))
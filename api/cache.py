@@ -0,0 +1,323 @@
+"""
+Content-addressed caches for the serving path.
+
+PredictionCache keys responses by a hash of the uploaded bytes plus the model
+version, so re-uploads (retries after cold-start timeouts, double taps, shared
+photos) skip decode and inference entirely.
+
+  memory tier — bounded LRU with a TTL
+  disk tier   — optional directory of JSON files, shared across restarts
+  single-flight — concurrent requests for the same key wait on one computation
+
+EmbeddingCache sits one level below: it keeps the backbone's embedding for an
+image hash, so head-only versions skip decode and EfficientNetB0 for images
+they (or another head version) have already seen.
+
+Lookups take optional metric `labels` (model_version, mode values), so /metrics
+can break hit ratios (and prediction cache entries) down per served version.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+
+import numpy as np
+
+
+def content_hash(data: bytes) -> str:
+    """Stable hex digest of raw upload bytes."""
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def _hit_rate(hits: int, lookups: int) -> float:
+    return round(hits / lookups, 4) if lookups else 0.0
+
+
+class PredictionCache:
+    """LRU + TTL cache of JSON-serialisable values with an optional disk tier."""
+
+    def __init__(self, max_entries: int = 1024, ttl_s: float = 3600.0, disk_dir=None):
+        self.max_entries = int(max_entries)
+        self.ttl_s       = float(ttl_s)
+        self.disk_dir    = Path(disk_dir) if disk_dir else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock     = threading.Lock()
+        self._entries  = OrderedDict()      # key -> (expires_at, value, labels)
+        self._inflight = {}                 # key -> Future
+        self._waiters  = {}                 # key -> callers joined on the in-flight Future
+        self._stats    = {"memory_hits": 0, "disk_hits": 0, "inflight_joins": 0,
+                          "misses": 0, "evictions": 0}
+        self._by_labels = {}                # labels -> {"hits", "lookups", "size"}
+
+    def _labelled(self, labels) -> dict:
+        """Per-label counters. Caller holds the lock."""
+        counts = self._by_labels.get(labels)
+        if counts is None:
+            counts = self._by_labels[labels] = {"hits": 0, "lookups": 0, "size": 0}
+        return counts
+
+    def _count(self, stat: str, labels) -> None:
+        """Record one lookup outcome. Caller holds the lock."""
+        self._stats[stat] += 1
+        counts = self._labelled(labels)
+        counts["lookups"] += 1
+        counts["hits"]    += stat != "misses"
+
+    # -- Memory tier ------------------------------------------------------------
+
+    def _get_memory(self, key):
+        """Return the cached value or None. Caller holds the lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value, labels = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self._labelled(labels)["size"] -= 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _put_memory(self, key, value, labels=()) -> None:
+        """Insert and evict least-recently-used entries. Caller holds the lock."""
+        if self.max_entries <= 0:
+            return
+        previous = self._entries.get(key)
+        if previous is not None:
+            self._labelled(previous[2])["size"] -= 1
+        self._entries[key] = (time.monotonic() + self.ttl_s, value, labels)
+        self._entries.move_to_end(key)
+        self._labelled(labels)["size"] += 1
+        while len(self._entries) > self.max_entries:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._labelled(evicted)["size"] -= 1
+            self._stats["evictions"] += 1
+
+    # -- Disk tier --------------------------------------------------------------
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key.replace(':', '_')}.json"
+
+    def _get_disk(self, key):
+        if self.disk_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl_s:
+                path.unlink(missing_ok=True)
+                return None
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _put_disk(self, key, value) -> None:
+        if self.disk_dir is None:
+            return
+        path = self._disk_path(key)
+        tmp  = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp.write_text(json.dumps(value))
+            os.replace(tmp, path)           # atomic: readers never see partial files
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    # -- Public API -------------------------------------------------------------
+
+    def get(self, key, labels=()):
+        """Look `key` up in memory, then on disk. Returns None on a miss."""
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                self._count("memory_hits", labels)
+                return dict(value)
+
+        value = self._get_disk(key)
+        with self._lock:
+            if value is None:
+                self._count("misses", labels)
+                return None
+            self._count("disk_hits", labels)
+            self._put_memory(key, value, labels)
+        return dict(value)
+
+    def put(self, key, value, labels=()) -> None:
+        with self._lock:
+            self._put_memory(key, value, labels)
+        self._put_disk(key, value)
+
+    def get_or_compute(self, key, compute, labels=()):
+        """
+        Return the cached value for `key`, or run `compute()` once for it.
+
+        Concurrent callers with the same key block on the first caller's
+        computation instead of starting their own. Exceptions are shared with
+        the waiters but never cached.
+        """
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                self._count("memory_hits", labels)
+                return dict(value)
+            future, owner = self._join(key, labels)
+
+        if not owner:
+            return dict(future.result())
+
+        try:
+            value = self._get_disk(key)
+            with self._lock:
+                self._count("disk_hits" if value is not None else "misses", labels)
+            if value is None:
+                value = compute()
+                self._put_disk(key, value)
+            with self._lock:
+                self._put_memory(key, value, labels)
+            future.set_result(value)
+            return dict(value)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            self._release(key)
+
+    async def get_or_compute_async(self, key, compute, labels=()):
+        """
+        Coroutine version of get_or_compute: `compute` is an async callable and
+        waiters await the shared in-flight future without blocking a thread.
+        """
+        with self._lock:
+            value = self._get_memory(key)
+            if value is not None:
+                self._count("memory_hits", labels)
+                return dict(value)
+            future, owner = self._join(key, labels)
+
+        if not owner:
+            return dict(await asyncio.wrap_future(future))
+
+        try:
+            value = self._get_disk(key)
+            with self._lock:
+                self._count("disk_hits" if value is not None else "misses", labels)
+            if value is None:
+                value = await compute()
+                self._put_disk(key, value)
+            with self._lock:
+                self._put_memory(key, value, labels)
+            future.set_result(value)
+            return dict(value)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            self._release(key)
+
+    def has_waiters(self, key) -> bool:
+        """True if other requests are waiting on the in-flight computation for `key`."""
+        with self._lock:
+            return self._waiters.get(key, 0) > 0
+
+    def _join(self, key, labels=()):
+        """Return (future, owner) for `key`. Caller holds the lock."""
+        future = self._inflight.get(key)
+        if future is None:
+            future = Future()
+            self._inflight[key] = future
+            self._waiters[key]  = 0
+            return future, True
+        self._count("inflight_joins", labels)
+        self._waiters[key] += 1
+        return future, False
+
+    def _release(self, key) -> None:
+        with self._lock:
+            self._inflight.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"]        = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            stats["inflight"]    = len(self._inflight)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["inflight_joins"] + stats["misses"]
+        stats["hit_rate"] = _hit_rate(lookups - stats["misses"], lookups)
+        return stats
+
+    def stats_by_labels(self) -> dict:
+        """{labels: {"hit_rate", "size"}} for every label set looked up so far."""
+        with self._lock:
+            return {labels: {"hit_rate": _hit_rate(c["hits"], c["lookups"]), "size": c["size"]}
+                    for labels, c in self._by_labels.items()}
+
+
+class EmbeddingCache:
+    """
+    Memory-bounded LRU of backbone embeddings, stored as float16.
+
+    Embeddings depend only on the image and the backbone, not on the head
+    version, so one entry serves every head-only model. A 1280-dim embedding
+    takes 2.5 KB, so 64 MB holds ~26K images.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, dtype=np.float16):
+        self.max_bytes = int(max_bytes)
+        self.dtype     = np.dtype(dtype)
+        self._lock     = threading.Lock()
+        self._entries  = OrderedDict()      # key -> np.ndarray (dtype)
+        self._bytes    = 0
+        self._stats    = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lookups  = {}                 # labels -> [hits, lookups]
+
+    def get(self, key, labels=()):
+        """Return the cached embedding as float32, or None."""
+        with self._lock:
+            embedding = self._entries.get(key)
+            counts    = self._lookups.setdefault(labels, [0, 0])
+            counts[1] += 1
+            if embedding is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            counts[0] += 1
+        return embedding.astype(np.float32)
+
+    def put(self, key, embedding: np.ndarray) -> None:
+        if self.max_bytes <= 0:
+            return
+        compact = np.asarray(embedding, dtype=self.dtype).copy()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = compact
+            self._bytes += compact.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"]      = len(self._entries)
+            stats["bytes"]     = self._bytes
+            stats["max_bytes"] = self.max_bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = _hit_rate(stats["hits"], lookups)
+        return stats
+
+    def stats_by_labels(self) -> dict:
+        """{labels: {"hit_rate"}}; entries are shared by every version on the backbone."""
+        with self._lock:
+            return {labels: {"hit_rate": _hit_rate(hits, lookups)}
+                    for labels, (hits, lookups) in self._lookups.items()}
@@ -0,0 +1,157 @@
+"""
+Admission control for the inference stage.
+
+  inference_slots — caps how many model calls run at once (sized to the CPUs),
+                    so TensorFlow threads don't fight over one vCPU
+  LoadShedder     — caps how many requests may wait for decode + inference;
+                    beyond that the API answers 503 + Retry-After immediately
+                    instead of letting clients hit their own timeout
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from api.model_config import INFERENCE_CONCURRENCY, MAX_QUEUE_DEPTH
+
+
+def cpu_quota():
+    """CPUs granted by the cgroup CPU quota (v2 cpu.max or v1 cfs), None if unlimited."""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        return int(quota) / int(period) if quota != "max" else None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def memory_limit_bytes():
+    """Memory this container may use: the cgroup limit (v2 or v1) capped by physical RAM."""
+    try:
+        physical = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):      # macOS / Windows
+        physical = None
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit():     # v2 "max" / v1's huge sentinel both fall through to RAM
+            return min(int(value), physical) if physical else int(value)
+    return physical
+
+
+def available_cpus() -> int:
+    """CPUs this process may use: affinity (unlike os.cpu_count) capped by the cgroup quota."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:      # macOS / Windows
+        cpus = os.cpu_count() or 1
+    quota = cpu_quota()
+    return max(1, min(cpus, math.ceil(quota))) if quota else cpus
+
+
+class InferenceSlots:
+    """
+    Semaphore capping concurrent model calls. `resize` only before serving starts
+    (api.serve sizes each worker to its own CPUs after forking).
+    """
+
+    def __init__(self, limit: int):
+        self.resize(limit)
+
+    def resize(self, limit: int) -> None:
+        self.limit      = max(int(limit), 1)
+        self._semaphore = threading.BoundedSemaphore(self.limit)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._semaphore.release()
+        return False
+
+
+# Shared by every served version and endpoint: at most this many model calls at once.
+inference_slots = InferenceSlots(INFERENCE_CONCURRENCY or available_cpus())
+
+
+class Overloaded(Exception):
+    """Raised when the inference queue is full; `labels` as passed to LoadShedder.admit."""
+
+    def __init__(self, retry_after: int, labels=()):
+        super().__init__(f"Inference queue full; retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.labels      = labels
+
+
+class LoadShedder:
+    """
+    Count requests in the decode + inference stage and reject past `max_pending`.
+
+    The limit is shared by every version; `labels` (model_version, mode values)
+    only break the pending and shed counts down for /metrics.
+    """
+
+    def __init__(self, max_pending: int = MAX_QUEUE_DEPTH, concurrency: int = None):
+        self.max_pending = int(max_pending)
+        self.concurrency = max(int(concurrency or inference_slots.limit), 1)
+        self.pending     = 0
+        self.shed        = 0
+        self._latency_s  = 0.5          # EWMA of time spent in the stage
+        self._by_labels  = {}           # labels -> {"pending", "shed"}
+        self._lock       = threading.Lock()
+
+    def retry_after(self) -> int:
+        """Rough seconds until the current queue drains."""
+        return max(1, math.ceil(self._latency_s * self.pending / self.concurrency))
+
+    @contextmanager
+    def admit(self, labels=()):
+        """Hold a queue slot for the duration of the block, or raise Overloaded."""
+        with self._lock:
+            counts = self._by_labels.get(labels)
+            if counts is None:
+                counts = self._by_labels[labels] = {"pending": 0, "shed": 0}
+            if self.pending >= self.max_pending:
+                self.shed += 1
+                counts["shed"] += 1
+                raise Overloaded(self.retry_after(), labels)
+            self.pending += 1
+            counts["pending"] += 1
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.pending -= 1
+                counts["pending"] -= 1
+                self._latency_s = 0.9 * self._latency_s + 0.1 * elapsed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending":     self.pending,
+                "max_pending": self.max_pending,
+                "shed":        self.shed,
+                "latency_s":   round(self._latency_s, 4),
+            }
+
+    def stats_by_labels(self) -> dict:
+        """{labels: {"pending", "shed"}} for every label set admitted or shed so far."""
+        with self._lock:
+            return {labels: dict(counts) for labels, counts in self._by_labels.items()}
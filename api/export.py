@@ -0,0 +1,267 @@
+"""
+Export a model version's serving graphs for the SavedModel / TFLite / ONNX Runtime backends.
+
+    python -m api.export demo_v11.0 --backend tflite --quantization int8 \\
+        --calibration-dir data/mmfood100k/v1/images --samples 200
+
+    # Package the EfficientNetB0 backbone weights (the only step that needs network access)
+    python -m api.export demo_v11.0 --backend keras
+
+Reads the version's Keras artifacts from MODEL_DIR/<version>/ (run the API once,
+or `gsutil cp` them, to fetch them), writes feature_extractor[.<q>].<ext> and
+heads[.<q>].<ext> next to them, and saves a drift report comparing every
+export with the Keras original on the calibration images.
+
+Upload the exported files to gs://<GCS_BUCKET>/<gcs_prefix>/ and set
+`backend` / `quantization` in api/model_config.py to serve them.
+"""
+
+import argparse
+import json
+import shutil
+import tempfile
+from pathlib import Path
+
+import joblib
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework.convert_to_constants import convert_variables_to_constants_v2
+
+from api.backends import (
+    BACKENDS, IMAGE_SIZE, QUANTIZATIONS, OnnxRunner, SavedModelRunner, TFLiteRunner,
+    build_feature_extractor, export_filenames, load_keras_heads,
+)
+from api.model_config import MODEL_CONFIGS, MODEL_DIR
+from api.postprocess import PostProcessor
+from dine.preprocessing import decode_batch
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+# -- Inputs -------------------------------------------------------------------
+
+def load_calibration_images(image_dir: Path, limit: int, seed: int = 42) -> np.ndarray:
+    """Decode up to `limit` images (sampled reproducibly) into a (N, 224, 224, 3) batch."""
+    paths = sorted(p for p in Path(image_dir).rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise FileNotFoundError(f"No images found under {image_dir}")
+    rng = np.random.default_rng(seed)
+    paths = [paths[i] for i in sorted(rng.permutation(len(paths))[:limit])]
+    batch, errors = decode_batch(paths)
+    return batch[[error is None for error in errors]]
+
+
+def _save_serving_model(model, export_dir: Path) -> None:
+    """Write `model` as a SavedModel with a dynamic-batch `serving_default` signature."""
+    spec = tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="model_input")
+    model.export(str(export_dir), format="tf_saved_model", input_signature=[spec], verbose=False)
+
+
+# -- Converters -----------------------------------------------------------------
+
+def export_saved_model(model, path: Path, quantization, samples: np.ndarray) -> None:
+    """Write `model` as a pre-traced SavedModel directory (no quantization)."""
+    if quantization:
+        raise ValueError("The saved_model backend has no quantized variants")
+    if path.exists():
+        shutil.rmtree(path)
+    _save_serving_model(model, path)
+
+
+def export_tflite(model, path: Path, quantization, samples: np.ndarray) -> None:
+    """Convert `model` to TFLite; int8 quantizes weights and activations (float I/O)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        _save_serving_model(model, Path(tmp))
+        converter = tf.lite.TFLiteConverter.from_saved_model(tmp)
+        if quantization:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "int8":
+            converter.representative_dataset = lambda: ([s[None]] for s in samples)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        path.write_bytes(converter.convert())
+
+
+def export_onnx(model, path: Path, quantization, samples: np.ndarray) -> None:
+    """Convert `model` to ONNX via tf2onnx, then quantize with onnxruntime if requested."""
+    try:
+        import tf2onnx
+        import onnxruntime as ort
+    except ImportError as exc:
+        raise RuntimeError(
+            "tf2onnx and onnxruntime are required to export ONNX graphs "
+            "(pip install tf2onnx onnxruntime)"
+        ) from exc
+
+    # Freeze variables into constants so the graph has a single image/embedding input.
+    spec   = tf.TensorSpec((None, *model.input_shape[1:]), tf.float32, name="model_input")
+    frozen = convert_variables_to_constants_v2(
+        tf.function(lambda x: model(x, training=False)).get_concrete_function(spec)
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        float_path = path if not quantization else Path(tmp) / "float.onnx"
+        tf2onnx.convert.from_graph_def(
+            frozen.graph.as_graph_def(),
+            input_names=[t.name for t in frozen.inputs],
+            output_names=[t.name for t in frozen.outputs],
+            opset=17, output_path=str(float_path),
+        )
+        if not quantization:
+            return
+
+        from onnxruntime.quantization import (
+            CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static,
+        )
+        if quantization == "dynamic":
+            quantize_dynamic(str(float_path), str(path), weight_type=QuantType.QInt8)
+            return
+
+        input_name = ort.InferenceSession(str(float_path)).get_inputs()[0].name
+
+        class _Reader(CalibrationDataReader):
+            def __init__(self):
+                self._batches = iter({input_name: s[None]} for s in samples)
+
+            def get_next(self):
+                return next(self._batches, None)
+
+        quantize_static(
+            str(float_path), str(path), _Reader(),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+
+
+_EXPORTERS = {"saved_model": export_saved_model, "tflite": export_tflite, "onnxruntime": export_onnx}
+_RUNNERS   = {"saved_model": SavedModelRunner, "tflite": TFLiteRunner, "onnxruntime": OnnxRunner}
+
+
+# -- Drift report ---------------------------------------------------------------
+
+def drift_report(config, scaler, reference, exported) -> dict:
+    """Compare (label_probs, macros_scaled) from an export against the Keras reference."""
+    ref_probs, ref_macros = reference
+    exp_probs, exp_macros = exported
+    grams      = PostProcessor.from_artifacts(config, scaler).grams
+    grams_diff = np.abs(grams(exp_macros) - grams(ref_macros))
+    report = {
+        "samples":          int(len(ref_probs)),
+        "label_agreement":  float(np.mean(ref_probs.argmax(1) == exp_probs.argmax(1))),
+        "max_prob_diff":    float(np.max(np.abs(ref_probs - exp_probs))),
+    }
+    for i, name in enumerate(["fat_g", "protein_g", "carbs_g", "calories_kcal"]):
+        report[f"{name}_mae"] = float(grams_diff[:, i].mean())
+        report[f"{name}_max"] = float(grams_diff[:, i].max())
+    return report
+
+
+# -- Main -----------------------------------------------------------------------
+
+def backbone_feature_extractor(config: dict, art_dir: Path):
+    """
+    The version's EfficientNetB0 → GAP model from its local weights artifact.
+
+    If the artifact doesn't exist yet, build it from the ImageNet download and
+    save it, so every later export and every server start runs offline.
+    """
+    weights = art_dir / config["artifacts"]["feature_extractor"]
+    if weights.exists():
+        return build_feature_extractor(weights)
+    model = build_feature_extractor()
+    model.save_weights(str(weights))
+    print(f"Backbone weights saved to {weights} ({weights.stat().st_size / 1e6:.1f} MB)")
+    return model
+
+
+def _size(path: Path) -> int:
+    """Bytes on disk for a file or a SavedModel directory."""
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+def export_version(version: str, backend: str, quantizations, calibration_dir=None,
+                   samples: int = 100) -> list:
+    config  = MODEL_CONFIGS[version]
+    art_dir = MODEL_DIR / version
+
+    if backend == "keras":
+        if config["input_type"] == "embeddings":
+            backbone_feature_extractor(config, art_dir)
+        return []
+
+    if calibration_dir:
+        images = load_calibration_images(calibration_dir, samples)
+    elif "int8" in quantizations:
+        raise ValueError("int8 quantization needs --calibration-dir with sample images")
+    else:
+        print("WARNING: no --calibration-dir; drift is measured on random pixels")
+        images = np.random.default_rng(0).uniform(0, 255, (samples, *IMAGE_SIZE, 3)).astype(np.float32)
+
+    # --- Keras reference pipeline ---
+    feature_extractor = None
+    if config["input_type"] == "embeddings":
+        feature_extractor = backbone_feature_extractor(config, art_dir)
+    fused, _ = load_keras_heads(config, art_dir)
+    head_inputs = feature_extractor.predict(images, verbose=0) if feature_extractor else images
+    reference   = [np.asarray(out) for out in fused.predict(head_inputs, verbose=0)]
+    scaler      = joblib.load(art_dir / config["artifacts"]["macro_scaler"])
+
+    reports = []
+    for quantization in quantizations:
+        files = export_filenames(config, backend, quantization)
+        if feature_extractor is not None:
+            _EXPORTERS[backend](feature_extractor, art_dir / files["feature_extractor"],
+                                quantization, images)
+        _EXPORTERS[backend](fused, art_dir / files["heads"], quantization, head_inputs)
+
+        runner_cls = _RUNNERS[backend]
+        model_input = images
+        if feature_extractor is not None:
+            (model_input,) = runner_cls(art_dir / files["feature_extractor"])(images)
+        exported = runner_cls(art_dir / files["heads"])(model_input)
+
+        report = {
+            "version":      version,
+            "backend":      backend,
+            "quantization": quantization,
+            "files":        {key: _size(art_dir / name) for key, name in files.items()},
+            **drift_report(config, scaler, reference, exported),
+        }
+        reports.append(report)
+        print(json.dumps(report, indent=2))
+
+    report_path = art_dir / f"export_report.{backend}.json"
+    report_path.write_text(json.dumps(reports, indent=2))
+    print(f"Drift report saved to {report_path}")
+    return reports
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("version", choices=sorted(MODEL_CONFIGS))
+    parser.add_argument("--backend", choices=BACKENDS, default="tflite",
+                        help="'keras' only packages the backbone weights artifact")
+    parser.add_argument("--quantization", choices=["none", "dynamic", "int8", "all"], default="all",
+                        help="which graph(s) to export; 'all' writes float, dynamic and int8")
+    parser.add_argument("--calibration-dir", type=Path,
+                        help="directory of sample images for int8 calibration and the drift report")
+    parser.add_argument("--samples", type=int, default=100,
+                        help="number of calibration images to use")
+    args = parser.parse_args()
+
+    if args.backend in ("keras", "saved_model"):
+        quantizations = [None]
+    elif args.quantization == "all":
+        quantizations = list(QUANTIZATIONS) if args.calibration_dir else [None, "dynamic"]
+    else:
+        quantizations = [None if args.quantization == "none" else args.quantization]
+
+    export_version(args.version, args.backend, quantizations,
+                   calibration_dir=args.calibration_dir, samples=args.samples)
+
+
+if __name__ == "__main__":
+    main()
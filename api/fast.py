@@ -1,72 +1,54 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import asyncio
 import io
 import os
+import tarfile
+import time
+import zipfile
 import numpy as np
-import joblib
-from PIL import Image
 from pathlib import Path
 
-# Lazy-import TF so startup errors are clear
+_IMPORT_START = time.perf_counter()
+
+# Import TF eagerly, for its side effects only: a missing install fails with a clear
+# error, the import counts in the "import" startup timing, and api.serve's master
+# imports it once before forking so workers don't repeat it.
 try:
-    import tensorflow as tf
-    from tensorflow.keras.applications.efficientnet import preprocess_input
-    from tensorflow.keras.applications import EfficientNetB0
-    from tensorflow.keras import layers, models
+    import tensorflow  # noqa: F401
 except ImportError as e:  # pragma: no cover
     raise RuntimeError("tensorflow package not found. Add tensorflow to requirements.txt") from e
 
+from api.cache import EmbeddingCache, PredictionCache, content_hash
+from api.concurrency import LoadShedder, Overloaded
+from api.metrics import (
+    IMAGES, MODEL_LABELS, REGISTRY, REQUEST_SECONDS, REQUESTS, SHED_REQUESTS, GaugeCallback,
+)
 from api.model_config import (
-    MODEL_VERSION, MODEL_CONFIGS, GCS_BUCKET,
-    ATWATER_FAT, ATWATER_PROTEIN, ATWATER_CARBS,
+    MODEL_VERSION, MODEL_VERSIONS,
+    PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL_S, PREDICTION_CACHE_DIR,
+    EMBEDDING_CACHE_MB, REQUEST_TIMEOUT_S, KNN_INDEX_DIR, KNN_NEIGHBOURS,
 )
+from api.registry import ModelRegistry, ServedModel
+from dine.knn import KnnIndex
+from dine.preprocessing import IMAGE_SIZE, decode_image, decode_into, empty_batch
 
-BASE_DIR   = Path(__file__).resolve().parent.parent
-MODEL_DIR  = Path(os.environ.get("MODEL_DIR", BASE_DIR / "api" / "model"))
-IMAGE_SIZE = (224, 224)
-
-
-def _get_config():
-    """Return the config dict for the active MODEL_VERSION."""
-    if MODEL_VERSION not in MODEL_CONFIGS:
-        available = ", ".join(sorted(MODEL_CONFIGS.keys()))
-        raise ValueError(
-            f"Unknown MODEL_VERSION '{MODEL_VERSION}'. Available: {available}"
-        )
-    return MODEL_CONFIGS[MODEL_VERSION]
-
+_IMPORT_S = round(time.perf_counter() - _IMPORT_START, 3)
 
-def _artifact_dir() -> Path:
-    """Each version gets its own subdirectory to avoid filename clashes."""
-    return MODEL_DIR / MODEL_VERSION
+# /predict/batch limits
+MAX_BATCH_IMAGES = int(os.environ.get("MAX_BATCH_IMAGES", 512))
+BATCH_CHUNK_SIZE = int(os.environ.get("BATCH_CHUNK_SIZE", 32))   # images per model call
+DECODE_WORKERS   = int(os.environ.get("DECODE_WORKERS", os.cpu_count() or 1))
 
+# Upload reads + JPEG decode run here, off the event loop; inference is bounded
+# separately by api.concurrency.inference_slots.
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
 
-def _maybe_download_from_gcs(config: dict) -> None:
-    """Download missing artifacts from GCS for the active model version."""
-    dest_dir = _artifact_dir()
-    artifact_files = list(config["artifacts"].values())
-    missing = [f for f in artifact_files if not (dest_dir / f).exists()]
-    if not missing:
-        return
-
-    print(f"[{MODEL_VERSION}] Downloading artifacts from GCS ({missing}) …")
-    try:
-        from google.cloud import storage as gcs_lib
-    except ImportError as exc:
-        raise RuntimeError(
-            "google-cloud-storage is required to fetch model artifacts. "
-            "Add it to api/requirements.txt."
-        ) from exc
-
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    client = gcs_lib.Client()
-    bucket = client.bucket(GCS_BUCKET)
-    for filename in artifact_files:
-        blob_name = f"{config['gcs_prefix']}/{filename}"
-        dest_path = dest_dir / filename
-        print(f"  gs://{GCS_BUCKET}/{blob_name}  →  {dest_path}")
-        bucket.blob(blob_name).download_to_filename(str(dest_path))
-    print("Download complete.")
+DISCONNECT_POLL_S = 0.1     # how often a waiting request checks its client is still there
 
 
 app = FastAPI(
@@ -88,80 +70,345 @@ app.add_middleware(
 @app.on_event("startup")
 def load_model():
     """
-    Load model artifacts for the configured MODEL_VERSION.
+    Load every version in MODEL_VERSIONS (MODEL_VERSION is the default).
 
-    Supports three architecture modes:
-      legacy    — single end-to-end multitask model (v1)
-      joint     — classifier + single 3-output regressor (demo_v3–v10)
-      per_macro — classifier + 3 separate regressors (demo_v11+)
-
-    Head-only models (input_type="embeddings") also load an EfficientNetB0
-    feature extractor for the image → 1280-dim embedding step.
+    See ModelRegistry.load for the supported architecture modes and backends.
+    Every version is warmed up before this returns, so /health only reports
+    ready once requests run at steady-state latency.
     """
-    config = _get_config()
-    _maybe_download_from_gcs(config)
-
-    art_dir   = _artifact_dir()
-    artifacts = config["artifacts"]
-    mode      = config["mode"]
-
-    # --- Feature extractor (for head-only models) ---
-    if config["input_type"] == "embeddings":
-        base = EfficientNetB0(
-            weights="imagenet", include_top=False,
-            input_shape=(*IMAGE_SIZE, 3),
-        )
-        base.trainable = False
-        app.state.feature_extractor = models.Sequential(
-            [base, layers.GlobalAveragePooling2D()],
-            name="feature_extractor",
+    app.state.ready = False
+    start    = time.perf_counter()
+    registry = ModelRegistry(default_version=MODEL_VERSION)
+    for version in MODEL_VERSIONS:
+        registry.load(version)
+    app.state.registry = registry
+
+    # --- Prediction cache: repeated uploads skip decode + inference ---
+    app.state.prediction_cache = PredictionCache(
+        max_entries=PREDICTION_CACHE_SIZE,
+        ttl_s=PREDICTION_CACHE_TTL_S,
+        disk_dir=PREDICTION_CACHE_DIR,
+    )
+
+    # --- Embedding cache: head-only versions skip the backbone for seen images ---
+    app.state.embedding_cache = None
+    if registry.has_feature_extractor and EMBEDDING_CACHE_MB > 0:
+        app.state.embedding_cache = EmbeddingCache(max_bytes=int(EMBEDDING_CACHE_MB * 1024 * 1024))
+
+    # --- Similar-dish index for /similar (backbone embeddings of the labelled dataset) ---
+    app.state.knn = None
+    if KNN_INDEX_DIR:
+        app.state.knn = _load_knn(registry, KNN_INDEX_DIR)
+
+    # --- Admission: shed load with 503 instead of queueing past the client timeout ---
+    app.state.shedder = LoadShedder()
+
+    app.state.startup_s = {
+        "import":   _IMPORT_S,
+        "load":     round(time.perf_counter() - start, 3),
+        "versions": registry.startup_timings,
+    }
+    app.state.ready = True
+    print(f"Startup complete: import {_IMPORT_S:.2f}s, "
+          f"load + warmup {app.state.startup_s['load']:.2f}s")
+
+
+def _load_knn(registry: ModelRegistry, directory: str) -> KnnIndex:
+    start = time.perf_counter()
+    knn   = KnnIndex.load(directory)
+    print(f"Similar-dish index loaded ({knn.kind}, {len(knn)} images, "
+          f"{(time.perf_counter() - start) * 1000:.0f}ms)")
+    # The index only makes sense for queries embedded by the same backbone weights;
+    # /similar rejects versions on any other backbone with a 409
+    if not any(m.index_backbone == knn.backbone for m in registry.models.values()):
+        print(f"WARNING: no served version uses the index backbone ({knn.backbone}); "
+              f"/similar will reject every version")
+    return knn
+
+
+@app.on_event("shutdown")
+def stop_batcher():
+    """Drain queued requests and stop the micro-batching workers."""
+    registry = getattr(app.state, "registry", None)
+    if registry is not None:
+        registry.close()
+
+
+# Requests recorded in dine_request_seconds / dine_requests_total
+_TIMED_ENDPOINTS = {"/predict", "/predict/batch", "/predict/tensor", "/similar"}
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if request.url.path not in _TIMED_ENDPOINTS:
+        return await call_next(request)
+    start  = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status   = response.status_code
+        return response
+    finally:
+        model  = getattr(request.state, "model", None)
+        labels = model.metric_labels if model is not None else {"model_version": "", "mode": ""}
+        REQUEST_SECONDS.labels(**labels, endpoint=request.url.path).observe(time.perf_counter() - start)
+        REQUESTS.labels(**labels, endpoint=request.url.path, status=status).inc()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    if exc.labels:
+        SHED_REQUESTS.labels(**dict(zip(MODEL_LABELS, exc.labels))).inc()
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def _select_model(request: Request, version, x_model_version) -> ServedModel:
+    """Resolve the requested version (query param, then header, then default)."""
+    requested = version or x_model_version
+    try:
+        model = app.state.registry.get(requested)
+        request.state.model = model         # labels for the request metrics
+        return model
+    except KeyError:
+        served = ", ".join(app.state.registry.models)
+        raise HTTPException(
+            status_code=404,
+            detail=f"Model version '{requested}' is not served. Available: {served}",
         )
-        print(f"[{MODEL_VERSION}] Feature extractor loaded (EfficientNetB0 → GAP → 1280)")
+
+
+def _read_archive(archive_bytes: bytes) -> list:
+    """Return [(filename, bytes), ...] for every regular file in a zip or tar archive."""
+    entries = []
+    if zipfile.is_zipfile(io.BytesIO(archive_bytes)):
+        with zipfile.ZipFile(io.BytesIO(archive_bytes)) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    entries.append((info.filename, zf.read(info)))
     else:
-        app.state.feature_extractor = None
+        # tarfile raises ReadError for anything it can't open (incl. gz/bz2/xz)
+        with tarfile.open(fileobj=io.BytesIO(archive_bytes), mode="r:*") as tf_archive:
+            for member in tf_archive:
+                if member.isfile():
+                    entries.append((member.name, tf_archive.extractfile(member).read()))
 
-    # --- Load models by mode ---
-    if mode == "legacy":
-        app.state.model = tf.keras.models.load_model(
-            str(art_dir / artifacts["model"])
-        )
-    elif mode == "joint":
-        app.state.classifier = tf.keras.models.load_model(
-            str(art_dir / artifacts["classifier"])
-        )
-        app.state.regressor = tf.keras.models.load_model(
-            str(art_dir / artifacts["regressor"])
-        )
-    elif mode == "per_macro":
-        app.state.classifier = tf.keras.models.load_model(
-            str(art_dir / artifacts["classifier"])
-        )
-        app.state.regressor_fat = tf.keras.models.load_model(
-            str(art_dir / artifacts["regressor_fat"])
-        )
-        app.state.regressor_protein = tf.keras.models.load_model(
-            str(art_dir / artifacts["regressor_protein"])
-        )
-        app.state.regressor_carbs = tf.keras.models.load_model(
-            str(art_dir / artifacts["regressor_carbs"])
-        )
+    # Skip OS metadata files (e.g. macOS "__MACOSX/" and ".DS_Store")
+    return [
+        (name, data) for name, data in entries
+        if not any(part.startswith((".", "__MACOSX")) for part in Path(name).parts)
+    ]
+
+
+async def _in_pool(fn, *args):
+    """Run a blocking call (upload read, hashing, decode) on the decode pool."""
+    return await asyncio.get_running_loop().run_in_executor(_decode_pool, fn, *args)
+
+
+def _read_hashed(file) -> tuple:
+    """(bytes, content_hash) of an upload: read and hashed in one worker-thread hop."""
+    data = file.read()
+    return data, content_hash(data)
+
+
+async def _hash_all(buffers) -> list:
+    """content_hash of each buffer on the pool (hashlib releases the GIL, so in parallel)."""
+    return list(await asyncio.gather(*(_in_pool(content_hash, buffer) for buffer in buffers)))
+
+
+def _check_deadline(deadline: float) -> None:
+    if asyncio.get_running_loop().time() >= deadline:
+        raise HTTPException(status_code=504, detail="Request deadline exceeded.")
 
-    # --- Common artifacts ---
-    app.state.label_encoder = joblib.load(art_dir / artifacts["label_encoder"])
-    app.state.macro_scaler  = joblib.load(art_dir / artifacts["macro_scaler"])
-    app.state.config        = config
 
-    print(f"[{MODEL_VERSION}] Model loaded (mode={mode}, "
-          f"log={config['log_transform']}, atwater={config['atwater']})")
+async def _await_inference(request: Request, future, deadline: float, key=None):
+    """
+    Wait for a batcher future, dropping the work if the deadline passes or the
+    client disconnects (unless another request joined the same computation).
+    """
+    loop    = asyncio.get_running_loop()
+    waiter  = asyncio.wrap_future(future)
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            future.cancel()
+            raise HTTPException(status_code=504, detail="Request deadline exceeded.")
+
+        done, _ = await asyncio.wait({waiter}, timeout=min(DISCONNECT_POLL_S, remaining))
+        if done:
+            return waiter.result()
+
+        if await request.is_disconnected():
+            if key is not None and app.state.prediction_cache.has_waiters(key):
+                continue
+            future.cancel()
+            raise HTTPException(status_code=499, detail="Client closed request.")
+
+
+def _rows(buffer: np.ndarray, rows: list) -> np.ndarray:
+    """Select batch rows: a zero-copy view when they are contiguous (no decode failures)."""
+    if rows[-1] - rows[0] + 1 == len(rows):
+        return buffer[rows[0]:rows[-1] + 1]
+    return buffer[rows]
 
 
 @app.get(
     "/health",
     summary="Health check",
-    description="Simple endpoint used to verify that the API service is running.",
+    description="Returns 200 once every model version is loaded and warmed up (503 while starting), with per-phase startup timings.",
 )
 def health():
-    return {"status": "ok", "model_version": MODEL_VERSION}
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {
+        "status":         "ok",
+        "model_version":  MODEL_VERSION,
+        "model_versions": list(app.state.registry.models),
+        "startup_s":      app.state.startup_s,
+    }
+
+
+@app.post(
+    "/predict/batch",
+    summary="Predict dish and nutrition for many images",
+    description=(
+        "Accepts several food images as repeated `images` multipart fields, or one "
+        "zip/tar `archive`. Returns one result per image in input order; images that "
+        "cannot be decoded get an `error` entry instead of a prediction."
+    ),
+)
+async def predict_batch(
+    request: Request,
+    images: Optional[List[UploadFile]] = File(None, description="Food image files"),
+    archive: Optional[UploadFile] = File(None, description="Zip or tar archive of food images"),
+    version: Optional[str] = Query(None, description="Model version (default: MODEL_VERSION)"),
+    x_model_version: Optional[str] = Header(None),
+):
+    model    = _select_model(request, version, x_model_version)
+    deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_S
+
+    # ---- COLLECT INPUTS (in request order) ----
+    with model.stage("upload_read"):
+        entries = [(image.filename, await _in_pool(image.file.read)) for image in images or []]
+        if archive is not None:
+            try:
+                entries.extend(await _in_pool(lambda: _read_archive(archive.file.read())))
+            except (zipfile.BadZipFile, tarfile.TarError) as exc:
+                raise HTTPException(status_code=400, detail=f"Could not read archive: {exc}")
+
+    if not entries:
+        raise HTTPException(status_code=400, detail="No images provided.")
+    if len(entries) > MAX_BATCH_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images ({len(entries)}); limit is {MAX_BATCH_IMAGES}.",
+        )
+
+    IMAGES.labels(**model.metric_labels).inc(len(entries))
+
+    # The whole batch holds one queue slot; it is shed or admitted as a unit.
+    with app.state.shedder.admit(model.label_values):
+        return await _predict_entries(request, model, entries, deadline)
+
+
+def _lookup_cached(model: ServedModel, hashes: list, results: list):
+    """
+    Fill `results` from the prediction cache; return (embedded, pending):
+    embedding-cache hits {index: embedding} and the indices that need the full model.
+    """
+    cache     = app.state.prediction_cache
+    emb_cache = app.state.embedding_cache if model.backbone_id else None
+
+    # ---- CACHE LOOKUP (predictions, then backbone embeddings) ----
+    embedded, pending = {}, []
+    for i, img_hash in enumerate(hashes):
+        cached = cache.get(model.prediction_key(img_hash), model.label_values)
+        if cached is not None:
+            results[i].update(cached)
+            continue
+        embedding = emb_cache.get(model.embedding_key(img_hash), model.label_values) if emb_cache is not None else None
+        if embedding is not None:
+            embedded[i] = embedding
+        else:
+            pending.append(i)
+    return embedded, pending
+
+
+async def _predict_entries(request: Request, model: ServedModel, entries: list, deadline: float) -> dict:
+    """Cache lookup → parallel decode → chunked inference for /predict/batch."""
+    hashes   = await _hash_all(data for _, data in entries)
+    results  = [{"index": i, "filename": name} for i, (name, _) in enumerate(entries)]
+    embedded, pending = _lookup_cached(model, hashes, results)
+
+    # ---- DECODE IN PARALLEL (straight into one batch buffer) ----
+    buffer = empty_batch(len(pending))
+
+    def decode(row, img_bytes):
+        try:
+            with model.stage("decode"):
+                decode_into(img_bytes, buffer[row])
+            return None
+        except Exception as exc:
+            return f"Could not decode image: {exc}"
+
+    errors = await asyncio.gather(*(_in_pool(decode, row, entries[i][1]) for row, i in enumerate(pending)))
+
+    valid, rows = [], []
+    for row, (i, error) in enumerate(zip(pending, errors)):
+        if error is not None:
+            results[i]["error"] = error
+        else:
+            valid.append(i)
+            rows.append(row)
+
+    return await _infer_rows(request, model, deadline, hashes, results, buffer, rows, valid,
+                             embedded, failed=len(pending) - len(valid))
+
+
+async def _infer_rows(request: Request, model: ServedModel, deadline: float, hashes: list,
+                      results: list, buffer: np.ndarray, rows: list, valid: list,
+                      embedded: dict, failed: int = 0) -> dict:
+    """Chunked inference for batch endpoints: results[valid[j]] ← model(buffer[rows[j]])."""
+    cache     = app.state.prediction_cache
+    emb_cache = app.state.embedding_cache if model.backbone_id else None
+
+    def store(indices, outputs):
+        for i, prediction in zip(indices, model.postprocess(*outputs[:2])):
+            cache.put(model.prediction_key(hashes[i]), prediction, model.label_values)
+            results[i].update(prediction)
+
+    async def next_chunk():
+        # Between chunks: give up if the client left or the deadline passed.
+        _check_deadline(deadline)
+        if await request.is_disconnected():
+            raise HTTPException(status_code=499, detail="Client closed request.")
+
+    # ---- INFERENCE (whole batch, in bounded chunks) ----
+    for start in range(0, len(valid), BATCH_CHUNK_SIZE):
+        await next_chunk()
+        chunk   = valid[start:start + BATCH_CHUNK_SIZE]
+        outputs = await run_in_threadpool(model.run_models, _rows(buffer, rows[start:start + BATCH_CHUNK_SIZE]))
+        if emb_cache is not None:
+            for i, embedding in zip(chunk, outputs[2]):
+                emb_cache.put(model.embedding_key(hashes[i]), embedding)
+        store(chunk, outputs)
+
+    # ---- HEADS ONLY (embedding cache hits) ----
+    hits = list(embedded)
+    for start in range(0, len(hits), BATCH_CHUNK_SIZE):
+        await next_chunk()
+        chunk = hits[start:start + BATCH_CHUNK_SIZE]
+        store(chunk, await run_in_threadpool(model.run_heads, np.stack([embedded[i] for i in chunk])))
+
+    return {
+        "model_version": model.version,
+        "count":         len(results),
+        "failed":        failed,
+        "results":       results,
+    }
 
 
 @app.post(
@@ -172,87 +419,311 @@ def health():
         "Returns the predicted dish, confidence score, and estimated nutrition values."
     ),
 )
-def predict(
+async def predict(
+    request: Request,
     image: UploadFile = File(..., description="Food image file"),
+    version: Optional[str] = Query(None, description="Model version (default: MODEL_VERSION)"),
+    x_model_version: Optional[str] = Header(None),
 ):
-    config = app.state.config
-    mode   = config["mode"]
+    model     = _select_model(request, version, x_model_version)
+    deadline  = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_S
+    with model.stage("upload_read"):
+        img_bytes, img_hash = await _in_pool(_read_hashed, image.file)
+    IMAGES.labels(**model.metric_labels).inc()
+    key       = model.prediction_key(img_hash)
+
+    # ---- CACHE (identical uploads share one computation) ----
+    return await app.state.prediction_cache.get_or_compute_async(
+        key, lambda: _predict_bytes(request, model, img_bytes, img_hash, deadline, key),
+        model.label_values,
+    )
+
+
+def _decode(model: ServedModel, img_bytes: bytes) -> np.ndarray:
+    with model.stage("decode"):
+        return decode_image(img_bytes)
+
+
+async def _predict_bytes(request: Request, model: ServedModel, img_bytes: bytes,
+                         img_hash: str, deadline: float, key) -> dict:
+    """Full single-image path: decode → micro-batched inference → response dict."""
+    with app.state.shedder.admit(model.label_values):
+        return await _predict_admitted(request, model, img_bytes, img_hash, deadline, key)
+
+
+async def _predict_admitted(request, model, image, img_hash, deadline, key) -> dict:
+    """`image` is upload bytes to decode, or an already decoded (224, 224, 3) array."""
+    emb_cache = app.state.embedding_cache if model.backbone_id else None
+
+    # ---- EMBEDDING CACHE (head-only: skip decode + backbone) ----
+    if emb_cache is not None:
+        embedding = emb_cache.get(model.embedding_key(img_hash), model.label_values)
+        if embedding is not None:
+            outputs = await run_in_threadpool(model.run_heads, embedding[None])
+            return model.postprocess(*outputs)[0]
+
+    # ---- PREPROCESS IMAGE ----
+    if isinstance(image, np.ndarray):
+        img_array = image
+    else:
+        try:
+            img_array = await _in_pool(_decode, model, image)     # (224, 224, 3)
+        except Exception as exc:
+            raise HTTPException(status_code=400, detail=f"Could not decode image: {exc}")
+        _check_deadline(deadline)
+
+    # ---- INFERENCE (micro-batched with concurrent requests) ----
+    future  = model.batcher.submit(img_array)
+    outputs = await _await_inference(request, future, deadline, key)
+    if emb_cache is not None:
+        emb_cache.put(model.embedding_key(img_hash), outputs[2])
+
+    label_probs, macros_scaled = outputs[:2]
+    return model.postprocess(label_probs[None], macros_scaled[None])[0]
+
+
+@app.post(
+    "/similar",
+    summary="Most similar labelled dataset images",
+    description=(
+        "Embeds the image with a head-only model's backbone and returns the `k` closest "
+        "labelled training images (dish and nutrition), plus a fallback estimate from their "
+        "similarity-weighted vote and mean. Needs an index built with `dine knn` (KNN_INDEX_DIR)."
+    ),
+)
+async def similar(
+    request: Request,
+    image: UploadFile = File(..., description="Food image file"),
+    k: int = Query(KNN_NEIGHBOURS, ge=1, le=100, description="Number of neighbours"),
+    version: Optional[str] = Query(None, description="Model version (default: MODEL_VERSION)"),
+    x_model_version: Optional[str] = Header(None),
+):
+    knn = getattr(app.state, "knn", None)
+    if knn is None:
+        raise HTTPException(status_code=404, detail="No similar-dish index loaded (set KNN_INDEX_DIR).")
+    model = _select_model(request, version, x_model_version)
+    if model.feature_extractor is None:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Model version '{model.version}' is end-to-end; /similar needs a head-only version.",
+        )
+    if model.index_backbone != knn.backbone:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Model version '{model.version}' embeds with {model.index_backbone}; "
+                   f"the similar-dish index was built with {knn.backbone}.",
+        )
+
+    deadline  = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_S
+    with model.stage("upload_read"):
+        img_bytes, img_hash = await _in_pool(_read_hashed, image.file)
+    IMAGES.labels(**model.metric_labels).inc()
+
+    with app.state.shedder.admit(model.label_values):
+        embedding = await _embed(request, model, img_bytes, img_hash, deadline)
+
+    with model.stage("neighbour_search"):
+        similarities, rows = knn.search(embedding, k)      # one search for both
+    return {
+        "model_version": model.version,
+        "neighbours":    knn.neighbours_from(similarities[0], rows[0]),
+        "estimate":      knn.estimate_from(similarities[0], rows[0]),
+    }
+
+
+async def _embed(request: Request, model: ServedModel, img_bytes: bytes,
+                 img_hash: str, deadline: float) -> np.ndarray:
+    """Backbone embedding of one image: embedding cache, else decode + micro-batched models."""
+    emb_cache = app.state.embedding_cache
+    if emb_cache is not None:
+        embedding = emb_cache.get(model.embedding_key(img_hash), model.label_values)
+        if embedding is not None:
+            return embedding
 
-    # ---- READ & PREPROCESS IMAGE ----
     try:
-        img_bytes = image.file.read()
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB").resize(IMAGE_SIZE)
-        img_array = preprocess_input(np.array(img, dtype=np.float32))
-        img_batch = np.expand_dims(img_array, axis=0)             # (1, 224, 224, 3)
+        img_array = await _in_pool(_decode, model, img_bytes)
     except Exception as exc:
         raise HTTPException(status_code=400, detail=f"Could not decode image: {exc}")
+    _check_deadline(deadline)
 
-    # ---- EXTRACT FEATURES (head-only models) ----
-    if app.state.feature_extractor is not None:
-        model_input = app.state.feature_extractor.predict(img_batch, verbose=0)
-    else:
-        model_input = img_batch
-
-    # ---- CLASSIFICATION ----
-    if mode == "legacy":
-        preds       = app.state.model.predict(model_input, verbose=0)
-        label_probs = preds["label"][0]
-    elif mode == "joint":
-        label_probs = app.state.classifier.predict(model_input, verbose=0)[0]
-    else:  # per_macro
-        label_probs = app.state.classifier.predict(model_input, verbose=0)[0]
-
-    class_idx  = int(np.argmax(label_probs))
-    confidence = round(float(label_probs[class_idx]), 3)
-    dish       = app.state.label_encoder.classes_[class_idx]
-
-    # ---- REGRESSION ----
-    if mode == "legacy":
-        # Legacy model: named outputs, scaler has 4 cols [fat, protein, cal, carbs]
-        macros_scaled = np.array([[
-            preds["fat_g"][0, 0],
-            preds["protein_g"][0, 0],
-            preds["calories_kcal"][0, 0],
-            preds["carbohydrate_g"][0, 0],
-        ]], dtype=np.float32)
-        macros_raw = app.state.macro_scaler.inverse_transform(macros_scaled)[0]
-        fat_g, protein_g, calories_kcal, carbs_g = macros_raw
+    outputs = await _await_inference(request, model.batcher.submit(img_array), deadline)
+    if emb_cache is not None:
+        emb_cache.put(model.embedding_key(img_hash), outputs[2])
+    return outputs[2]
+
+
+# -- Tensor input ----------------------------------------------------------------
+# Clients that already hold the model input (batch workers, the edge app) send
+# uint8 pixels instead of a JPEG: no encode on their side, no decode on ours.
+
+TENSOR_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)     # (height, width, channels)
+_NPY_HEADERS = {
+    (1, 0): np.lib.format.read_array_header_1_0,
+    (2, 0): np.lib.format.read_array_header_2_0,
+}
 
+
+def _parse_tensor(body: bytes, shape_header: Optional[str]) -> np.ndarray:
+    """
+    Read a (224, 224, 3) or (N, 224, 224, 3) uint8 body, NPY or raw with a declared
+    shape, as a read-only view of the request bytes (no copy).
+    """
+    offset = 0
+    if body[:6] == b"\x93NUMPY":
+        stream = io.BytesIO(body)
+        try:
+            reader = _NPY_HEADERS.get(np.lib.format.read_magic(stream))
+            if reader is None:
+                raise ValueError("unsupported NPY format version")
+            shape, fortran_order, dtype = reader(stream)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=f"Could not read NPY header: {exc}")
+        if fortran_order:
+            raise HTTPException(status_code=400, detail="Fortran-ordered arrays are not supported.")
+        offset = stream.tell()
+    elif shape_header:
+        try:
+            shape = tuple(int(dim) for dim in shape_header.split(","))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid X-Tensor-Shape '{shape_header}'.")
+        dtype = np.dtype(np.uint8)
     else:
-        # joint / per_macro: scaler has 3 cols [fat, protein, carbs]
-        if mode == "joint":
-            macros_scaled = app.state.regressor.predict(model_input, verbose=0)
-        else:  # per_macro
-            pred_fat  = app.state.regressor_fat.predict(model_input, verbose=0)
-            pred_prot = app.state.regressor_protein.predict(model_input, verbose=0)
-            pred_carb = app.state.regressor_carbs.predict(model_input, verbose=0)
-            macros_scaled = np.hstack([pred_fat, pred_prot, pred_carb])
-
-        # Inverse transform: scaler → (optional exp) → raw
-        macros = app.state.macro_scaler.inverse_transform(macros_scaled)
-        if config["log_transform"]:
-            macros = np.expm1(macros)       # exp(y) - 1
-        macros = np.maximum(macros, 0.0)
-
-        fat_g, protein_g, carbs_g = macros[0]
-
-        if config["atwater"]:
-            calories_kcal = (ATWATER_FAT * fat_g
-                           + ATWATER_PROTEIN * protein_g
-                           + ATWATER_CARBS * carbs_g)
-        else:
-            calories_kcal = 0.0             # shouldn't happen for supported versions
+        raise HTTPException(
+            status_code=400,
+            detail="Send an NPY body, or raw uint8 bytes with an X-Tensor-Shape header (e.g. 224,224,3).",
+        )
+
+    if dtype != np.uint8:
+        raise HTTPException(status_code=400, detail=f"Expected uint8 pixels, got {dtype}.")
+    if len(shape) not in (3, 4) or tuple(shape[-3:]) != TENSOR_SHAPE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Expected shape {TENSOR_SHAPE} or (N, *{TENSOR_SHAPE}), got {tuple(shape)}.",
+        )
+    count = int(np.prod(shape))
+    if len(body) - offset != count:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Body has {len(body) - offset} bytes of pixels, shape {tuple(shape)} needs {count}.",
+        )
+    return np.frombuffer(body, dtype=np.uint8, count=count, offset=offset).reshape(shape)
+
+
+@app.post(
+    "/predict/tensor",
+    summary="Predict from already decoded pixels",
+    description=(
+        "Body: uint8 RGB pixels of shape (224, 224, 3) for one image or (N, 224, 224, 3) "
+        "for a batch, as an NPY file (`np.save`) or raw bytes with an `X-Tensor-Shape: "
+        "224,224,3` header. One image returns the /predict response; a batch returns "
+        "the /predict/batch response."
+    ),
+)
+async def predict_tensor(
+    request: Request,
+    version: Optional[str] = Query(None, description="Model version (default: MODEL_VERSION)"),
+    x_model_version: Optional[str] = Header(None),
+    x_tensor_shape: Optional[str] = Header(None),
+):
+    model    = _select_model(request, version, x_model_version)
+    deadline = asyncio.get_running_loop().time() + REQUEST_TIMEOUT_S
+    with model.stage("upload_read"):
+        body = await request.body()
+    pixels = _parse_tensor(body, x_tensor_shape)
+
+    # ---- ONE IMAGE: same path as /predict, minus the decode ----
+    if pixels.ndim == 3:
+        IMAGES.labels(**model.metric_labels).inc()
+        img_hash = await _in_pool(content_hash, pixels.data)
+        key      = model.prediction_key(img_hash)
+
+        async def compute():
+            with app.state.shedder.admit(model.label_values):
+                return await _predict_admitted(request, model, pixels, img_hash, deadline, key)
+
+        return await app.state.prediction_cache.get_or_compute_async(key, compute, model.label_values)
+
+    # ---- BATCH: same path as /predict/batch, rows are views of the body ----
+    if not len(pixels):
+        raise HTTPException(status_code=400, detail="No images provided.")
+    if len(pixels) > MAX_BATCH_IMAGES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images ({len(pixels)}); limit is {MAX_BATCH_IMAGES}.",
+        )
+    IMAGES.labels(**model.metric_labels).inc(len(pixels))
+
+    with app.state.shedder.admit(model.label_values):
+        hashes  = await _hash_all(row.data for row in pixels)
+        results = [{"index": i} for i in range(len(pixels))]
+        embedded, pending = _lookup_cached(model, hashes, results)
+        return await _infer_rows(request, model, deadline, hashes, results,
+                                 pixels, pending, pending, embedded)
 
-    nutrition = {
-        "calories":  int(round(float(calories_kcal))),
-        "protein_g": round(float(protein_g), 1),
-        "carbs_g":   round(float(carbs_g), 1),
-        "fat_g":     round(float(fat_g), 1),
-    }
 
+@app.get(
+    "/cache/stats",
+    summary="Cache statistics",
+    description="Hit rates and sizes of the prediction and embedding caches, for sizing them.",
+)
+def cache_stats():
     return {
-        "dish":          dish,
-        "confidence":    confidence,
-        "nutrition":     nutrition,
-        "model_version": MODEL_VERSION,
+        "model_versions": list(app.state.registry.models),
+        "prediction":    app.state.prediction_cache.stats(),
+        "admission":     app.state.shedder.stats(),
+        "embedding":     (app.state.embedding_cache.stats()
+                          if app.state.embedding_cache is not None else None),
     }
+
+
+# -- Metrics --------------------------------------------------------------------
+# Gauges read at scrape time from the objects that own the numbers.
+
+def _per_model(value):
+    registry = getattr(app.state, "registry", None)
+    if registry is None:
+        return []
+    return [((m.version, m.config["mode"]), value(m)) for m in registry.models.values()]
+
+
+def _caches(stat):
+    """Rows per cache and served version, except embedding cache entries (shared)."""
+    rows = []
+    for name in ("prediction", "embedding"):
+        cache = getattr(app.state, f"{name}_cache", None)
+        if cache is None:
+            continue
+        if name == "embedding" and stat == "size":
+            # Every head-only version on the backbone reads the same entries
+            rows.append(((name, "", ""), cache.stats()["size"]))
+            continue
+        rows.extend(((name, *labels), stats[stat])
+                    for labels, stats in cache.stats_by_labels().items())
+    return rows
+
+
+def _admission(key):
+    shedder = getattr(app.state, "shedder", None)
+    if shedder is None:
+        return []
+    return [(labels, stats[key]) for labels, stats in shedder.stats_by_labels().items()]
+
+
+GaugeCallback("dine_queue_depth", "Images waiting for a micro-batch.",
+              MODEL_LABELS, fn=lambda: _per_model(lambda m: m.batcher.queue_depth))
+GaugeCallback("dine_in_flight_requests", "Requests admitted to decode + inference.",
+              MODEL_LABELS, fn=lambda: _admission("pending"))
+GaugeCallback("dine_cache_hit_ratio", "Cache hits / lookups since startup.",
+              ("cache",) + MODEL_LABELS, fn=lambda: _caches("hit_rate"))
+GaugeCallback("dine_cache_entries", "Entries currently cached.",
+              ("cache",) + MODEL_LABELS, fn=lambda: _caches("size"))
+
+
+@app.get(
+    "/metrics",
+    summary="Prometheus metrics",
+    description="Per-stage latency histograms, batch sizes, queue depth, cache hit ratios and RSS.",
+    response_class=PlainTextResponse,
+)
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
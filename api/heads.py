@@ -0,0 +1,94 @@
+"""
+Fused head graphs.
+
+Each architecture mode ships its heads as separate .keras files. Calling them
+one by one costs a full Keras predict() round trip per head, which dominates
+latency for the small head-only models. fuse_heads() wires them into a single
+multi-output model that shares one input, so every mode runs as one call
+returning (label_probs, macros_scaled).
+"""
+
+import numpy as np
+from tensorflow.keras import layers, models
+
+# Artifact keys holding the Keras models for each mode, in output order.
+HEAD_KEYS = {
+    "legacy":    ("model",),
+    "joint":     ("classifier", "regressor"),
+    "per_macro": ("classifier", "regressor_fat", "regressor_protein", "regressor_carbs"),
+}
+
+# Legacy multitask outputs, in the 4-column scaler order [fat, protein, cal, carbs].
+LEGACY_MACRO_OUTPUTS = ("fat_g", "protein_g", "calories_kcal", "carbohydrate_g")
+
+
+def fuse_heads(mode: str, head_models: dict) -> models.Model:
+    """
+    Build one model with outputs [label_probs, macros_scaled] for `mode`.
+
+    The fused model reuses the loaded layers (no weight copies), so it adds
+    no memory on top of the separate models.
+    """
+    first  = head_models[HEAD_KEYS[mode][0]]
+    inputs = layers.Input(shape=first.input_shape[1:], name="model_input")
+
+    if mode == "legacy":
+        preds       = head_models["model"](inputs)
+        label_probs = preds["label"]
+        macros      = [preds[name] for name in LEGACY_MACRO_OUTPUTS]
+    elif mode == "joint":
+        label_probs = head_models["classifier"](inputs)
+        macros      = [head_models["regressor"](inputs)]
+    else:  # per_macro
+        label_probs = head_models["classifier"](inputs)
+        macros      = [head_models[key](inputs) for key in HEAD_KEYS[mode][1:]]
+
+    macros_scaled = (layers.Concatenate(name="macros_scaled")(macros)
+                     if len(macros) > 1 else macros[0])
+    return models.Model(inputs, [label_probs, macros_scaled], name=f"fused_{mode}")
+
+
+def run_separately(mode: str, head_models: dict, model_input: np.ndarray):
+    """Reference path: one predict() per head, as served before fusion."""
+    if mode == "legacy":
+        preds         = head_models["model"].predict(model_input, verbose=0)
+        label_probs   = preds["label"]
+        macros_scaled = np.hstack([preds[name] for name in LEGACY_MACRO_OUTPUTS])
+    elif mode == "joint":
+        label_probs   = head_models["classifier"].predict(model_input, verbose=0)
+        macros_scaled = head_models["regressor"].predict(model_input, verbose=0)
+    else:  # per_macro
+        label_probs   = head_models["classifier"].predict(model_input, verbose=0)
+        macros_scaled = np.hstack([
+            head_models[key].predict(model_input, verbose=0)
+            for key in HEAD_KEYS[mode][1:]
+        ])
+    return label_probs, macros_scaled
+
+
+def validate_fused(fused: models.Model, mode: str, head_models: dict,
+                   batch_size: int = 4, atol: float = 1e-4, seed: int = 0) -> float:
+    """
+    Check the fused model against the separate heads on a random batch.
+
+    Returns the max absolute difference; raises ValueError if it exceeds `atol`.
+    """
+    rng = np.random.default_rng(seed)
+    shape = (batch_size, *fused.input_shape[1:])
+    if len(shape) == 4:     # image input: raw pixel range
+        sample = rng.uniform(0.0, 255.0, size=shape).astype(np.float32)
+    else:                   # embeddings: non-negative GAP activations
+        sample = np.abs(rng.normal(size=shape)).astype(np.float32)
+
+    fused_out = fused.predict(sample, verbose=0)
+    ref_out   = run_separately(mode, head_models, sample)
+
+    max_diff = max(
+        float(np.max(np.abs(np.asarray(got) - np.asarray(want))))
+        for got, want in zip(fused_out, ref_out)
+    )
+    if max_diff > atol:
+        raise ValueError(
+            f"Fused {mode} heads differ from separate models by {max_diff:.2e} (atol={atol})"
+        )
+    return max_diff
@@ -0,0 +1,99 @@
+"""
+Inference runners: a uniform callable interface over a Keras model.
+
+    runner(batch: np.ndarray) -> tuple[np.ndarray, ...]   # one array per model output
+
+PredictRunner is the plain `model.predict(..., verbose=0)` path. It pays for
+a data adapter, callback setup and possible retracing on every call.
+
+CompiledRunner traces the model once per bucketed batch size into a
+`tf.function` with a fixed input signature (optionally XLA-compiled). Each
+call pads the batch up to the nearest bucket, so shapes never change and
+nothing is retraced after startup.
+"""
+
+import numpy as np
+import tensorflow as tf
+
+from api.model_config import INFERENCE_BUCKETS, INFERENCE_RUNNER, INFERENCE_XLA
+
+
+def _as_tuple(outputs) -> tuple:
+    # float32 whatever the compute precision (mixed-precision models emit bf16/fp16)
+    return tuple(np.asarray(out, dtype=np.float32) for out in tf.nest.flatten(outputs))
+
+
+def bucket_for(n: int, buckets) -> int:
+    """Smallest bucket that holds `n` rows (the largest one if none does)."""
+    for size in buckets:
+        if size >= n:
+            return size
+    return buckets[-1]
+
+
+def run_bucketed(batch: np.ndarray, buckets, call) -> tuple:
+    """
+    Pad `batch` up to a bucket size (chunking by the largest bucket) and run
+    `call(padded) -> tuple of arrays`, so a graph only ever sees `buckets` shapes.
+    """
+    batch   = np.asarray(batch, dtype=np.float32)
+    largest = buckets[-1]
+    chunks  = []
+    for start in range(0, len(batch), largest):
+        chunk = batch[start:start + largest]
+        n     = len(chunk)
+        size  = bucket_for(n, buckets)
+        if size > n:
+            pad   = np.zeros((size - n, *batch.shape[1:]), dtype=np.float32)
+            chunk = np.concatenate([chunk, pad])
+        chunks.append(tuple(out[:n] for out in call(chunk)))
+
+    if len(chunks) == 1:
+        return chunks[0]
+    return tuple(np.concatenate(parts) for parts in zip(*chunks))
+
+
+class PredictRunner:
+    """Run a model through Keras `predict()` (the pre-compiled-runner behaviour)."""
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, batch: np.ndarray) -> tuple:
+        return _as_tuple(self.model.predict(batch, verbose=0))
+
+
+class CompiledRunner:
+    """Run a model through one traced `tf.function` per batch-size bucket."""
+
+    def __init__(self, model, buckets=INFERENCE_BUCKETS, jit_compile=INFERENCE_XLA):
+        self.model       = model
+        self.buckets     = tuple(sorted(set(int(b) for b in buckets)))
+        self.jit_compile = bool(jit_compile)
+        self.input_shape = tuple(model.input_shape[1:])
+
+        def forward(x):
+            return model(x, training=False)
+
+        # Trace every bucket now so no request pays for graph construction.
+        self._functions = {}
+        for size in self.buckets:
+            signature = [tf.TensorSpec((size, *self.input_shape), tf.float32)]
+            fn = tf.function(forward, input_signature=signature,
+                             jit_compile=self.jit_compile)
+            self._functions[size] = fn.get_concrete_function()
+
+    def __call__(self, batch: np.ndarray) -> tuple:
+        return run_bucketed(
+            batch, self.buckets,
+            lambda chunk: _as_tuple(self._functions[len(chunk)](tf.constant(chunk))),
+        )
+
+
+def make_runner(model, kind: str = INFERENCE_RUNNER, **kwargs):
+    """Wrap `model` in the runner selected by `kind` ("compiled" | "predict")."""
+    if kind == "compiled":
+        return CompiledRunner(model, **kwargs)
+    if kind == "predict":
+        return PredictRunner(model)
+    raise ValueError(f"Unknown inference runner '{kind}'. Use 'compiled' or 'predict'.")
@@ -0,0 +1,244 @@
+"""
+In-process metrics in Prometheus text format (served at /metrics, no collector needed).
+
+Recording is a dict lookup done once per label set, then a lock + bisect per
+observation; children are cached by the caller (see ServedModel.stage) so the
+hot path never formats labels.
+
+    STAGE_SECONDS  — histogram per pipeline stage, labelled model_version/mode/stage
+    BATCH_SIZE     — images per model call
+    REQUEST_SECONDS / REQUESTS — end-to-end latency and throughput per endpoint
+    SHED_REQUESTS  — requests answered 503 by load shedding
+
+Values that already live elsewhere (queue depth, cache hit ratios, RSS) are
+read at scrape time through `GaugeCallback`.
+"""
+
+import bisect
+import os
+import resource
+import sys
+import threading
+import time
+
+# Latency buckets (seconds) from sub-millisecond decode up to the 60 s client timeout.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BATCH_BUCKETS   = (1, 2, 4, 8, 16, 32, 64)
+
+STAGES = ("upload_read", "decode", "feature_extraction", "heads", "postprocess",
+          "neighbour_search")
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in exposition format 0.0.4."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+# -- Metric types ---------------------------------------------------------------
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=REGISTRY):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple(labelnames)
+        self._children  = {}
+        self._lock      = threading.Lock()
+        registry.register(self)
+
+    def labels(self, **labels):
+        """Child for one label set; cache it if you record from a hot path."""
+        key   = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def samples(self):
+        for key, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"
+
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)     # last slot: +Inf
+        self.sum    = 0.0
+        self._lock  = threading.Lock()
+
+    def observe(self, value) -> None:
+        index = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        """Context manager that observes the block's duration in seconds."""
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def samples(self):
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class GaugeCallback(_Metric):
+    """
+    Gauge read at scrape time: `fn()` returns [(label_values_tuple, value), ...].
+
+    For values owned by other objects (queue lengths, cache stats, RSS), so
+    nothing is recorded on the request path at all.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn=None, registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.fn = fn
+
+    def samples(self):
+        if self.fn is None:
+            return
+        for key, value in self.fn():
+            if value is not None:
+                yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+# -- Process --------------------------------------------------------------------
+
+def resident_memory_bytes() -> int:
+    """Current RSS (Linux /proc), else peak RSS from getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# -- Serving metrics ------------------------------------------------------------
+
+MODEL_LABELS = ("model_version", "mode")
+
+STAGE_SECONDS = Histogram(
+    "dine_stage_seconds", "Time spent in each pipeline stage.",
+    MODEL_LABELS + ("stage",),
+)
+BATCH_SIZE = Histogram(
+    "dine_batch_size", "Images per model call (micro-batches and /predict/batch chunks).",
+    MODEL_LABELS, buckets=BATCH_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "dine_request_seconds", "End-to-end request latency.",
+    MODEL_LABELS + ("endpoint",),
+)
+REQUESTS = Counter(
+    "dine_requests_total", "Requests served, by response status.",
+    MODEL_LABELS + ("endpoint", "status"),
+)
+IMAGES = Counter(
+    "dine_images_total", "Images scored (cache hits included).",
+    MODEL_LABELS,
+)
+SHED_REQUESTS = Counter(
+    "dine_shed_requests_total", "Requests rejected with 503 by load shedding.",
+    MODEL_LABELS,
+)
+PROCESS_RSS = GaugeCallback(
+    "process_resident_memory_bytes", "Resident memory of this process.",
+    fn=lambda: [((), resident_memory_bytes())],
+)
@@ -3,6 +3,7 @@ Model version configuration for the Dine API.
 
 Change MODEL_VERSION to switch which model the API loads.
 Override via env var: MODEL_VERSION=demo_v11.0
+Serve more versions side by side: MODEL_VERSIONS=demo_v11.0,demo_v12.0
 
 Each config specifies:
   gcs_prefix:     path under gs://mmfood/ for artifact download
@@ -14,9 +15,18 @@ Each config specifies:
   log_transform:  whether regression targets use log(1+y) transform
   atwater:        whether calories are derived via Atwater (True) or predicted directly (False)
   artifacts:      dict mapping artifact keys to filenames in GCS
+  max_batch_size: most concurrent /predict requests run through the model as one batch
+  max_wait_ms:    how long the first queued request waits for others to join its batch
+  backend:        "keras" | "saved_model" | "tflite" | "onnxruntime"
+                  (non-Keras graphs come from `python -m api.export`)
+  quantization:   None | "dynamic" | "int8" — which exported graph a non-Keras backend loads
+  precision:      "float32" | "bfloat16" | "float16" — keras backend compute precision
+                  (float32 on CPUs without native support; see api/precision.py)
+  jit_compile:    XLA-compile the traced backbone / fused-head graphs (keras backend)
 """
 
 import os
+from pathlib import Path
 
 # =====================================================================
 #  Model version — set via Cloud Build substitution variable _MODEL_VERSION
@@ -25,6 +35,13 @@ import os
 # =====================================================================
 MODEL_VERSION = os.environ.get("MODEL_VERSION", "demo_v11.0")
 
+# Extra versions served from the same process (comma-separated), selectable per
+# request with ?version= or X-Model-Version. MODEL_VERSION stays the default.
+MODEL_VERSIONS = list(dict.fromkeys(
+    [MODEL_VERSION]
+    + [v.strip() for v in os.environ.get("MODEL_VERSIONS", "").split(",") if v.strip()]
+))
+
 # Atwater conversion factors: cal = 9*fat + 4*protein + 4*carbs
 ATWATER_FAT     = 9.0
 ATWATER_PROTEIN = 4.0
@@ -33,6 +50,69 @@ ATWATER_CARBS   = 4.0
 # GCS bucket
 GCS_BUCKET = os.environ.get("GCS_BUCKET", "mmfood")
 
+# Where artifacts are downloaded from: gs://<bucket> or a local mirror (file:///path).
+# ARTIFACT_CACHE_DIR keeps one verified copy per host, shared by containers/processes
+# that mount it; each version directory gets hard links.
+ARTIFACT_STORE            = os.environ.get("ARTIFACT_STORE", f"gs://{GCS_BUCKET}")
+ARTIFACT_CACHE_DIR        = os.environ.get("ARTIFACT_CACHE_DIR")
+ARTIFACT_DOWNLOAD_WORKERS = int(os.environ.get("ARTIFACT_DOWNLOAD_WORKERS", 8))
+# Offline dev: never contact the store, serve whatever artifacts are on disk unverified
+ARTIFACT_OFFLINE          = os.environ.get("ARTIFACT_OFFLINE", "0") == "1"
+
+# Prediction cache keyed by hash(upload bytes) + MODEL_VERSION.
+# Size 0 disables the memory tier; set PREDICTION_CACHE_DIR to add a disk tier.
+PREDICTION_CACHE_SIZE  = int(os.environ.get("PREDICTION_CACHE_SIZE", 1024))
+PREDICTION_CACHE_TTL_S = float(os.environ.get("PREDICTION_CACHE_TTL_S", 3600))
+PREDICTION_CACHE_DIR   = os.environ.get("PREDICTION_CACHE_DIR")
+
+# Backbone embedding cache (head-only versions), float16, shared across head versions.
+EMBEDDING_CACHE_MB = float(os.environ.get("EMBEDDING_CACHE_MB", 64))
+
+# Request admission: model calls running at once (0 = one per available CPU),
+# requests allowed to wait before shedding with 503, and per-request deadline.
+INFERENCE_CONCURRENCY = int(os.environ.get("INFERENCE_CONCURRENCY", 0))
+MAX_QUEUE_DEPTH       = int(os.environ.get("MAX_QUEUE_DEPTH", 32))
+REQUEST_TIMEOUT_S     = float(os.environ.get("REQUEST_TIMEOUT_S", 55))    # frontend gives up at 60 s
+
+# Pre-fork server (`python -m api.serve`): worker processes (0 = as many as both the
+# usable CPUs and the memory limit allow, see SERVE_WORKER_MEMORY_MB), TensorFlow
+# intra-op threads per worker (0 = the worker's share of those CPUs), inter-op threads,
+# and whether each worker is pinned to its own cores. Workers do not share model
+# weights, so each one needs memory for a full copy of every served version.
+SERVE_WORKERS          = int(os.environ.get("SERVE_WORKERS", 1))
+SERVE_WORKER_MEMORY_MB = int(os.environ.get("SERVE_WORKER_MEMORY_MB", 1280))   # per worker, for SERVE_WORKERS=0
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", 0))
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", 2))
+SERVE_PIN_CPUS      = os.environ.get("SERVE_PIN_CPUS", "1") == "1"
+
+# Similar-dish index served at /similar (built with `dine knn`); unset disables it.
+KNN_INDEX_DIR  = os.environ.get("KNN_INDEX_DIR")
+KNN_NEIGHBOURS = int(os.environ.get("KNN_NEIGHBOURS", 5))
+
+# Local artifact root; each version gets its own subdirectory
+BASE_DIR  = Path(__file__).resolve().parent.parent
+MODEL_DIR = Path(os.environ.get("MODEL_DIR", BASE_DIR / "api" / "model"))
+
+# Inference runner: "compiled" (tf.function per bucketed batch size, traced at
+# startup) or "predict" (plain Keras model.predict). Switch to compare latency.
+INFERENCE_RUNNER  = os.environ.get("INFERENCE_RUNNER", "compiled")
+INFERENCE_XLA     = os.environ.get("INFERENCE_XLA", "0") == "1"
+INFERENCE_BUCKETS = tuple(
+    int(size) for size in os.environ.get("INFERENCE_BUCKETS", "1,2,4,8,16,32").split(",")
+)
+
+# Default compute precision of keras-backend versions, and how far (grams, or kcal
+# for calories) reduced-precision macros may drift from float32 in the load-time
+# check before the version is refused.
+INFERENCE_PRECISION   = os.environ.get("INFERENCE_PRECISION", "float32")
+PRECISION_MAX_DRIFT_G = float(os.environ.get("PRECISION_MAX_DRIFT_G", 1.0))
+
+# Batch sizes pushed through every loaded model at startup, before /health
+# reports ready, so no request pays first-execution graph optimization.
+# Empty disables warmup.
+_WARMUP            = os.environ.get("WARMUP_BATCH_SIZES", ",".join(map(str, INFERENCE_BUCKETS)))
+WARMUP_BATCH_SIZES = tuple(int(size) for size in _WARMUP.split(",") if size.strip())
+
 
 # -- Helper builders (reduce boilerplate) ------------------------------------
 
@@ -41,6 +121,24 @@ _COMMON_ARTIFACTS = {
     "macro_scaler":  "macro_scaler.pkl",
 }
 
+# Versioned EfficientNetB0 (ImageNet) → GAP weights for head-only models, stored
+# next to the heads so startup never downloads from the network.
+# Written by `python -m api.export <version> --backend keras`. Optional: prefixes
+# without it fall back to Keras' ImageNet download (api.backends.optional_artifacts).
+BACKBONE_WEIGHTS = "efficientnetb0_gap.imagenet-v1.weights.h5"
+
+_SERVING = {
+    # Micro-batching: raise max_wait_ms for throughput, lower it for p50 latency.
+    "max_batch_size": 8,
+    "max_wait_ms":    5.0,
+    # Inference backend
+    "backend":        "keras",
+    "quantization":   None,
+    # Numerics (keras backend): reduced-precision compute and XLA
+    "precision":      INFERENCE_PRECISION,
+    "jit_compile":    INFERENCE_XLA,
+}
+
 def _joint(version, log_transform):
     """Config for classifier + single 3-output regressor."""
     return {
@@ -50,14 +148,17 @@ def _joint(version, log_transform):
         "log_transform": log_transform,
         "atwater":       True,
         "artifacts":     {
-            "classifier": "classifier.keras",
-            "regressor":  "regressor.keras",
+            "classifier":        "classifier.keras",
+            "regressor":         "regressor.keras",
+            "feature_extractor": BACKBONE_WEIGHTS,
             **_COMMON_ARTIFACTS,
         },
+        **_SERVING,
     }
 
 def _per_macro(version, log_transform, *, input_type="embeddings", prefix=""):
     """Config for classifier + 3 separate single-output regressors."""
+    backbone = {"feature_extractor": BACKBONE_WEIGHTS} if input_type == "embeddings" else {}
     return {
         "gcs_prefix":    f"models/{version}",
         "mode":          "per_macro",
@@ -69,8 +170,10 @@ def _per_macro(version, log_transform, *, input_type="embeddings", prefix=""):
             "regressor_fat":     f"{prefix}regressor_fat.keras",
             "regressor_protein": f"{prefix}regressor_protein.keras",
             "regressor_carbs":   f"{prefix}regressor_carbs.keras",
+            **backbone,
             **_COMMON_ARTIFACTS,
         },
+        **_SERVING,
     }
 
 
@@ -92,6 +195,7 @@ MODEL_CONFIGS = {
             "model": "multitask_v4.keras",
             **_COMMON_ARTIFACTS,
         },
+        **_SERVING,
     },
 
     # ---- Demo series: joint regressor (classifier + 1 regressor) ---------
@@ -0,0 +1,155 @@
+"""
+Vectorized post-processing: raw model outputs → dishes and nutrition.
+
+`PostProcessor.from_artifacts` compiles a version's label_encoder.pkl and
+macro_scaler.pkl into plain arrays once at load time:
+
+    classes          label index → dish name
+    scale, offset    the scaler's inverse transform as one affine map
+    columns          scaler column order → [fat, protein, carbs(, calories)]
+
+so a batch of any size is decoded with a handful of NumPy operations
+(inverse scaling, expm1, clamping, Atwater) and sklearn never runs per
+request. The API, `dine score` and the export / precision drift checks all
+use it, so they agree to the last digit.
+"""
+
+import numpy as np
+
+from api.model_config import ATWATER_FAT, ATWATER_PROTEIN, ATWATER_CARBS
+
+ATWATER = np.array([ATWATER_FAT, ATWATER_PROTEIN, ATWATER_CARBS])
+
+# Scaler column order per mode, by macro
+_LEGACY_COLUMNS = {"fat": 0, "protein": 1, "calories": 2, "carbs": 3}
+_HEAD_COLUMNS   = {"fat": 0, "protein": 1, "carbs": 2}
+
+
+def _affine_inverse(scaler):
+    """(scale, offset) with scaler.inverse_transform(x) == x * scale + offset."""
+    n = scaler.n_features_in_
+    if hasattr(scaler, "with_mean"):                    # StandardScaler
+        scale  = scaler.scale_ if scaler.with_std else np.ones(n)
+        offset = scaler.mean_ if scaler.with_mean else np.zeros(n)
+    elif hasattr(scaler, "min_"):                       # MinMaxScaler: (x - min_) / scale_
+        scale  = 1.0 / scaler.scale_
+        offset = -scaler.min_ / scaler.scale_
+    elif hasattr(scaler, "with_centering"):             # RobustScaler
+        scale  = scaler.scale_ if scaler.with_scaling else np.ones(n)
+        offset = scaler.center_ if scaler.with_centering else np.zeros(n)
+    else:
+        raise ValueError(f"Cannot compile {type(scaler).__name__}: expected a Standard, "
+                         f"MinMax or Robust scaler")
+    return np.asarray(scale, dtype=np.float64), np.asarray(offset, dtype=np.float64)
+
+
+class PostProcessor:
+    """One version's output decoding as array operations; see the module docstring."""
+
+    def __init__(self, classes, scale, offset, columns, log_transform: bool, atwater: bool):
+        self.classes       = None if classes is None else np.asarray(classes)
+        self.scale         = np.asarray(scale, dtype=np.float64)[columns]
+        self.offset        = np.asarray(offset, dtype=np.float64)[columns]
+        self.columns       = np.asarray(columns, dtype=np.intp)
+        self.log_transform = bool(log_transform)
+        self.atwater       = bool(atwater)
+
+    @classmethod
+    def from_artifacts(cls, config: dict, macro_scaler, label_encoder=None,
+                       seed: int = 0) -> "PostProcessor":
+        """
+        Compile the sklearn artifacts of a `config` version.
+
+        The affine map is checked against `macro_scaler.inverse_transform` on a
+        random batch, so an unexpected scaler fails at load time, not in production.
+        """
+        scale, offset = _affine_inverse(macro_scaler)
+        if config["mode"] == "legacy":
+            # Legacy scaler has 4 cols [fat, protein, cal, carbs]; calories are predicted
+            layout = _LEGACY_COLUMNS
+            names  = ("fat", "protein", "carbs", "calories")
+            log_transform, atwater = False, False
+        else:
+            # joint / per_macro: scaler has 3 cols [fat, protein, carbs]
+            layout = _HEAD_COLUMNS
+            names  = ("fat", "protein", "carbs")
+            log_transform, atwater = config["log_transform"], config["atwater"]
+        if len(scale) != len(layout):
+            raise ValueError(f"{config['mode']} expects a {len(layout)}-column macro scaler, "
+                             f"got {len(scale)} columns")
+        classes = None if label_encoder is None else label_encoder.classes_
+
+        processor = cls(classes, scale, offset, [layout[name] for name in names],
+                        log_transform, atwater)
+        probe = np.random.default_rng(seed).normal(size=(8, len(scale)))
+        if not np.allclose(probe[:, processor.columns] * processor.scale + processor.offset,
+                           macro_scaler.inverse_transform(probe)[:, processor.columns]):
+            raise ValueError(f"{type(macro_scaler).__name__} does not invert as an affine map")
+        return processor
+
+    # -- Regression ---------------------------------------------------------------
+
+    def grams(self, macros_scaled: np.ndarray) -> np.ndarray:
+        """Scaled regression outputs → (N, 4) [fat, protein, carbs, calories] in g / kcal."""
+        macros = np.asarray(macros_scaled, dtype=np.float64)[:, self.columns] * self.scale + self.offset
+        if len(self.columns) == 4:          # legacy: calories predicted, no clamping
+            return macros
+        if self.log_transform:
+            np.expm1(macros, out=macros)    # exp(y) - 1
+        np.maximum(macros, 0.0, out=macros)
+        calories = macros @ ATWATER if self.atwater else np.zeros(len(macros))
+        return np.column_stack([macros, calories])
+
+    # -- Classification -----------------------------------------------------------
+
+    def top_k(self, label_probs: np.ndarray, k: int = 1):
+        """(dishes (N, k), probabilities (N, k)), most likely first."""
+        label_probs = np.asarray(label_probs)
+        k = min(k, label_probs.shape[1])
+        if k == 1:
+            idx = np.argmax(label_probs, axis=1)[:, None]
+        else:
+            part  = np.argpartition(-label_probs, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(label_probs, part, axis=1), axis=1)
+            idx   = np.take_along_axis(part, order, axis=1)
+        return self.classes[idx], np.take_along_axis(label_probs, idx, axis=1)
+
+    # -- Both -----------------------------------------------------------------------
+
+    def decode(self, label_probs: np.ndarray, macros_scaled: np.ndarray, k: int = 1) -> dict:
+        """
+        Unrounded per-image columns: dish, confidence, calories, protein_g,
+        carbs_g, fat_g (plus top_dishes / top_confidences (N, k) when k > 1).
+        """
+        dishes, probs = self.top_k(label_probs, k)
+        fat_g, protein_g, carbs_g, calories = self.grams(macros_scaled).T
+        out = {
+            "dish":       dishes[:, 0],
+            "confidence": probs[:, 0],
+            "calories":   calories,
+            "protein_g":  protein_g,
+            "carbs_g":    carbs_g,
+            "fat_g":      fat_g,
+        }
+        if k > 1:
+            out["top_dishes"], out["top_confidences"] = dishes, probs
+        return out
+
+    def responses(self, label_probs: np.ndarray, macros_scaled: np.ndarray, version: str) -> list:
+        """API response dicts; rounding is vectorized, only dict assembly is per image."""
+        out        = self.decode(label_probs, macros_scaled)
+        confidence = np.round(out["confidence"].astype(np.float64), 3).tolist()
+        calories   = np.round(out["calories"]).astype(np.int64).tolist()
+        protein_g  = np.round(out["protein_g"], 1).tolist()
+        carbs_g    = np.round(out["carbs_g"], 1).tolist()
+        fat_g      = np.round(out["fat_g"], 1).tolist()
+        return [
+            {
+                "dish":          dish,
+                "confidence":    conf,
+                "nutrition":     {"calories": kcal, "protein_g": p, "carbs_g": c, "fat_g": f},
+                "model_version": version,
+            }
+            for dish, conf, kcal, p, c, f in zip(out["dish"].tolist(), confidence, calories,
+                                                 protein_g, carbs_g, fat_g)
+        ]
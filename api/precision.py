@@ -0,0 +1,123 @@
+"""
+Reduced-precision compute for the keras backend.
+
+A config's `precision` runs the backbone and fused heads under a Keras mixed
+policy: variables stay float32, convolutions and matmuls run in bfloat16 or
+float16, and outputs are cast back to float32 by the runners. That only pays
+off on CPUs with native support (AVX512-BF16 / AMX, AVX512-FP16; BF16 / FP16
+on Arm), so on other hosts the version is served in float32.
+
+Before a reduced-precision version is served, `check_drift` runs a fixed batch
+through the float32 and reduced graphs and compares the macros in grams; past
+PRECISION_MAX_DRIFT_G the version is refused.
+"""
+
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+from api.model_config import PRECISION_MAX_DRIFT_G
+from api.postprocess import PostProcessor
+from dine.preprocessing import IMAGE_SIZE
+
+PRECISIONS = ("float32", "bfloat16", "float16")
+
+# Keras dtype policy per precision (variables stay float32 under the mixed ones)
+_POLICIES = {"float32": "float32", "bfloat16": "mixed_bfloat16", "float16": "mixed_float16"}
+
+# /proc/cpuinfo flags (x86) / Features (Arm) that mean native support
+_CPU_FLAGS = {
+    "bfloat16": {"avx512_bf16", "amx_bf16", "bf16"},
+    "float16":  {"avx512_fp16", "amx_fp16", "asimdhp"},
+}
+
+
+@lru_cache(maxsize=1)
+def cpu_flags() -> frozenset:
+    flags = set()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in ("flags", "Features"):
+                    flags.update(value.split())
+    except OSError:     # not Linux: assume no reduced-precision support
+        pass
+    return frozenset(flags)
+
+
+def cpu_supports(precision: str) -> bool:
+    return precision == "float32" or bool(_CPU_FLAGS[precision] & cpu_flags())
+
+
+def serving_precision(config: dict) -> str:
+    """
+    The precision `config` is served at on this host: float32 without CPU
+    support, and for exported graphs (their numerics come from `quantization`).
+    """
+    precision = config.get("precision") or "float32"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Available: {', '.join(PRECISIONS)}")
+    if config["backend"] != "keras":
+        return "float32"
+    return precision if cpu_supports(precision) else "float32"
+
+
+# -- Keras models -----------------------------------------------------------------
+
+def _layers(model):
+    yield model
+    for layer in getattr(model, "layers", ()):
+        yield from _layers(layer)
+
+
+def set_precision(model, precision: str) -> None:
+    """Switch every layer (nested models included) to `precision` compute, in place."""
+    policy = _POLICIES[precision]
+    for layer in _layers(model):
+        layer.dtype_policy = policy
+
+
+@contextmanager
+def computing_in(model, precision: str):
+    """Temporarily run `model` at `precision`; graphs already traced are unaffected."""
+    saved = [(layer, layer.dtype_policy) for layer in _layers(model)]
+    set_precision(model, precision)
+    try:
+        yield model
+    finally:
+        for layer, policy in saved:
+            layer.dtype_policy = policy
+
+
+# -- Drift check ------------------------------------------------------------------
+
+def check_drift(config: dict, scaler, heads, precision: str, backbone=None,
+                max_drift_g: float = PRECISION_MAX_DRIFT_G, batch_size: int = 8,
+                seed: int = 0) -> float:
+    """
+    Largest |Δ| of fat, protein or carbs (grams) between float32 and `precision`
+    on a random pixel batch, through `backbone` (Keras, head-only versions) and
+    the fused `heads`. Raises ValueError past `max_drift_g`.
+    """
+    images = np.random.default_rng(seed).uniform(
+        0.0, 255.0, (batch_size, *IMAGE_SIZE, 3)).astype(np.float32)
+    to_grams = PostProcessor.from_artifacts(config, scaler).grams
+    grams    = {}
+    for p in ("float32", precision):
+        with computing_in(heads, p):
+            model_input = images
+            if backbone is not None:
+                with computing_in(backbone, p):
+                    model_input = backbone(images, training=False)
+            _, macros_scaled = heads(model_input, training=False)
+        grams[p] = to_grams(np.asarray(macros_scaled, dtype=np.float32))
+
+    drift = float(np.max(np.abs(grams[precision] - grams["float32"])[:, :3]))
+    if drift > max_drift_g:
+        raise ValueError(
+            f"{precision} macros drift {drift:.3f} g from float32 "
+            f"(max {max_drift_g:g} g); set precision='float32' for this version"
+        )
+    return drift
@@ -0,0 +1,202 @@
+"""
+Model registry: every model version served by this process.
+
+MODEL_VERSIONS lists the MODEL_CONFIGS entries to load (default: just
+MODEL_VERSION). Head-only versions that use the same backbone share one
+feature extractor, so each extra version only adds its small heads.
+Requests choose a version with `?version=` or an `X-Model-Version` header
+and fall back to MODEL_VERSION.
+"""
+
+import time
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+
+from api.artifacts import artifact_dir, maybe_download_from_gcs
+from api.backends import backbone_id, index_backbone, load_backend
+from api.batching import MicroBatcher
+from api.concurrency import inference_slots
+from api.metrics import BATCH_SIZE, STAGE_SECONDS, STAGES
+from api.precision import serving_precision
+from api.model_config import MODEL_CONFIGS, INFERENCE_RUNNER, WARMUP_BATCH_SIZES
+from api.postprocess import PostProcessor
+
+
+@contextmanager
+def timed(timings: dict, phase: str):
+    """Record the wall time of the block in `timings[phase]` (seconds)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = round(time.perf_counter() - start, 3)
+
+
+class ServedModel:
+    """One loaded model version: runners, label/scaler artifacts and its micro-batcher."""
+
+    def __init__(self, version: str, config: dict, feature_extractor, heads,
+                 label_encoder, macro_scaler):
+        self.version           = version
+        self.config            = config
+        self.feature_extractor = feature_extractor
+        self.heads             = heads
+        self.label_encoder     = label_encoder
+        self.macro_scaler      = macro_scaler
+        self.postprocessor     = PostProcessor.from_artifacts(config, macro_scaler, label_encoder)
+        self.backbone_id       = backbone_id(config) if feature_extractor is not None else None
+        # Queries only match a kNN index built from the same backbone weights
+        self.index_backbone    = index_backbone(config) if feature_extractor is not None else None
+
+        # --- Metrics: label children resolved once, so recording is just observe() ---
+        self.metric_labels = {"model_version": version, "mode": config["mode"]}
+        self.label_values  = tuple(self.metric_labels.values())     # for caches / shedder stats
+        self._stages       = {stage: STAGE_SECONDS.labels(**self.metric_labels, stage=stage)
+                              for stage in STAGES}
+        self._batch_sizes  = BATCH_SIZE.labels(**self.metric_labels)
+
+        # --- Micro-batching: concurrent requests share one model call ---
+        self.batcher = MicroBatcher(
+            self.run_models,
+            max_batch_size=config["max_batch_size"],
+            max_wait_ms=config["max_wait_ms"],
+            name=f"batcher-{version}",
+        )
+
+    def stage(self, name: str):
+        """Context manager timing one pipeline stage into dine_stage_seconds."""
+        return self._stages[name].time()
+
+    def prediction_key(self, img_hash: str) -> str:
+        return f"{self.version}:{img_hash}"
+
+    def embedding_key(self, img_hash: str) -> str:
+        return f"{self.backbone_id}:{img_hash}"
+
+    def run_models(self, img_batch: np.ndarray):
+        """
+        Run the models on a (N, 224, 224, 3) batch.
+
+        Returns (label_probs, macros_scaled): class probabilities (N, n_classes)
+        and regression outputs in the macro scaler's column order (N, n_cols).
+        Head-only models also return their (N, 1280) embeddings as a third
+        element, for the embedding cache.
+        """
+        with inference_slots:
+            self._batch_sizes.observe(len(img_batch))
+
+            # ---- EXTRACT FEATURES (head-only models) ----
+            if self.feature_extractor is None:
+                return self._heads(img_batch)
+
+            with self.stage("feature_extraction"):
+                (embeddings,) = self.feature_extractor(img_batch)
+            return (*self._heads(embeddings), embeddings)
+
+    def run_heads(self, model_input: np.ndarray):
+        """Run the fused heads on images (end-to-end) or embeddings (head-only)."""
+        with inference_slots:
+            return self._heads(model_input)
+
+    def _heads(self, model_input: np.ndarray):
+        # Classification and regression run as one fused graph, timed together.
+        with self.stage("heads"):
+            label_probs, macros_scaled = self.heads(model_input)
+        return label_probs, macros_scaled.astype(np.float32)
+
+    def warmup(self, batch_sizes=WARMUP_BATCH_SIZES) -> None:
+        """Run dummy batches so graph optimization happens before the first request."""
+        # Straight to the runners: warmup calls stay out of the serving metrics.
+        for size in batch_sizes:
+            model_input = np.zeros((size, 224, 224, 3), dtype=np.float32)
+            if self.feature_extractor is not None:
+                (model_input,) = self.feature_extractor(model_input)
+            self.heads(model_input)
+
+    def postprocess(self, label_probs: np.ndarray, macros_scaled: np.ndarray) -> list:
+        """Turn a batch of raw model outputs into API response dicts."""
+        with self.stage("postprocess"):
+            return self.postprocessor.responses(label_probs, macros_scaled, self.version)
+
+    def close(self) -> None:
+        self.batcher.close()
+
+
+class ModelRegistry:
+    """Load and look up served versions; feature extractors are shared by backbone."""
+
+    def __init__(self, default_version: str):
+        self.default_version    = default_version
+        self.models             = {}
+        self.feature_extractors = {}    # backbone_id -> runner, shared across versions
+        self.startup_timings    = {}    # version -> {phase: seconds}
+
+    def load(self, version: str) -> ServedModel:
+        """
+        Load artifacts for one MODEL_CONFIGS version.
+
+        Supports three architecture modes:
+          legacy    — single end-to-end multitask model (v1)
+          joint     — classifier + single 3-output regressor (demo_v3–v10)
+          per_macro — classifier + 3 separate regressors (demo_v11+)
+
+        Head-only models (input_type="embeddings") also use an EfficientNetB0
+        feature extractor for the image → 1280-dim embedding step, shared with
+        every other loaded version on the same backbone.
+
+        The config's `backend` picks Keras, TFLite or ONNX Runtime graphs
+        (see api/backends.py).
+        """
+        if version not in MODEL_CONFIGS:
+            available = ", ".join(sorted(MODEL_CONFIGS.keys()))
+            raise ValueError(f"Unknown model version '{version}'. Available: {available}")
+
+        config  = MODEL_CONFIGS[version]
+        timings = self.startup_timings[version] = {}
+        with timed(timings, "download"):
+            maybe_download_from_gcs(version, config)
+
+        art_dir   = artifact_dir(version)
+        artifacts = config["artifacts"]
+
+        # --- Feature extractor (shared) + fused heads for the configured backend ---
+        with timed(timings, "backend"):
+            feature_extractor, heads = load_backend(
+                config, art_dir, version, shared=self.feature_extractors
+            )
+
+        with timed(timings, "artifacts"):
+            label_encoder = joblib.load(art_dir / artifacts["label_encoder"])
+            macro_scaler  = joblib.load(art_dir / artifacts["macro_scaler"])
+
+        model = ServedModel(
+            version, config, feature_extractor, heads,
+            label_encoder=label_encoder, macro_scaler=macro_scaler,
+        )
+
+        # --- Warmup: first executions pay graph optimization, not the first users ---
+        with timed(timings, "warmup"):
+            model.warmup()
+        self.models[version] = model
+
+        print(f"[{version}] Model loaded (mode={config['mode']}, "
+              f"log={config['log_transform']}, atwater={config['atwater']}, "
+              f"backend={config['backend']}, precision={serving_precision(config)}, "
+              f"runner={INFERENCE_RUNNER}, "
+              f"batch<={config['max_batch_size']}, wait={config['max_wait_ms']}ms)")
+        print(f"[{version}] Startup: " + ", ".join(f"{k} {v:.2f}s" for k, v in timings.items()))
+        return model
+
+    def get(self, version: str = None) -> ServedModel:
+        """Return a loaded version (default if None); KeyError if it isn't served."""
+        return self.models[version or self.default_version]
+
+    @property
+    def has_feature_extractor(self) -> bool:
+        return bool(self.feature_extractors)
+
+    def close(self) -> None:
+        for model in self.models.values():
+            model.close()
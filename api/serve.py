@@ -0,0 +1,205 @@
+"""
+Pre-fork server: one master, SERVE_WORKERS uvicorn workers on one socket.
+
+    python -m api.serve --host 0.0.0.0 --port 8080
+
+The master imports the app (TensorFlow, Keras, NumPy, scikit-learn, so workers
+skip the import), syncs and verifies every version's artifacts once, binds the
+port and forks.
+Each worker then pins itself to its own cores, sizes TensorFlow's intra/inter-op
+pools (and TFLite / ONNX Runtime threads, and the inference slots) to them,
+loads + warms up its models and accepts from the shared socket.
+
+TensorFlow's runtime does not survive a fork once it has executed an op, and
+building a model runs ops (creating its variables is enough for the forked
+children to hang), so models are built after the fork; the artifacts they read
+are already verified and in the page cache. The weights themselves are
+therefore NOT shared: every worker holds its own copy of each served version's
+weights and traced graphs, so memory grows by one model set per worker. Extra
+workers buy CPU parallelism, not memory savings. SERVE_WORKERS defaults to 1;
+0 sizes the pool to the CPUs and to the memory limit / SERVE_WORKER_MEMORY_MB.
+`python -m benchmarks.workers` reports per-worker RSS / PSS to set that budget.
+
+A worker that dies is replaced, unless it dies while starting up (bad config,
+missing artifact): then the server exits.
+"""
+
+import argparse
+import os
+import signal
+import socket
+import sys
+import time
+
+from api.concurrency import available_cpus, memory_limit_bytes
+from api.model_config import (
+    MODEL_CONFIGS, MODEL_VERSIONS, SERVE_WORKERS, SERVE_WORKER_MEMORY_MB, SERVE_PIN_CPUS,
+    TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS, INFERENCE_CONCURRENCY,
+)
+
+STARTUP_GRACE_S = 120       # a worker exiting sooner than this is a startup failure
+
+
+def auto_workers(memory_mb: int = SERVE_WORKER_MEMORY_MB) -> int:
+    """One worker per usable CPU, as long as each fits in `memory_mb` of the memory limit."""
+    cpus   = available_cpus()
+    memory = memory_limit_bytes()
+    if not memory or memory_mb <= 0:
+        return cpus
+    return max(1, min(cpus, memory // (memory_mb * 1024 * 1024)))
+
+
+def plan_workers(workers: int = SERVE_WORKERS, threads: int = TF_INTRA_OP_THREADS,
+                 pin: bool = SERVE_PIN_CPUS) -> list:
+    """
+    [(cores or None, threads), ...] per worker.
+
+    `workers` 0 means `auto_workers()`. Threads default to the workers' share of
+    the usable CPUs. Cores are dealt out in contiguous runs of `threads`,
+    wrapping if workers x threads oversubscribes.
+    """
+    cpus    = available_cpus()
+    workers = workers or auto_workers()
+    threads = threads or max(1, cpus // workers)
+    try:
+        cores = sorted(os.sched_getaffinity(0))[:max(cpus, threads)]
+    except AttributeError:      # macOS / Windows: no affinity control
+        cores, pin = [], False
+    return [
+        ([cores[(w * threads + t) % len(cores)] for t in range(threads)] if pin else None, threads)
+        for w in range(workers)
+    ]
+
+
+def _preload() -> None:
+    """Master-side work every worker would otherwise repeat."""
+    from api.artifacts import artifact_dir, maybe_download_from_gcs
+
+    for version in MODEL_VERSIONS:
+        maybe_download_from_gcs(version, MODEL_CONFIGS[version])
+        # Pull the files into the page cache once; workers then load from memory
+        for path in artifact_dir(version).rglob("*"):
+            if path.is_file() and hasattr(os, "posix_fadvise"):
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+
+    # Modules only; nothing here may run a TensorFlow op before the fork
+    import api.fast  # noqa: F401
+
+
+def _configure_worker(cores, threads: int) -> None:
+    """Runs in the child before any model is built."""
+    import tensorflow as tf
+
+    import api.backends
+    import api.concurrency
+
+    if cores:
+        os.sched_setaffinity(0, cores)
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    api.backends.NUM_THREADS = threads
+    api.concurrency.inference_slots.resize(INFERENCE_CONCURRENCY or threads)
+
+
+def _run_worker(index: int, sock: socket.socket, cores, threads: int, log_level: str) -> None:
+    import uvicorn
+
+    from api.fast import app
+
+    _configure_worker(cores, threads)
+    print(f"[worker {index}] pid {os.getpid()}, {threads} thread(s), "
+          f"cores {cores if cores else 'unpinned'}", flush=True)
+    uvicorn.Server(uvicorn.Config(app, log_level=log_level)).run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int = SERVE_WORKERS, log_level: str = "info") -> int:
+    plan = plan_workers(workers)
+    memory = memory_limit_bytes()
+    print(f"Pre-fork server: {len(plan)} worker(s) x {plan[0][1]} thread(s) "
+          f"on {available_cpus()} usable CPU(s), "
+          f"{f'{memory / 2**30:.1f} GiB' if memory else 'unknown'} memory limit", flush=True)
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    _preload()
+
+    children = {}           # pid -> (worker index, start time)
+    stopping = False
+
+    def spawn(index: int) -> None:
+        cores, threads = plan[index]
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                _run_worker(index, sock, cores, threads, log_level)
+            except BaseException as exc:
+                print(f"[worker {index}] crashed: {exc!r}", flush=True)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)     # uvicorn drains and runs shutdown
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(len(plan)):
+        spawn(index)
+
+    exit_code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index, started = children.pop(pid)
+        if stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started < STARTUP_GRACE_S:
+            print(f"[worker {index}] exited with {code} during startup; stopping server", flush=True)
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+        print(f"[worker {index}] exited with {code}; restarting", flush=True)
+        spawn(index)
+
+    sock.close()
+    return exit_code
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS,
+                        help="worker processes (default: SERVE_WORKERS, "
+                             "0 = fit to the CPUs and memory limit)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    sys.exit(serve(args.host, args.port, args.workers, args.log_level))
+
+
+if __name__ == "__main__":
+    main()
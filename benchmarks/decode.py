@@ -0,0 +1,79 @@
+"""
+Microbenchmark: current API decode path vs dine.preprocessing on phone-size JPEGs.
+
+    python -m benchmarks.decode                       # synthetic 12 MP photos
+    python -m benchmarks.decode --images path/to/jpgs # your own files
+
+Reports ms/image for each path and the mean absolute pixel difference between them.
+"""
+
+import argparse
+import io
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from dine.preprocessing import IMAGE_SIZE, decode_image, decode_into, empty_batch
+
+
+def baseline(img_bytes: bytes) -> np.ndarray:
+    """The pre-dine.preprocessing path: full decode, resize, float copy, batch axis."""
+    img = Image.open(io.BytesIO(img_bytes)).convert("RGB").resize(IMAGE_SIZE)
+    return np.expand_dims(np.array(img, dtype=np.float32), axis=0)
+
+
+def synthetic_jpegs(n: int, size=(4032, 3024), quality=90, seed=0) -> list:
+    """Smooth random photos (gradients + noise) so JPEG sizes resemble real ones."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    small = rng.integers(0, 255, (n, height // 64, width // 64, 3), dtype=np.uint8)
+    out = []
+    for i in range(n):
+        img = Image.fromarray(small[i]).resize(size, Image.Resampling.BICUBIC)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=quality)
+        out.append(buf.getvalue())
+    return out
+
+
+def timeit(fn, images, repeat) -> float:
+    """Best-of-`repeat` milliseconds per image."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for img_bytes in images:
+            fn(img_bytes)
+        best = min(best, (time.perf_counter() - start) / len(images))
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=Path, help="Directory of JPEGs (default: synthetic)")
+    parser.add_argument("-n", type=int, default=16, help="Synthetic images to generate")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [p.read_bytes() for p in sorted(args.images.rglob("*.jp*g"))]
+    else:
+        images = synthetic_jpegs(args.n)
+    print(f"{len(images)} images, mean {np.mean([len(b) for b in images]) / 1e6:.2f} MB")
+
+    buffer = empty_batch(1)
+    paths = {
+        "baseline":     baseline,
+        "decode_image": decode_image,
+        "decode_into":  lambda b: decode_into(b, buffer[0]),
+    }
+    for name, fn in paths.items():
+        print(f"  {name:<14} {timeit(fn, images, args.repeat):8.2f} ms/image")
+
+    diff = np.mean([np.abs(baseline(b)[0] - decode_image(b)).mean() for b in images])
+    print(f"  mean |baseline - decode_image| = {diff:.2f} (0-255 scale)")
+
+
+if __name__ == "__main__":
+    main()
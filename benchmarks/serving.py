@@ -0,0 +1,367 @@
+"""
+Load test for the serving path: stub models per mode, synthetic JPEGs, api.fast.app.
+
+    python -m benchmarks.serving                                  # all modes, in-process
+    python -m benchmarks.serving --transport http --concurrency 1,8,32 --sizes 640x480,4032x3024
+    python -m benchmarks.serving --output bench.json --baseline main.json   # fail on regressions
+
+Stub models have the real input/output shapes of each mode (random weights, no
+network) and are synced through a local artifact store like production ones.
+Every request uploads a distinct image, and the prediction cache is off unless
+--cache is given, so each request runs decode + inference.
+
+Reports throughput and client-side p50/p95/p99 per run, plus per-stage
+percentiles estimated from the /metrics histograms, and writes everything as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+# Stub version per mode (their MODEL_CONFIGS entries decide artifact names and shapes)
+MODE_VERSIONS = {"per_macro": "demo_v11.0", "joint": "demo_v10.0", "legacy": "v1"}
+PERCENTILES   = (50, 95, 99)
+
+
+# -- Stub models ------------------------------------------------------------------
+
+def build_stub_models(store_root: Path, modes, seed: int = 0) -> None:
+    """Write stub artifacts for each mode under store_root/<gcs_prefix>/."""
+    import joblib
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+    from tensorflow import keras
+    from tensorflow.keras.applications import EfficientNetB0
+
+    from api.backends import IMAGE_SIZE
+    from api.heads import LEGACY_MACRO_OUTPUTS
+    from api.model_config import MODEL_CONFIGS
+    from dine.params import DISHES
+
+    keras.utils.set_random_seed(seed)
+    rng = np.random.default_rng(seed)
+    n_classes = len(DISHES)
+
+    def dense_head(units, activation=None):
+        inputs = keras.Input((1280,))
+        hidden = keras.layers.Dense(256, activation="relu")(inputs)
+        return keras.Model(inputs, keras.layers.Dense(units, activation=activation)(hidden))
+
+    for mode in modes:
+        config = MODEL_CONFIGS[MODE_VERSIONS[mode]]
+        out    = store_root / config["gcs_prefix"]
+        out.mkdir(parents=True, exist_ok=True)
+        artifacts = config["artifacts"]
+        n_cols    = 4 if mode == "legacy" else 3
+
+        if mode == "legacy":
+            # End-to-end multitask model: full EfficientNetB0 + named outputs
+            inputs   = keras.Input((*IMAGE_SIZE, 3))
+            features = EfficientNetB0(weights=None, include_top=False, pooling="avg")(inputs)
+            outputs  = {"label": keras.layers.Dense(n_classes, activation="softmax", name="label")(features)}
+            for name in LEGACY_MACRO_OUTPUTS:
+                outputs[name] = keras.layers.Dense(1, name=name)(features)
+            keras.Model(inputs, outputs).save(out / artifacts["model"])
+        else:
+            backbone = keras.Sequential([
+                EfficientNetB0(weights=None, include_top=False, input_shape=(*IMAGE_SIZE, 3)),
+                keras.layers.GlobalAveragePooling2D(),
+            ], name="feature_extractor")
+            backbone.save_weights(out / artifacts["feature_extractor"])
+            dense_head(n_classes, "softmax").save(out / artifacts["classifier"])
+            if mode == "joint":
+                dense_head(3).save(out / artifacts["regressor"])
+            else:
+                for key in ("regressor_fat", "regressor_protein", "regressor_carbs"):
+                    dense_head(1).save(out / artifacts[key])
+
+        joblib.dump(LabelEncoder().fit(DISHES), out / artifacts["label_encoder"])
+        scaler = StandardScaler().fit(rng.normal(3.0, 1.0, size=(100, n_cols)))
+        joblib.dump(scaler, out / artifacts["macro_scaler"])
+        print(f"Stub {mode} model written to {out}")
+
+
+# -- Load generation ----------------------------------------------------------------
+
+def parse_size(text: str) -> tuple:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def percentiles(values) -> dict:
+    if not len(values):
+        return {}
+    values = np.asarray(values) * 1000
+    return {
+        **{f"p{p}": round(float(np.percentile(values, p)), 2) for p in PERCENTILES},
+        "mean": round(float(values.mean()), 2),
+    }
+
+
+async def drive(client, version: str, images: list, concurrency: int) -> dict:
+    """POST every image to /predict with `concurrency` workers; client-side timings."""
+    latencies, statuses = [], defaultdict(int)
+    todo = iter(images)
+
+    async def worker():
+        for img_bytes in todo:
+            start = time.perf_counter()
+            response = await client.post(
+                "/predict", params={"version": version},
+                files={"image": ("bench.jpg", img_bytes, "image/jpeg")},
+            )
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests":       len(latencies),
+        "errors":         sum(n for status, n in statuses.items() if status != 200),
+        "statuses":       dict(statuses),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms":     percentiles(latencies),
+    }
+
+
+# -- Stage percentiles from /metrics ----------------------------------------------
+
+_BUCKET = re.compile(r'^dine_stage_seconds_bucket\{(?P<labels>.*),le="(?P<le>[^"]+)"\} (?P<count>\S+)$')
+
+
+def stage_buckets(metrics_text: str) -> dict:
+    """{(version, stage): [(upper_bound, cumulative_count), ...]} from a /metrics scrape."""
+    out = defaultdict(list)
+    for line in metrics_text.splitlines():
+        match = _BUCKET.match(line)
+        if not match:
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', match["labels"]))
+        bound  = float("inf") if match["le"] == "+Inf" else float(match["le"])
+        out[(labels["model_version"], labels["stage"])].append((bound, float(match["count"])))
+    return out
+
+
+def histogram_quantile(q: float, buckets) -> float:
+    """Prometheus-style quantile: linear interpolation inside the bucket holding rank q."""
+    total = buckets[-1][1]
+    if total == 0:
+        return float("nan")
+    rank = q * total
+    lower_bound, lower_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / max(count - lower_count, 1e-9)
+        lower_bound, lower_count = bound, count
+    return lower_bound
+
+
+def stage_percentiles(before: str, after: str, version: str) -> dict:
+    """Per-stage p50/p95/p99 (ms) for requests made between two scrapes."""
+    old, new = stage_buckets(before), stage_buckets(after)
+    stages = {}
+    for (v, stage), buckets in new.items():
+        if v != version:
+            continue
+        previous = dict(old.get((v, stage), []))
+        delta = [(bound, count - previous.get(bound, 0.0)) for bound, count in buckets]
+        if delta[-1][1] <= 0:
+            continue
+        stages[stage] = {
+            **{f"p{p}": round(histogram_quantile(p / 100, delta) * 1000, 2) for p in PERCENTILES},
+            "count": int(delta[-1][1]),
+        }
+    return stages
+
+
+# -- Transports -------------------------------------------------------------------
+
+class InProcess:
+    """httpx straight into the ASGI app (no sockets); runs the app's startup/shutdown."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __aenter__(self):
+        import httpx
+        self._lifespan = self.app.router.lifespan_context(self.app)
+        await self._lifespan.__aenter__()
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=self.app), base_url="http://bench", timeout=120,
+        )
+        return self.client
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        await self._lifespan.__aexit__(*exc_info)
+
+
+class LocalHTTP:
+    """uvicorn on a free localhost port in a background thread, driven over TCP."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __aenter__(self):
+        import httpx
+        import uvicorn
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(self.app, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            await asyncio.sleep(0.05)
+        self.client = httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=120,
+            limits=httpx.Limits(max_connections=None),
+        )
+        return self.client
+
+    async def __aexit__(self, *exc_info):
+        await self.client.aclose()
+        self.server.should_exit = True
+        await asyncio.to_thread(self.thread.join)
+
+
+# -- Main -------------------------------------------------------------------------
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run(args, app, images_by_size) -> list:
+    transport = {"inprocess": InProcess, "http": LocalHTTP}[args.transport]
+    results = []
+    async with transport(app) as client:
+        for mode in args.modes:
+            version = MODE_VERSIONS[mode]
+            for label, images in images_by_size.items():
+                # Warm the client/connection path so the first run isn't penalised
+                await drive(client, version, images[:2], 1)
+                for concurrency in args.concurrency:
+                    before = (await client.get("/metrics")).text
+                    result = await drive(client, version, images, concurrency)
+                    after  = (await client.get("/metrics")).text
+                    result = {
+                        "mode":        mode,
+                        "version":     version,
+                        "transport":   args.transport,
+                        "image_size":  label,
+                        "concurrency": concurrency,
+                        **result,
+                        "stages_ms":   stage_percentiles(before, after, version),
+                    }
+                    results.append(result)
+                    print(f"{mode:<10} {label:>10} c={concurrency:<3} "
+                          f"{result['throughput_rps']:7.1f} req/s  "
+                          f"p50 {result['latency_ms'].get('p50', 0):7.1f} ms  "
+                          f"p99 {result['latency_ms'].get('p99', 0):7.1f} ms  "
+                          f"errors {result['errors']}")
+    return results
+
+
+def compare(results: list, baseline_path: Path, tolerance: float) -> list:
+    """Runs whose p95 grew by more than `tolerance` (fraction) vs. the baseline JSON."""
+    baseline = {
+        (r["mode"], r["transport"], r["image_size"], r["concurrency"]): r
+        for r in json.loads(baseline_path.read_text())["results"]
+    }
+    regressions = []
+    for r in results:
+        old = baseline.get((r["mode"], r["transport"], r["image_size"], r["concurrency"]))
+        if not old or not old["latency_ms"] or not r["latency_ms"]:
+            continue
+        ratio = r["latency_ms"]["p95"] / max(old["latency_ms"]["p95"], 1e-9)
+        print(f"{r['mode']:<10} {r['image_size']:>10} c={r['concurrency']:<3} "
+              f"p95 {old['latency_ms']['p95']:.1f} → {r['latency_ms']['p95']:.1f} ms ({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", default="per_macro,joint,legacy",
+                        help="comma-separated subset of: " + ", ".join(MODE_VERSIONS))
+    parser.add_argument("--transport", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--concurrency", default="1,8", help="comma-separated client concurrency levels")
+    parser.add_argument("--sizes", default="640x480,1600x1200,4032x3024",
+                        help="comma-separated JPEG sizes (WxH)")
+    parser.add_argument("--requests", type=int, default=64, help="requests per run")
+    parser.add_argument("--cache", action="store_true", help="keep the prediction cache on")
+    parser.add_argument("--workdir", type=Path, help="where stub models go (default: a temp dir)")
+    parser.add_argument("--output", type=Path, help="write results JSON here")
+    parser.add_argument("--baseline", type=Path, help="results JSON to compare p95 against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed p95 growth (fraction)")
+    args = parser.parse_args()
+    args.modes       = [m.strip() for m in args.modes.split(",") if m.strip()]
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="dine-bench-"))
+    versions = [MODE_VERSIONS[mode] for mode in args.modes]
+
+    # api.model_config reads these at import time
+    os.environ.update({
+        "MODEL_DIR":       str(workdir / "model"),
+        "ARTIFACT_STORE":  f"file://{workdir / 'store'}",
+        "MODEL_VERSION":   versions[0],
+        "MODEL_VERSIONS":  ",".join(versions),
+        "MAX_QUEUE_DEPTH": os.environ.get("MAX_QUEUE_DEPTH", str(max(args.concurrency) * 2)),
+    })
+    if not args.cache:
+        os.environ["PREDICTION_CACHE_SIZE"] = "0"
+        os.environ["EMBEDDING_CACHE_MB"]    = "0"
+        os.environ.pop("PREDICTION_CACHE_DIR", None)
+
+    if not (workdir / "store").exists():
+        build_stub_models(workdir / "store", args.modes)
+
+    from benchmarks.decode import synthetic_jpegs
+    images_by_size = {}
+    for i, text in enumerate(args.sizes.split(",")):
+        images_by_size[text] = synthetic_jpegs(args.requests, size=parse_size(text), seed=1000 + i)
+
+    from api.fast import app
+    results = asyncio.run(run(args, app, images_by_size))
+
+    report = {
+        "commit":    _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python":    sys.version.split()[0],
+        "cpus":      os.cpu_count(),
+        "config":    {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "results":   results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} run(s) regressed by more than {args.tolerance:.0%} at p95")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
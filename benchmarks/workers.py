@@ -0,0 +1,174 @@
+"""
+Throughput vs. worker count for the pre-fork server (`python -m api.serve`).
+
+    python -m benchmarks.workers                                  # 1, 2, 4 workers
+    python -m benchmarks.workers --workers 1,2,4,8 --threads 1 --concurrency 32 --output workers.json
+
+Each run starts api.serve in a subprocess on stub models (see benchmarks.serving),
+waits for every worker to finish loading, then drives /predict over HTTP with
+distinct JPEGs and reports throughput, client-side p50/p95/p99 and the memory of
+the master and each worker (RSS, and PSS, which splits shared pages between the
+processes mapping them). Workers do not share model weights, so expect
+roughly one model set of RSS per worker.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.serving import MODE_VERSIONS, build_stub_models, drive, parse_size, _git_commit
+
+STARTUP_TIMEOUT_S = 600
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, threads: int, env: dict, log_path: Path):
+    """Launch api.serve and block until all `workers` report startup complete."""
+    port = _free_port()
+    log  = open(log_path, "w")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "api.serve", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env={**env, "TF_INTRA_OP_THREADS": str(threads)}, stdout=log, stderr=subprocess.STDOUT,
+    )
+    deadline = time.monotonic() + STARTUP_TIMEOUT_S
+    while log_path.read_text().count("Startup complete") < workers:
+        if proc.poll() is not None or time.monotonic() > deadline:
+            proc.kill()
+            raise RuntimeError(f"api.serve with {workers} worker(s) failed to start; see {log_path}")
+        time.sleep(0.5)
+    return proc, port
+
+
+def _proc_kb(path: str, field: str) -> int:
+    with open(path) as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def process_memory(master_pid: int) -> dict:
+    """RSS / PSS in MB of the master and each worker, from /proc (empty off Linux)."""
+    def usage(pid):
+        return {
+            "pid":    pid,
+            "rss_mb": round(_proc_kb(f"/proc/{pid}/status", "VmRSS") / 1024, 1),
+            "pss_mb": round(_proc_kb(f"/proc/{pid}/smaps_rollup", "Pss") / 1024, 1),
+        }
+
+    if not os.path.exists(f"/proc/{master_pid}/smaps_rollup"):
+        return {}
+    workers = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            if ppid == master_pid:
+                workers.append(usage(int(entry)))
+        except (OSError, IndexError, ValueError):
+            continue        # exited while scanning
+    return {"master": usage(master_pid), "workers": sorted(workers, key=lambda w: w["pid"])}
+
+
+def stop_server(proc) -> None:
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+
+async def measure(port: int, version: str, images: list, concurrency: int) -> dict:
+    import httpx
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=120,
+                                 limits=httpx.Limits(max_connections=None)) as client:
+        # One pass per connection so every worker has served before timing starts
+        await drive(client, version, images[:concurrency], concurrency)
+        return await drive(client, version, images, concurrency)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--mode", default="per_macro", choices=list(MODE_VERSIONS))
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="TF intra-op threads per worker (0 = CPUs / workers)")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--size", default="640x480", help="JPEG size (WxH)")
+    parser.add_argument("--requests", type=int, default=128, help="requests per run")
+    parser.add_argument("--workdir", type=Path, help="where stub models go (default: a temp dir)")
+    parser.add_argument("--output", type=Path, help="write results JSON here")
+    args = parser.parse_args()
+    args.workers = [int(w) for w in args.workers.split(",")]
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="dine-bench-"))
+    version = MODE_VERSIONS[args.mode]
+    env = {
+        **os.environ,
+        "MODEL_DIR":             str(workdir / "model"),
+        "ARTIFACT_STORE":        f"file://{workdir / 'store'}",
+        "MODEL_VERSION":         version,
+        "MODEL_VERSIONS":        version,
+        "PREDICTION_CACHE_SIZE": "0",
+        "EMBEDDING_CACHE_MB":    "0",
+        "MAX_QUEUE_DEPTH":       os.environ.get("MAX_QUEUE_DEPTH", str(args.concurrency * 2)),
+        "PYTHONUNBUFFERED":      "1",
+    }
+    env.pop("PREDICTION_CACHE_DIR", None)
+    if not (workdir / "store").exists():
+        build_stub_models(workdir / "store", [args.mode])
+
+    from benchmarks.decode import synthetic_jpegs
+    images = synthetic_jpegs(args.requests, size=parse_size(args.size), seed=1000)
+
+    results = []
+    for workers in args.workers:
+        proc, port = start_server(workers, args.threads, env, workdir / f"serve-{workers}.log")
+        try:
+            result = asyncio.run(measure(port, version, images, args.concurrency))
+            result["memory"] = process_memory(proc.pid)
+        finally:
+            stop_server(proc)
+        result = {"workers": workers, "threads": args.threads, "concurrency": args.concurrency, **result}
+        results.append(result)
+        print(f"workers={workers:<3} {result['throughput_rps']:7.1f} req/s  "
+              f"p50 {result['latency_ms'].get('p50', 0):7.1f} ms  "
+              f"p95 {result['latency_ms'].get('p95', 0):7.1f} ms  "
+              f"errors {result['errors']}")
+        if result["memory"]:
+            rss = [w["rss_mb"] for w in result["memory"]["workers"]]
+            pss = sum(w["pss_mb"] for w in result["memory"]["workers"])
+            print(f"           RSS per worker {', '.join(f'{r:.0f}' for r in rss)} MB  "
+                  f"(master {result['memory']['master']['rss_mb']:.0f} MB)  "
+                  f"PSS of all workers {pss:.0f} MB")
+
+    report = {
+        "commit":    _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "cpus":      os.cpu_count(),
+        "config":    {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "results":   results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+`dine` command line.
+
+    dine score <version> <labels.csv> [-o predictions.parquet] [--metrics report.json]
+    dine embed <version> <labels.csv> <store_dir> [--dtype float16]
+    dine knn <store_dir> <labels.csv> <index_dir> [--kind flat|ivf|ivfpq]
+"""
+
+import argparse
+import json
+import sys
+
+
+def _score(args) -> int:
+    from dine.scoring import format_report, score_labels
+
+    _, report = score_labels(
+        args.version, args.labels, args.output,
+        root=args.image_root, batch_size=args.batch_size, workers=args.workers,
+        prefetch=args.prefetch, limit=args.limit, top_k=args.top_k,
+    )
+    print(format_report(report))
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            json.dump({"model_version": args.version, "labels": args.labels, **report}, f, indent=2)
+    return 0
+
+
+def _embed(args) -> int:
+    from dine.embeddings import build_store
+
+    store = build_store(
+        args.store, args.version, args.labels,
+        root=args.image_root, dtype=args.dtype, batch_size=args.batch_size,
+        workers=args.workers, prefetch=args.prefetch, limit=args.limit,
+    )
+    print(f"{len(store)} embeddings ({store.dtype}, dim {store.dim}) in {store.directory}")
+    return 0
+
+
+def _knn(args) -> int:
+    from dine.knn import build_index
+
+    index = build_index(args.store, args.labels, args.index,
+                        kind=args.kind, nlist=args.nlist, nprobe=args.nprobe, m=args.m)
+    print(f"{index.kind} index of {len(index)} images in {args.index}")
+    return 0
+
+
+def _add_pipeline_args(parser) -> None:
+    parser.add_argument("--image-root", help="Directory relative image_path values resolve against "
+                                             "(default: next to labels.csv, else BASE_DATA_DIR)")
+    parser.add_argument("--batch-size", type=int, default=128, help="Images per model call")
+    parser.add_argument("--workers", type=int, default=None, help="Decode threads (default: CPUs)")
+    parser.add_argument("--prefetch", type=int, default=2, help="Decoded batches kept ready ahead")
+    parser.add_argument("--limit", type=int, default=None, help="Use only the first N rows")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="dine", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    score = commands.add_parser(
+        "score", help="Bulk-score a labels.csv with a MODEL_CONFIGS version and report MAE/MAPE/bias.",
+    )
+    score.add_argument("version", help="MODEL_CONFIGS key, e.g. demo_v11.0")
+    score.add_argument("labels", help="labels.csv (local path or gs://), as written by create_dataset")
+    score.add_argument("-o", "--output", help="Parquet file for labels + predictions")
+    score.add_argument("--metrics", help="Also write the metrics report as JSON")
+    score.add_argument("--top-k", type=int, default=1,
+                       help="Also record the k most likely dishes (top_dishes) and top-k accuracy")
+    _add_pipeline_args(score)
+    score.set_defaults(func=_score)
+
+    embed = commands.add_parser(
+        "embed", help="Add backbone embeddings for new labels.csv images to a memory-mapped store.",
+    )
+    embed.add_argument("version", help="Head-only MODEL_CONFIGS key whose backbone to use")
+    embed.add_argument("labels", help="labels.csv (local path or gs://)")
+    embed.add_argument("store", help="Embedding store directory (created if missing)")
+    embed.add_argument("--dtype", choices=("float16", "float32"), default="float16")
+    _add_pipeline_args(embed)
+    embed.set_defaults(func=_embed)
+
+    knn = commands.add_parser(
+        "knn", help="Build the similar-dish index served at /similar from an embedding store.",
+    )
+    knn.add_argument("store", help="Embedding store directory (from `dine embed`)")
+    knn.add_argument("labels", help="labels.csv with label and nutrition columns")
+    knn.add_argument("index", help="Output directory (point KNN_INDEX_DIR here)")
+    knn.add_argument("--kind", choices=("flat", "ivf", "ivfpq"), default="flat",
+                     help="flat = exact; ivf/ivfpq = approximate, for large datasets")
+    knn.add_argument("--nlist", type=int, default=None, help="ivf lists (default: sqrt(N))")
+    knn.add_argument("--nprobe", type=int, default=8, help="ivf lists scanned per query")
+    knn.add_argument("--m", type=int, default=64, help="ivfpq bytes per vector")
+    knn.set_defaults(func=_knn)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
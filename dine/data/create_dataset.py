@@ -17,35 +17,154 @@ Caching is also available
 import os
 import io
 import re
+import numpy as np
 import pandas as pd
 import json
-import requests
-from PIL import Image
 from datetime import datetime, timezone
-from datasets import load_dataset
+from datasets import IterableDataset, load_dataset
 from google.cloud import storage
 from tqdm import tqdm
 
 from dine.params import *
+from dine.data.download import Downloader
+from dine.data.images import IMAGE_COLUMNS, describe_image, prepare_image
+
+SEED = 42  # Don't change: fixes which rows every dataset version samples
+
+
+# --- Subset selection ---
+def normalize_dish(name):
+    return name.lower() if isinstance(name, str) else None
+
+
+def _sample(n, per_class, seed):
+    """Positions of the rows kept out of a dish's `n`, in order."""
+    # Dataset.shuffle(seed) permutes with np.random.default_rng(seed)
+    return np.random.default_rng(seed).permutation(n)[:per_class]
+
+
+def select_subsets(dataset, dishes=DISHES, per_class=PER_CLASS, seed=SEED):
+    """
+    Pick up to `per_class` rows per dish in a single pass over the dataset.
+
+    Each dish gets the same rows, in the same order, as
+    `dataset.filter(dish).shuffle(seed).select(range(per_class))`, so existing
+    dataset versions (and their cached 000000.jpg files) stay valid.
+
+    Map-style datasets: only the dish_name column is scanned. Streaming datasets:
+    the whole stream is read once (the sample depends on each dish's row count),
+    but only rows of the requested dishes are kept in memory.
+    """
+    wanted = {dish.lower(): dish for dish in dishes}
+
+    if isinstance(dataset, IterableDataset):
+        rows = {dish: [] for dish in dishes}
+        for row in dataset:
+            dish = wanted.get(normalize_dish(row.get("dish_name")))
+            if dish is not None:
+                rows[dish].append(row)
+        return {dish: [group[i] for i in _sample(len(group), per_class, seed)]
+                for dish, group in rows.items()}
+
+    groups = {dish: [] for dish in dishes}
+    for i, name in enumerate(dataset["dish_name"]):
+        dish = wanted.get(normalize_dish(name))
+        if dish is not None:
+            groups[dish].append(i)
+
+    subsets = {}
+    for dish, indices in groups.items():
+        keep = np.asarray(indices, dtype=np.int64)[_sample(len(indices), per_class, seed)]
+        subsets[dish] = dataset.select(keep)
+    return subsets
+
+
+# --- Cache manifest ---
+def cached_images(labels, save_mode="local", bucket=None):
+    """
+    {label: {filename: info}} of the images DATASET_VERSION already has, so the
+    resume check is a dict lookup instead of a round trip per image.
+
+    GCS: one paginated prefix listing of `bucket`; `info` holds the labels.csv
+    image columns (see save_gcs) from the same listing.
+    Local: one os.scandir per dish directory; `info` is the file size.
+    """
+    cached = {label: {} for label in labels}
+
+    if save_mode == "gcs":
+        prefix = f"{DATASET_VERSION}/images/"
+        fields = "items(name,size,metadata),nextPageToken"
+        for blob in bucket.list_blobs(prefix=prefix, fields=fields):
+            label, _, filename = blob.name[len(prefix):].partition("/")
+            if label in cached and filename.endswith(".jpg") and "/" not in filename:
+                # Objects uploaded before the columns were recorded only have a size
+                metadata = blob.metadata or {}
+                cached[label][filename] = {
+                    "file_size": int(blob.size),
+                    "width": int(metadata["width"]) if "width" in metadata else None,
+                    "height": int(metadata["height"]) if "height" in metadata else None,
+                    "sha256": metadata.get("sha256")
+                }
+        return cached
+
+    for label in labels:
+        dish_dir = os.path.join(BASE_DATA_DIR, DATASET_VERSION, "images", label)
+        try:
+            with os.scandir(dish_dir) as entries:
+                cached[label] = {
+                    e.name: {"file_size": e.stat().st_size}
+                    for e in entries if e.name.endswith(".jpg") and e.is_file()
+                }
+        except FileNotFoundError:
+            pass
+    return cached
+
+
+def previous_image_info(labels_csv_path):
+    """{image_path: image columns} recorded by an earlier build of this version."""
+    try:
+        previous = pd.read_csv(labels_csv_path, usecols=lambda c: c in ("image_path", *IMAGE_COLUMNS))
+    except FileNotFoundError:
+        return {}
+    if not set(IMAGE_COLUMNS) <= set(previous.columns):
+        return {}   # written before the columns existed
+    previous = previous.dropna(subset=list(IMAGE_COLUMNS))
+    return {
+        row.image_path: {"file_size": int(row.file_size), "width": int(row.width),
+                         "height": int(row.height), "sha256": row.sha256}
+        for row in previous.itertuples(index=False)
+    }
+
+
+def cached_image_info(save_mode, image_path, info, previous=None, bucket=None):
+    """
+    labels.csv image columns of a cached image. GCS: from the listing; objects
+    uploaded before the columns were recorded are downloaded once and get them
+    as metadata (see backfill_gcs_info). Local: from the previous labels.csv
+    when the file size still matches, otherwise read back from disk.
+    """
+    if save_mode == "gcs":
+        if all(info.get(column) is not None for column in IMAGE_COLUMNS):
+            return info
+        return backfill_gcs_info(image_path, bucket)
+    known = (previous or {}).get(image_path)
+    if known is not None and known["file_size"] == info.get("file_size"):
+        return known
+    with open(os.path.join(BASE_DATA_DIR, image_path), "rb") as f:
+        return describe_image(f.read())
 
-# --- Helper ---
-def count_existing_images(label):
-    dish_dir = os.path.join(
-        BASE_DATA_DIR,
-        DATASET_VERSION,
-        "images",
-        label
-    )
 
-    if not os.path.exists(dish_dir):
-        return 0
+# --- Helper ---
+def backfill_gcs_info(image_path, bucket):
+    """Image columns of a GCS object without them, written back as its metadata for the next resume."""
+    blob = bucket.blob(image_path.removeprefix(f"gs://{bucket.name}/"))
+    info = describe_image(blob.download_as_bytes())
+    blob.metadata = {k: str(v) for k, v in info.items() if k != "file_size"}
+    blob.patch()
+    return info
 
-    return len([
-        f for f in os.listdir(dish_dir)
-        if f.endswith(".jpg")
-    ])
 
-def save_local(img, label, filename):
+def save_local(data, label, filename):
     save_path = os.path.join(
         BASE_DATA_DIR,
         DATASET_VERSION,
@@ -56,29 +175,31 @@ def save_local(img, label, filename):
 
     os.makedirs(os.path.dirname(save_path), exist_ok=True)
 
-    img.save(save_path, format="JPEG", quality=90)
+    # Write then rename, so an interrupted run never leaves a partial file
+    # that the cache check would take for a finished one
+    with open(save_path + ".part", "wb") as f:
+        f.write(data)
+    os.replace(save_path + ".part", save_path)
 
     return f"{DATASET_VERSION}/images/{label}/{filename}"
 
 
-def save_gcs(img, label, filename, bucket):
+def save_gcs(data, label, filename, bucket, info=None):
     blob_path = f"{DATASET_VERSION}/images/{label}/{filename}"
 
-    buffer = io.BytesIO()
-
-    img.save(buffer, format="JPEG", quality=90)
-    buffer.seek(0)
-
     blob = bucket.blob(blob_path)
-    blob.upload_from_file(buffer, content_type="image/jpeg")
+    # Kept as object metadata, so a resumed run reads it back from the listing
+    blob.metadata = {k: str(v) for k, v in (info or {}).items() if k != "file_size"}
+    blob.upload_from_string(data, content_type="image/jpeg")
 
     return f"gs://{bucket.name}/{blob_path}"
 
 
-def create_dataset(save_mode="local"):
+def create_dataset(save_mode="local", streaming=STREAMING):
     dataset = load_dataset(
         "Codatta/MM-Food-100K",
-        split="train"
+        split="train",
+        streaming=streaming
     )
 
     labels_csv_path = os.path.join(
@@ -100,8 +221,6 @@ def create_dataset(save_mode="local"):
         storage_client = storage.Client()
         bucket = storage_client.bucket(GCS_BUCKET_NAME)
 
-    session = requests.Session()
-
     total_images = 0
     dish_subsets = {}
 
@@ -110,57 +229,62 @@ def create_dataset(save_mode="local"):
     # -----------------------------------
     total_target = 0
     total_cached = 0
-    dish_subsets = {}
 
-    for dish in DISHES:
-        dish_data = dataset.filter(
-            lambda x: isinstance(x["dish_name"], str)
-            and x["dish_name"].lower() == dish.lower()
-        )
+    dish_subsets = select_subsets(dataset)
 
-        dish_data = dish_data.shuffle(seed=42).select(
-            range(min(PER_CLASS, len(dish_data)))
-        )
+    labels = {dish: dish.lower().replace(" ", "_") for dish in dish_subsets}
+    cached_files = cached_images(labels.values(), save_mode, bucket)
+    previous = previous_image_info(labels_csv_path) if save_mode == "local" else {}
 
-        dish_subsets[dish] = dish_data
+    for dish, dish_data in dish_subsets.items():
         total_target += len(dish_data)
-
-        label = dish.lower().replace(" ", "_")
-
-        if save_mode == "local":
-            existing = count_existing_images(label)
-            total_cached += min(existing, len(dish_data))
-
-        elif save_mode == "gcs":
-            for i in range(len(dish_data)):
-                filename = f"{i:06d}.jpg"
-                blob_path = f"{DATASET_VERSION}/images/{label}/{filename}"
-                blob = bucket.blob(blob_path)
-                if blob.exists():
-                    total_cached += 1
+        total_cached += sum(
+            f"{i:06d}.jpg" in cached_files[labels[dish]] for i in range(len(dish_data))
+        )
 
     total_to_download = total_target - total_cached
+    total_backfill = sum(
+        info["sha256"] is None for files in cached_files.values() for info in files.values()
+    ) if save_mode == "gcs" else 0
 
     print("\nDataset summary:")
     print(f"Total target images:      {total_target}")
     print(f"Already cached images:    {total_cached}")
-    print(f"Images left to download:  {total_to_download}\n")
+    print(f"Images left to download:  {total_to_download}")
+    if total_backfill:
+        print(f"Cached without metadata:  {total_backfill} (re-read once to fill their columns)")
+    print()
 
-    with tqdm(total=total_to_download, desc="Downloading images") as pbar:
+    def save(dish, i, content):
+        # Runs in a download worker thread
+        label = dish.lower().replace(" ", "_")
+        filename = f"{i:06d}.jpg"
+        image = prepare_image(content)
+        info = image.describe()
+        if save_mode == "local":
+            return save_local(image.data, label, filename), info
+        return save_gcs(image.data, label, filename, bucket, info), info
 
-        for dish, dish_data in dish_subsets.items():
+    def label_row(image_path, label, row, info):
+        return {
+            "image_path": image_path,
+            "label": label,
+            "portion_size": row.get("portion_size", None),
+            "nutritional_profile": row.get("nutritional_profile", None),
+            **info
+        }
 
-            label = dish.lower().replace(" ", "_")
+    with tqdm(total=total_to_download, desc="Downloading images") as pbar, \
+            Downloader() as downloader:
 
-            # -----------------------------------
-            # PER-DISH RESUME CHECK
-            # -----------------------------------
-            if save_mode == "local":
-                existing_count = count_existing_images(label)
-                if existing_count >= PER_CLASS:
-                    print(f"Skipping {dish} (already complete)")
-                    pbar.update(len(dish_data))
-                    continue
+        jobs = {}           # dish -> [(index, url), ...] still to download
+        dish_rows = {}      # dish -> {index: label row}, cached and downloaded
+
+        for dish, dish_data in dish_subsets.items():
+
+            label = labels[dish]
+            jobs[dish] = []
+            dish_rows[dish] = {}
 
             for i, row in enumerate(dish_data):
                 filename = f"{i:06d}.jpg"
@@ -168,55 +292,32 @@ def create_dataset(save_mode="local"):
                 # Build image path first (for BOTH cached & new images)
                 if save_mode == "local":
                     image_path = f"{DATASET_VERSION}/images/{label}/{filename}"
-                    image_local_path = os.path.join(
-                        BASE_DATA_DIR,
-                        image_path
-                    )
-                    cached = os.path.exists(image_local_path)
-
                 else:  # gcs
-                    blob_path = f"{DATASET_VERSION}/images/{label}/{filename}"
-                    image_path = f"gs://{bucket.name}/{blob_path}"
-                    blob = bucket.blob(blob_path)
-                    cached = blob.exists()
-
-                try:
-                    # -----------------------------
-                    # Download ONLY if not cached
-                    # -----------------------------
-                    if not cached:
-                        url = row.get("image_url")
-                        if not isinstance(url, str):
-                            pbar.update(1)
-                            continue
-
-                        response = session.get(url, timeout=15)
-                        response.raise_for_status()
-
-                        img = Image.open(io.BytesIO(response.content)).convert("RGB")
-
-                        if save_mode == "local":
-                            save_local(img, label, filename)
-                        else:
-                            save_gcs(img, label, filename, bucket)
-
-                        pbar.update(1)
-
-                    # -----------------------------
-                    # ALWAYS append label row
-                    # -----------------------------
-                    labels_rows.append({
-                        "image_path": image_path,
-                        "label": label,
-                        "portion_size": row.get("portion_size", None),
-                        "nutritional_profile": row.get("nutritional_profile", None)
-                    })
-
-                except Exception as e:
-                    print("Failed:", e)
-                    if not cached:
-                        pbar.update(1)
-    session.close()
+                    image_path = f"gs://{bucket.name}/{DATASET_VERSION}/images/{label}/{filename}"
+
+                # Download ONLY if not cached
+                if filename in cached_files[label]:
+                    info = cached_image_info(
+                        save_mode, image_path, cached_files[label][filename], previous, bucket
+                    )
+                    dish_rows[dish][i] = label_row(image_path, label, row, info)
+                elif isinstance(row.get("image_url"), str):
+                    jobs[dish].append((i, row.get("image_url")))
+                else:
+                    pbar.update(1)
+
+        # Every dish downloads side by side; results come back in row order
+        for dish, i, saved, error in downloader.download(jobs, save):
+            pbar.update(1)
+            if error is not None:
+                print("Failed:", error)
+                continue
+            image_path, info = saved
+            dish_rows[dish][i] = label_row(image_path, labels[dish], dish_subsets[dish][i], info)
+
+    # ALWAYS append label rows, in dish then row order
+    for rows in dish_rows.values():
+        labels_rows.extend(rows[i] for i in sorted(rows))
 
     return labels_rows
 
@@ -312,7 +413,8 @@ if __name__ == "__main__":
         "total_samples": len(labels_df),
         "class_distribution": labels_df["label"].value_counts().to_dict(),
         "source_dataset": "Codatta/MM-Food-100K",
-        "seed": 42  # Don't change
+        "seed": SEED,
+        "streaming": STREAMING
     }
 
     # ---- Save ----
@@ -0,0 +1,206 @@
+"""
+Concurrent image downloads for the dataset builds (`make clean_dataset`, `make dataset`).
+
+    with Downloader() as downloader:
+        for dish, key, result, error in downloader.download(jobs, process, limit=PER_CLASS):
+            ...
+
+A bounded thread pool fetches URLs over one pooled `requests.Session` (up to
+DOWNLOAD_PER_HOST keep-alive connections per host), with an optional per-host
+rate limit and retries with exponential backoff on timeouts, connection errors,
+429 and 5xx. `process` (validate / save) runs in the worker threads too.
+
+Dishes are downloaded side by side, so one slow host never stalls the build.
+Results are still handed back per dish in input order, whatever order they
+finish in, and a dish stops (pending downloads cancelled) as soon as `limit`
+of them succeeded: file names derived from that order are deterministic.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dine.params import (
+    DOWNLOAD_WORKERS, DOWNLOAD_PER_HOST, DOWNLOAD_HOST_RATE,
+    DOWNLOAD_RETRIES, DOWNLOAD_TIMEOUT_S, DOWNLOAD_BACKOFF_S,
+)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRY_AFTER_S = 60      # cap on a server's Retry-After
+HOST_POOLS = 64             # hosts whose connection pools are kept open
+
+
+class _Group:
+    """Download progress of one dish."""
+
+    def __init__(self, items):
+        self.items     = list(items)    # [(key, url), ...] in priority order
+        self.submitted = 0              # items handed to the pool
+        self.emitted   = 0              # items yielded, in order
+        self.successes = 0
+        self.results   = {}             # position -> (result, error), finished but not yet yielded
+        self.pending   = set()          # futures in flight
+        self.done      = False
+
+    def wants_more(self, limit) -> bool:
+        """Keep a few downloads ahead of what `limit` still needs, to cover failures."""
+        if self.done or self.submitted >= len(self.items):
+            return False
+        if limit is None:
+            return True
+        needed = limit - self.successes
+        return self.submitted - self.emitted < needed + needed // 4 + 1
+
+
+class Downloader:
+    """Bounded, host-aware pool of HTTP downloads; see the module docstring."""
+
+    def __init__(self, workers: int = DOWNLOAD_WORKERS, per_host: int = DOWNLOAD_PER_HOST,
+                 host_rate: float = DOWNLOAD_HOST_RATE, retries: int = DOWNLOAD_RETRIES,
+                 timeout: float = DOWNLOAD_TIMEOUT_S, backoff_s: float = DOWNLOAD_BACKOFF_S):
+        self.workers   = workers
+        self.per_host  = per_host
+        self.interval  = 1.0 / host_rate if host_rate else 0.0
+        self.retries   = retries
+        self.timeout   = (min(5.0, timeout), timeout)      # (connect, read)
+        self.backoff_s = backoff_s
+
+        # The adapter's connection pools are thread-safe; per-host slots below keep
+        # each host within pool_maxsize, so connections are always reused
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Mozilla/5.0"
+        adapter = HTTPAdapter(pool_connections=HOST_POOLS, pool_maxsize=per_host, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._pool      = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="download")
+        self._lock      = threading.Lock()
+        self._slots     = {}            # host -> BoundedSemaphore(per_host)
+        self._next_slot = {}            # host -> monotonic time of its next allowed request
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._session.close()
+
+    # -- Single URL -------------------------------------------------------------------
+
+    @contextmanager
+    def _host_slot(self, host: str):
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = threading.BoundedSemaphore(self.per_host)
+            if self.interval:
+                now   = time.monotonic()
+                start = max(now, self._next_slot.get(host, now))
+                self._next_slot[host] = start + self.interval
+        with slot:
+            if self.interval and start > now:
+                time.sleep(start - now)
+            yield
+
+    def _backoff(self, attempt: int, response=None) -> float:
+        retry_after = response is not None and response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_AFTER_S)
+        return self.backoff_s * 2 ** attempt * random.uniform(0.5, 1.5)
+
+    def fetch(self, url: str) -> bytes:
+        """GET `url`, retrying transient failures; raises the last error."""
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            raise ValueError(f"Not an http(s) URL: {url!r}")
+        host = urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with self._host_slot(host):
+                    response = self._session.get(url, timeout=self.timeout)
+                    response.raise_for_status()
+                    return response.content
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+            except requests.HTTPError as exc:
+                if response.status_code not in RETRY_STATUSES:
+                    raise
+                error = exc
+            if attempt < self.retries:
+                time.sleep(self._backoff(attempt, response))
+        raise error
+
+    def _job(self, group, key, url, process):
+        try:
+            return process(group, key, self.fetch(url)), None
+        except Exception as exc:
+            return None, exc
+
+    # -- Many URLs ------------------------------------------------------------------------
+
+    def download(self, jobs: dict, process, limit: int = None):
+        """
+        Download `jobs` ({group: [(key, url), ...]}) and run
+        `process(group, key, content)` on each body in a worker thread.
+
+        Yields (group, key, result, error) with `error` None on success, per group
+        in input order. After a group's `limit`-th success its remaining items are
+        dropped: neither downloaded nor yielded.
+        """
+        groups  = {name: _Group(items) for name, items in jobs.items()}
+        futures = {}                    # future -> (group, position)
+        window  = 2 * self.workers      # downloads queued or in flight
+
+        try:
+            while True:
+                # Top up the pool round-robin, so every group keeps making progress
+                added = True
+                while added and len(futures) < window:
+                    added = False
+                    for name, group in groups.items():
+                        if len(futures) >= window:
+                            break
+                        if group.wants_more(limit):
+                            key, url = group.items[group.submitted]
+                            future = self._pool.submit(self._job, name, key, url, process)
+                            futures[future] = (name, group.submitted)
+                            group.pending.add(future)
+                            group.submitted += 1
+                            added = True
+                if not futures:
+                    return
+
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, position = futures.pop(future)
+                    group = groups[name]
+                    group.pending.discard(future)
+                    if group.done or future.cancelled():
+                        continue
+                    group.results[position] = future.result()
+
+                    # Release whatever is now contiguous from the front, in order
+                    while group.emitted in group.results and not group.done:
+                        result, error = group.results.pop(group.emitted)
+                        key = group.items[group.emitted][0]
+                        group.emitted += 1
+                        if error is None:
+                            group.successes += 1
+                        yield name, key, result, error
+                        if limit is not None and group.successes >= limit:
+                            group.done = True
+                            group.results.clear()
+                            for pending in group.pending:
+                                pending.cancel()     # in-flight ones finish; results are dropped
+        finally:
+            for future in futures:
+                future.cancel()
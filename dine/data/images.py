@@ -0,0 +1,67 @@
+"""
+Validation and storage format of downloaded dataset images.
+
+`prepare_image` checks a download from its header plus a draft decode (JPEGs
+decoded at 1/8 scale: cheap, but libjpeg still walks the whole compressed
+stream, so truncated or corrupt files fail) and returns the bytes to store:
+
+- RGB or grayscale JPEGs no larger than DATASET_MAX_IMAGE_SIDE are stored byte
+  for byte: no second lossy generation, EXIF kept (dine.preprocessing applies
+  its orientation);
+- anything else (PNG, WebP, CMYK, oversized, ...) is transcoded once to an
+  upright RGB JPEG at DATASET_JPEG_QUALITY, downscaled to DATASET_MAX_IMAGE_SIDE.
+"""
+
+import hashlib
+import io
+from typing import NamedTuple
+
+from PIL import Image, ImageOps
+
+from dine.params import DATASET_MAX_IMAGE_SIDE, DATASET_JPEG_QUALITY
+
+PASS_THROUGH_MODES = {"RGB", "L"}      # JPEG modes stored as downloaded
+
+# Per-image columns recorded in labels.csv
+IMAGE_COLUMNS = ("file_size", "width", "height", "sha256")
+
+
+class StoredImage(NamedTuple):
+    data:       bytes                   # JPEG bytes to write
+    width:      int                     # of the stored pixels (before EXIF orientation)
+    height:     int
+    sha256:     str                     # hex digest of `data`
+    transcoded: bool                    # False: `data` is the downloaded file
+
+    def describe(self) -> dict:
+        """The per-image columns recorded in labels.csv."""
+        return {"file_size": len(self.data), "width": self.width,
+                "height": self.height, "sha256": self.sha256}
+
+
+def describe_image(data: bytes) -> dict:
+    """labels.csv columns of already stored JPEG bytes (header read only)."""
+    width, height = Image.open(io.BytesIO(data)).size
+    return {"file_size": len(data), "width": width, "height": height,
+            "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def prepare_image(content: bytes, max_side: int = DATASET_MAX_IMAGE_SIDE,
+                  quality: int = DATASET_JPEG_QUALITY) -> StoredImage:
+    """Validate downloaded `content` and return what to store; raises if it is not a usable image."""
+    img = Image.open(io.BytesIO(content))       # parses the header only
+    width, height = img.size
+
+    if img.format == "JPEG" and img.mode in PASS_THROUGH_MODES and max(width, height) <= max_side:
+        img.draft(img.mode, (max(1, width // 8), max(1, height // 8)))
+        img.load()
+        return StoredImage(content, width, height, hashlib.sha256(content).hexdigest(), False)
+
+    # ---- TRANSCODE ----
+    img.draft("RGB", (max_side, max_side))      # JPEGs: skip detail the downscale drops anyway
+    img = ImageOps.exif_transpose(img).convert("RGB")
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=quality)
+    data = out.getvalue()
+    return StoredImage(data, img.width, img.height, hashlib.sha256(data).hexdigest(), True)
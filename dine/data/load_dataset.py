@@ -5,6 +5,7 @@ from google.cloud import storage
 from PIL import Image
 
 from dine.params import *
+from dine.preprocessing import IMAGE_SIZE, load_image
 
 # Instantiate the filesystem (handles authentication via Application Default Credentials)
 fs = GCSFileSystem()
@@ -23,16 +24,19 @@ def load_labels_csv_from_gcs(bucket_name: str = GCS_BUCKET_NAME,
 
     return df
 
-def load_image_from_gcs(image_gcs_uri: str) -> Image.Image:
+def load_image_from_gcs(image_gcs_uri: str, size=IMAGE_SIZE) -> Image.Image:
     """
     Load image from full GCS URI:
     gs://mmfood/v1-portion/images/apple/000000.jpg
+
+    Decoded with dine.preprocessing.load_image (upright, RGB, `size`), so training
+    sees exactly the pixels /predict and `dine score` see for the same file.
     """
 
     with fs.open(image_gcs_uri, "rb") as f:
-        image = Image.open(f).convert("RGB")
+        data = f.read()
 
-    return image
+    return load_image(data, size)
 
 
 # Example usage
@@ -0,0 +1,235 @@
+"""
+On-disk store of backbone embeddings for the dataset, memory-mapped.
+
+    <store>/manifest.json   backbone, preprocessing, dtype, dim and row count
+    <store>/embeddings.bin  (count, dim) row-major float16/float32 matrix
+    <store>/paths.txt       image_path of each row, one per line (as in labels.csv)
+
+Opening a store maps the matrix without reading it, so training, evaluation
+and the API's kNN tools get 100K x 1280 embeddings in milliseconds and the
+OS pages in only the rows they touch.
+
+The store is append-only: `build_store` embeds just the labels.csv rows that
+are not in it yet, and checkpoints the manifest after every batch, so an
+interrupted build resumes where it stopped. Rows beyond the manifest's count
+(a crash mid-batch) are overwritten by the next append.
+
+    dine embed demo_v11.0 $BASE_DATA_DIR/v1/labels.csv $BASE_DATA_DIR/v1/embeddings
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dine.preprocessing import IMAGE_SIZE, PREPROCESSING_ID
+
+MANIFEST = "manifest.json"
+MATRIX   = "embeddings.bin"
+PATHS    = "paths.txt"
+DTYPES   = ("float16", "float32")
+
+
+class EmbeddingStore:
+    """Append-only (image_path → embedding row) store backed by a memory-mapped matrix."""
+
+    def __init__(self, directory, manifest: dict):
+        self.directory = Path(directory)
+        self.manifest  = manifest
+        self.dtype     = np.dtype(manifest["dtype"])
+        self.dim       = int(manifest["dim"])
+        self._paths    = None
+        self._index    = None
+        self._matrix   = None
+        self._trimmed  = False
+
+    # -- Open / create ------------------------------------------------------------
+
+    @classmethod
+    def open(cls, directory) -> "EmbeddingStore":
+        """Open an existing store (FileNotFoundError if there is none)."""
+        directory = Path(directory)
+        with open(directory / MANIFEST) as f:
+            return cls(directory, json.load(f))
+
+    @classmethod
+    def create(cls, directory, backbone: str, dim: int = 1280, dtype: str = "float16",
+               preprocessing: str = PREPROCESSING_ID) -> "EmbeddingStore":
+        """
+        Open the store at `directory`, creating it if needed.
+
+        An existing store must have been built with the same backbone,
+        preprocessing, dtype and dim; mixing embeddings is refused with ValueError.
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unsupported dtype '{dtype}'. Available: {', '.join(DTYPES)}")
+        wanted = {
+            "backbone":      backbone,
+            "preprocessing": preprocessing,
+            "image_size":    list(IMAGE_SIZE),
+            "dtype":         dtype,
+            "dim":           int(dim),
+        }
+        directory = Path(directory)
+        if (directory / MANIFEST).exists():
+            store = cls.open(directory)
+            clashes = [key for key, value in wanted.items() if store.manifest.get(key) != value]
+            if clashes:
+                details = ", ".join(f"{k}: {store.manifest.get(k)!r} != {wanted[k]!r}" for k in clashes)
+                raise ValueError(f"Embedding store {directory} was built differently ({details})")
+            return store
+
+        directory.mkdir(parents=True, exist_ok=True)
+        store = cls(directory, {**wanted, "count": 0})
+        (directory / MATRIX).touch()
+        (directory / PATHS).touch()
+        store._save_manifest()
+        return store
+
+    # -- Read ---------------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return int(self.manifest["count"])
+
+    def __contains__(self, image_path: str) -> bool:
+        return image_path in self.index
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Read-only (count, dim) memory map of every stored embedding."""
+        if self._matrix is None or len(self._matrix) != len(self):
+            if len(self) == 0:
+                self._matrix = np.empty((0, self.dim), dtype=self.dtype)
+            else:
+                self._matrix = np.memmap(self.directory / MATRIX, dtype=self.dtype,
+                                         mode="r", shape=(len(self), self.dim))
+        return self._matrix
+
+    @property
+    def paths(self) -> list:
+        """image_path of each row, in row order."""
+        if self._paths is None:
+            with open(self.directory / PATHS, encoding="utf-8") as f:
+                self._paths = f.read().split("\n")[:len(self)]
+        return self._paths
+
+    @property
+    def index(self) -> dict:
+        """image_path → row number (built on first use)."""
+        if self._index is None:
+            self._index = {path: row for row, path in enumerate(self.paths)}
+        return self._index
+
+    def rows(self, image_paths) -> np.ndarray:
+        """Row numbers for `image_paths` (KeyError for any path not in the store)."""
+        index = self.index
+        return np.fromiter((index[p] for p in image_paths), dtype=np.int64)
+
+    def get(self, image_paths, dtype=np.float32) -> np.ndarray:
+        """(N, dim) embeddings for `image_paths`, copied out of the map as `dtype`."""
+        return self.matrix[self.rows(image_paths)].astype(dtype, copy=False)
+
+    def missing(self, image_paths) -> list:
+        """The paths (deduplicated, in order) that have no stored embedding yet."""
+        index = self.index
+        return [p for p in dict.fromkeys(image_paths) if p not in index]
+
+    # -- Write --------------------------------------------------------------------
+
+    def append(self, image_paths, embeddings: np.ndarray) -> None:
+        """Add rows; the manifest is updated last, so a crash never exposes partial rows."""
+        image_paths = list(image_paths)
+        embeddings  = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        if embeddings.shape != (len(image_paths), self.dim):
+            raise ValueError(f"Expected embeddings of shape ({len(image_paths)}, {self.dim}), "
+                             f"got {embeddings.shape}")
+        if any("\n" in p for p in image_paths):
+            raise ValueError("image_path values cannot contain newlines")
+
+        count = len(self)
+        with open(self.directory / MATRIX, "r+b") as f:
+            f.seek(count * self.dim * self.dtype.itemsize)
+            f.write(embeddings.tobytes())
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+
+        paths = self.paths
+        if not self._trimmed:
+            # Drop lines left past `count` by an interrupted append, once per process
+            with open(self.directory / PATHS, "w", encoding="utf-8") as f:
+                f.writelines(p + "\n" for p in paths)
+            self._trimmed = True
+        with open(self.directory / PATHS, "a", encoding="utf-8") as f:
+            f.writelines(p + "\n" for p in image_paths)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.manifest["count"] = count + len(image_paths)
+        self._save_manifest()
+        paths.extend(image_paths)
+        if self._index is not None:
+            self._index.update((p, count + i) for i, p in enumerate(image_paths))
+
+    def _save_manifest(self) -> None:
+        self.manifest["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        tmp = self.directory / (MANIFEST + ".part")
+        tmp.write_text(json.dumps(self.manifest, indent=2))
+        os.replace(tmp, self.directory / MANIFEST)
+
+
+def build_store(directory, version: str, labels_path: str, *, root: str = None,
+                dtype: str = "float16", batch_size: int = 128, workers: int = None,
+                prefetch: int = 2, limit: int = None) -> EmbeddingStore:
+    """
+    Embed every labels.csv image that `directory` does not have yet.
+
+    `version` must be a head-only MODEL_CONFIGS entry; its feature extractor
+    (and backend) defines the backbone recorded in the manifest. Undecodable
+    images are reported and skipped, so the next run retries them.
+    """
+    # Imported here: TensorFlow is only needed once we actually embed
+    from api.backends import index_backbone
+    from api.model_config import MODEL_CONFIGS
+    from api.registry import ModelRegistry
+    from dine.scoring import iter_batches, read_labels, resolve_sources
+
+    config = MODEL_CONFIGS[version]
+    if config["input_type"] != "embeddings":
+        raise ValueError(f"{version} is an end-to-end model; pick a head-only version "
+                         f"to define the backbone")
+    backbone = index_backbone(config)
+    store    = EmbeddingStore.create(directory, backbone, dtype=dtype)
+
+    labels = read_labels(labels_path)
+    if limit:
+        labels = labels.head(limit)
+    todo = store.missing(labels["image_path"].astype(str))
+    print(f"[{version}] {len(store)} embeddings stored, {len(todo)} to add")
+    if not todo:
+        return store
+
+    sources = resolve_sources(pd.DataFrame({"image_path": todo}), labels_path, root)
+    model   = ModelRegistry(default_version=version).load(version)
+    start   = time.perf_counter()
+    failed  = 0
+    try:
+        for offset, batch, errors in iter_batches(sources, batch_size, workers, prefetch):
+            ok = np.array([e is None for e in errors])
+            failed += int((~ok).sum())
+            if ok.any():
+                (embeddings,) = model.feature_extractor(batch if ok.all() else batch[ok])
+                keep = [p for p, good in zip(todo[offset:offset + len(batch)], ok) if good]
+                store.append(keep, embeddings)
+            done = offset + len(batch)
+            print(f"[{version}] {done}/{len(todo)} images, "
+                  f"{done / (time.perf_counter() - start):.1f} img/s")
+    finally:
+        model.close()
+
+    if failed:
+        print(f"[{version}] WARNING: {failed} images could not be decoded and were skipped")
+    return store
@@ -0,0 +1,282 @@
+"""
+Nearest-neighbour index over backbone embeddings of the labelled dataset.
+
+Given a query image's 1280-dim embedding, find the most similar training
+images (cosine similarity) and return their dish labels and nutrition: to
+explain a prediction ("looks like these") and as a fallback estimate
+(similarity-weighted vote and mean of the neighbours' labels).
+
+    flat   — exact: one BLAS matrix product against every stored vector
+    ivf    — spherical k-means lists; only the `nprobe` closest lists are scanned
+    ivfpq  — ivf lists holding product-quantized codes (m bytes per vector
+             instead of 4 x 1280) for datasets that outgrow RAM
+
+Built from an `EmbeddingStore` plus labels.csv and saved as .npy files that
+are memory-mapped on load:
+
+    dine knn $BASE_DATA_DIR/v1/embeddings $BASE_DATA_DIR/v1/labels.csv $BASE_DATA_DIR/v1/knn
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+KINDS = ("flat", "ivf", "ivfpq")
+
+# Label columns carried with each vector (labels.csv names) and their API names
+NUTRITION = ("calories_kcal", "protein_g", "carbohydrate_g", "fat_g")
+API_NAMES = ("calories", "protein_g", "carbs_g", "fat_g")
+
+INDEX_MANIFEST = "knn.json"
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int):
+    """Indices of the k largest scores per row, best first."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 20, spherical: bool = False, seed: int = 42):
+    """Lloyd's k-means (cosine when `spherical`), returning (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        if spherical:
+            assign = np.argmax(x @ centroids.T, axis=1)
+        else:
+            # ||x - c||² up to the per-row constant ||x||²
+            assign = np.argmin((centroids ** 2).sum(1) - 2 * x @ centroids.T, axis=1)
+        counts = np.bincount(assign, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters on random points so every list gets used
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        if spherical:
+            centroids = _normalize(centroids)
+    return centroids.astype(np.float32), assign
+
+
+class KnnIndex:
+    """Similarity search over labelled embeddings; see the module docstring for kinds."""
+
+    def __init__(self, manifest: dict, arrays: dict):
+        self.manifest   = manifest
+        self.kind       = manifest["kind"]
+        self.nprobe     = manifest.get("nprobe", 1)
+        self.image_path = arrays["image_path"]
+        self.dish       = arrays["dish"]
+        self.nutrition  = arrays["nutrition"]          # (N, len(NUTRITION)) float32
+        self.vectors    = arrays.get("vectors")        # flat / ivf: (N, dim), list order
+        self.centroids  = arrays.get("centroids")      # ivf*: (nlist, dim)
+        self.offsets    = arrays.get("offsets")        # ivf*: list i = rows offsets[i]:offsets[i+1]
+        self.ids        = arrays.get("ids")            # ivf*: list order → label row
+        self.codes      = arrays.get("codes")          # ivfpq: (N, m) uint8
+        self.codebooks  = arrays.get("codebooks")      # ivfpq: (m, ksub, dim / m)
+
+    def __len__(self) -> int:
+        return len(self.dish)
+
+    @property
+    def backbone(self) -> str:
+        return self.manifest.get("backbone", "")
+
+    # -- Build ----------------------------------------------------------------------
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, dish, nutrition, image_path, *,
+              kind: str = "flat", nlist: int = None, nprobe: int = 8, m: int = 64,
+              backbone: str = "") -> "KnnIndex":
+        """Index `embeddings` (N, dim) with one dish label and nutrition row per vector."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown index kind '{kind}'. Available: {', '.join(KINDS)}")
+        vectors = _normalize(embeddings)
+        n, dim  = vectors.shape
+        arrays  = {
+            "image_path": np.asarray(image_path, dtype=str),
+            "dish":       np.asarray(dish, dtype=str),
+            "nutrition":  np.asarray(nutrition, dtype=np.float32),
+        }
+        manifest = {"kind": kind, "dim": dim, "count": n, "backbone": backbone,
+                    "nutrition": list(NUTRITION)}
+
+        if kind == "flat":
+            arrays["vectors"] = vectors
+            return cls(manifest, arrays)
+
+        # --- Coarse quantizer: vectors grouped by their closest centroid ---
+        nlist = nlist or max(1, int(np.sqrt(n)))
+        centroids, assign = _kmeans(vectors, nlist, spherical=True)
+        order = np.argsort(assign, kind="stable")
+        arrays.update(
+            centroids=centroids,
+            offsets=np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))]),
+            ids=order.astype(np.int64),
+        )
+        manifest.update(nlist=len(centroids), nprobe=min(nprobe, len(centroids)))
+
+        if kind == "ivf":
+            arrays["vectors"] = vectors[order]
+            return cls(manifest, arrays)
+
+        # --- Product quantization: m sub-vectors, 256 centroids each ---
+        if dim % m:
+            raise ValueError(f"m={m} must divide the embedding dimension {dim}")
+        subs = vectors[order].reshape(n, m, dim // m)
+        codebooks, codes = [], []
+        for j in range(m):
+            book, code = _kmeans(subs[:, j], 256, iters=10, seed=j)
+            codebooks.append(np.pad(book, ((0, 256 - len(book)), (0, 0))))
+            codes.append(code)
+        arrays.update(codebooks=np.stack(codebooks), codes=np.stack(codes, axis=1).astype(np.uint8))
+        manifest.update(m=m)
+        return cls(manifest, arrays)
+
+    # -- Persistence ----------------------------------------------------------------
+
+    def save(self, directory) -> None:
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        names = ("image_path", "dish", "nutrition", "vectors", "centroids",
+                 "offsets", "ids", "codes", "codebooks")
+        for name in names:
+            array = getattr(self, name)
+            if array is not None:
+                np.save(directory / f"{name}.npy", np.asarray(array))
+        tmp = directory / (INDEX_MANIFEST + ".part")
+        tmp.write_text(json.dumps(self.manifest, indent=2))
+        os.replace(tmp, directory / INDEX_MANIFEST)
+
+    @classmethod
+    def load(cls, directory) -> "KnnIndex":
+        """Memory-map a saved index (the vectors are paged in by the first queries)."""
+        directory = Path(directory)
+        manifest  = json.loads((directory / INDEX_MANIFEST).read_text())
+        arrays    = {
+            path.stem: np.load(path, mmap_mode="r" if path.stem in ("vectors", "codes") else None)
+            for path in directory.glob("*.npy")
+        }
+        return cls(manifest, arrays)
+
+    # -- Search ---------------------------------------------------------------------
+
+    def search(self, queries: np.ndarray, k: int = 5):
+        """
+        Cosine top-k for (Q, dim) `queries` (or one (dim,) vector).
+
+        Returns (similarities (Q, k) float32, rows (Q, k) int64 into the label arrays).
+        """
+        queries = _normalize(np.atleast_2d(queries))
+        if self.kind == "flat":
+            scores = queries @ np.asarray(self.vectors).T       # one sgemm for the whole batch
+            rows   = _top_k(scores, k)
+            return np.take_along_axis(scores, rows, axis=1), rows
+
+        similarities, rows = [], []
+        probes = _top_k(queries @ self.centroids.T, self.nprobe)
+        for query, lists in zip(queries, probes):
+            spans      = [(self.offsets[i], self.offsets[i + 1]) for i in lists]
+            candidates = np.concatenate([np.arange(a, b) for a, b in spans])
+            scores     = self._scores(query, spans)[None]
+            best       = _top_k(scores, k)[0]
+            similarities.append(scores[0, best])
+            rows.append(self.ids[candidates[best]])
+        return _stack(similarities, k, np.float32), _stack(rows, k, np.int64, fill=-1)
+
+    def _scores(self, query: np.ndarray, spans: list) -> np.ndarray:
+        """Similarity of `query` to every vector in the probed lists (contiguous row spans)."""
+        if self.kind == "ivf":
+            return np.concatenate([self.vectors[a:b] @ query for a, b in spans])
+        # ivfpq: per-subspace lookup tables, then sum each candidate's m table entries
+        m      = self.codebooks.shape[0]
+        tables = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(m, -1))
+        codes  = np.concatenate([self.codes[a:b] for a, b in spans])
+        return tables[np.arange(m), codes].sum(axis=1)
+
+    def neighbours(self, query: np.ndarray, k: int = 5) -> list:
+        """The k most similar labelled images for one embedding, as response dicts."""
+        similarities, rows = self.search(query, k)
+        return self.neighbours_from(similarities[0], rows[0])
+
+    def estimate(self, query: np.ndarray, k: int = 5) -> dict:
+        """Fallback prediction for one embedding; see `estimate_from`."""
+        similarities, rows = self.search(query, k)
+        return self.estimate_from(similarities[0], rows[0])
+
+    def neighbours_from(self, similarities: np.ndarray, rows: np.ndarray) -> list:
+        """Response dicts for one query's `search` results."""
+        return [
+            {
+                "image_path": str(self.image_path[row]),
+                "dish":       str(self.dish[row]),
+                "similarity": round(float(sim), 4),
+                "nutrition":  self._nutrition(self.nutrition[row]),
+            }
+            for sim, row in zip(similarities, rows) if row >= 0
+        ]
+
+    def estimate_from(self, similarities: np.ndarray, rows: np.ndarray) -> dict:
+        """
+        Fallback prediction from one query's `search` results: similarity-weighted
+        dish vote and nutrition mean of the neighbours, in the /predict response format.
+        """
+        keep    = rows >= 0
+        rows    = rows[keep]
+        weights = np.maximum(similarities[keep], 0.0) + 1e-6
+        dishes, votes = np.unique(self.dish[rows], return_inverse=True)
+        totals  = np.bincount(votes, weights=weights)
+        best    = int(np.argmax(totals))
+        return {
+            "dish":       str(dishes[best]),
+            "confidence": round(float(totals[best] / totals.sum()), 3),
+            "nutrition":  self._nutrition(weights @ self.nutrition[rows] / weights.sum()),
+        }
+
+    @staticmethod
+    def _nutrition(values) -> dict:
+        out = {name: round(float(v), 1) for name, v in zip(API_NAMES, values)}
+        out["calories"] = int(round(out["calories"]))
+        return out
+
+
+def _stack(parts: list, k: int, dtype, fill=0):
+    """Stack per-query results, padding queries whose probed lists held < k vectors."""
+    out = np.full((len(parts), k), fill, dtype=dtype)
+    for i, part in enumerate(parts):
+        out[i, :len(part)] = part
+    return out
+
+
+def build_index(store_dir, labels_path: str, out_dir, **options) -> KnnIndex:
+    """Index every labels.csv row that has a stored embedding and full nutrition labels."""
+    from dine.embeddings import EmbeddingStore
+    from dine.scoring import read_labels
+
+    store  = EmbeddingStore.open(store_dir)
+    labels = read_labels(labels_path).drop_duplicates("image_path")
+    usable = labels["image_path"].isin(store.index) & labels[list(NUTRITION)].notna().all(axis=1)
+    if not usable.all():
+        print(f"Skipping {int((~usable).sum())} rows without an embedding or nutrition labels")
+    labels = labels[usable]
+    if labels.empty:
+        raise ValueError(f"No labels.csv rows have embeddings in {store_dir}")
+
+    index = KnnIndex.build(
+        store.get(labels["image_path"]),
+        dish=labels["label"], nutrition=labels[list(NUTRITION)].to_numpy(),
+        image_path=labels["image_path"], backbone=store.manifest["backbone"], **options,
+    )
+    index.save(out_dir)
+    return index
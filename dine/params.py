@@ -18,6 +18,20 @@ DATASET_VERSION = "v1"
 
 # --- Only when running `make clean_dataset`
 SAVE_MODE = "local"  # or "gcs"
+# Stream MM-Food-100K instead of downloading it to the datasets cache
+# (same sample as the default mode)
+STREAMING = os.getenv("DATASET_STREAMING", "0") == "1"
+
+# --- Image downloads (`make clean_dataset` and `make dataset`) ---
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "32"))          # concurrent downloads
+DOWNLOAD_PER_HOST = int(os.getenv("DOWNLOAD_PER_HOST", "8"))         # connections per host
+DOWNLOAD_HOST_RATE = float(os.getenv("DOWNLOAD_HOST_RATE", "0"))     # requests/s per host, 0 = no limit
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_TIMEOUT_S = float(os.getenv("DOWNLOAD_TIMEOUT_S", "15"))
+DOWNLOAD_BACKOFF_S = float(os.getenv("DOWNLOAD_BACKOFF_S", "0.5"))   # doubles per retry
+# Downloaded JPEGs are stored as-is; other formats and larger images are re-encoded
+DATASET_MAX_IMAGE_SIDE = int(os.getenv("DATASET_MAX_IMAGE_SIDE", "4096"))  # px
+DATASET_JPEG_QUALITY = 90
 
 # --- Only when running `make dataset` ---
 OUTPUT_FILENAME = "candidates.csv"
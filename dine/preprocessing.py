@@ -0,0 +1,127 @@
+"""
+Image decoding shared by the API, bulk scoring and training.
+
+Phone photos are ~12 MP; the model sees 224x224. Instead of decoding every
+pixel and resizing afterwards, JPEGs are decoded straight at a reduced scale
+(libjpeg DCT scaling via `Image.draft`), box-reduced to within 2x of the target
+with `Image.reduce`, and only then resampled. EXIF orientation is applied so a
+portrait photo reaches the model upright.
+
+Pixels come out as float32 in [0, 255]: EfficientNet's `preprocess_input` is a
+pass-through (rescaling lives inside the model), so no further transform is needed.
+
+Use the same functions everywhere so that serving, scoring and training all see
+identical pixels.
+"""
+
+import io
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZE = (224, 224)     # (width, height)
+
+# Bump when the decode/resize path changes, so stored embeddings built with the
+# old pixels are not silently mixed with new ones (see dine/embeddings.py).
+PREPROCESSING_ID = "draft-reduce-bicubic-exif-rgb255/v1"
+
+# EXIF Orientation tag (0x0112) -> transpose that makes the image upright
+_ORIENTATION = 0x0112
+_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def _open(source) -> Image.Image:
+    """Open raw bytes, a path or a binary file object without decoding pixels."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    elif isinstance(source, Path):
+        source = str(source)
+    return Image.open(source)
+
+
+def load_image(source, size=IMAGE_SIZE) -> Image.Image:
+    """
+    Decode `source` into an upright RGB PIL image of exactly `size` (width, height).
+
+    Decoding is done at the smallest JPEG scale (1/1 … 1/8) that is still at
+    least `size`, so a 4032x3024 photo is decoded as 504x378 rather than 12 MP.
+    """
+    img = _open(source)
+    transpose = _TRANSPOSE.get(img.getexif().get(_ORIENTATION, 1))
+
+    # Rotations by 90 degrees swap the axes the target applies to.
+    width, height = size
+    if transpose in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                     Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270):
+        width, height = height, width
+
+    # ---- DECODE AT REDUCED SCALE (JPEG only; no-op for other formats) ----
+    img.draft("RGB", (width, height))
+
+    # ---- BOX-REDUCE TO WITHIN 2x OF THE TARGET ----
+    factor = min(img.width // (2 * width), img.height // (2 * height))
+    if factor > 1:
+        img = img.reduce(factor)
+
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if transpose is not None:
+        img = img.transpose(transpose)
+
+    # ---- FINAL RESAMPLE ----
+    if img.size != tuple(size):
+        img = img.resize(size, Image.Resampling.BICUBIC)
+    return img
+
+
+def decode_into(source, out: np.ndarray) -> np.ndarray:
+    """
+    Decode `source` into the preallocated (H, W, 3) array `out` (any numeric dtype).
+
+    Typically `out` is one row of a batch buffer from `empty_batch`, so the
+    decoded pixels are written once, straight where the model will read them.
+    """
+    height, width = out.shape[:2]
+    out[...] = np.asarray(load_image(source, (width, height)))
+    return out
+
+
+def decode_image(source, size=IMAGE_SIZE, dtype=np.float32) -> np.ndarray:
+    """Decode `source` into a new (H, W, 3) array."""
+    return decode_into(source, np.empty((size[1], size[0], 3), dtype=dtype))
+
+
+def empty_batch(n: int, size=IMAGE_SIZE, dtype=np.float32) -> np.ndarray:
+    """Allocate an uninitialised (n, H, W, 3) batch buffer for `decode_into`."""
+    return np.empty((n, size[1], size[0], 3), dtype=dtype)
+
+
+def decode_batch(sources, size=IMAGE_SIZE, dtype=np.float32, out=None, pool=None):
+    """
+    Decode `sources` into one (N, H, W, 3) buffer, optionally on an executor `pool`.
+
+    Returns (batch, errors) where errors[i] is None for decoded rows and the
+    exception message for rows that failed (their contents are undefined).
+    """
+    sources = list(sources)
+    batch   = empty_batch(len(sources), size, dtype) if out is None else out
+
+    def decode(i):
+        try:
+            decode_into(sources[i], batch[i])
+            return None
+        except Exception as exc:
+            return str(exc)
+
+    indices = range(len(sources))
+    errors  = list(pool.map(decode, indices) if pool is not None else map(decode, indices))
+    return batch, errors
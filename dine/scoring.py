@@ -0,0 +1,307 @@
+"""
+Offline bulk scoring: run a MODEL_CONFIGS version over a labels.csv.
+
+    dine score demo_v11.0 $BASE_DATA_DIR/v1/labels.csv -o preds.parquet
+
+Images stream through a decode pipeline: a thread pool (PIL releases the GIL
+while decoding) fills a small ring of preallocated batch buffers, so the next
+batches are ready while the model scores the current one and memory stays at
+`prefetch + 2` batches whatever the size of the dataset.
+
+Predictions are written to Parquet next to the label columns; `evaluate`
+computes MAE, median MAPE and per-class bias for fat, protein, carbs and
+(Atwater) calories, the same metrics as docs/Model Experiments Log.md.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from dine.params import BASE_DATA_DIR
+from dine.preprocessing import decode_into, empty_batch
+
+# (truth column in labels.csv, prediction column written by `score`)
+TARGETS = {
+    "fat":      ("fat_g",          "pred_fat_g"),
+    "protein":  ("protein_g",      "pred_protein_g"),
+    "carbs":    ("carbohydrate_g", "pred_carbs_g"),
+    "calories": ("calories_kcal",  "pred_calories"),
+}
+
+_DONE = object()
+
+
+# -- Inputs ---------------------------------------------------------------------
+
+def read_labels(path: str) -> pd.DataFrame:
+    """labels.csv from disk or gs:// (as written by create_dataset / download_subset)."""
+    labels = pd.read_csv(path)
+    if "image_path" not in labels.columns:
+        raise ValueError(f"{path} has no image_path column")
+    return labels
+
+
+def image_root(labels_path: str, image_path: str) -> str:
+    """
+    Directory that relative image paths are relative to.
+
+    create_dataset writes `<version>/images/...` (relative to BASE_DATA_DIR, the
+    parent of the labels.csv directory); download_subset writes `images/...`
+    relative to the labels.csv directory itself.
+    """
+    labels_dir = os.path.dirname(labels_path)
+    if os.path.exists(os.path.join(labels_dir, image_path)):
+        return labels_dir
+    if BASE_DATA_DIR:
+        return BASE_DATA_DIR
+    return os.path.dirname(labels_dir)
+
+
+def resolve_sources(labels: pd.DataFrame, labels_path: str, root: str = None) -> list:
+    """Absolute local paths or gs:// URIs for every row."""
+    paths = labels["image_path"].astype(str)
+    if root is None:
+        first = next((p for p in paths if "://" not in p and not os.path.isabs(p)), None)
+        root  = image_root(labels_path, first) if first is not None else ""
+    return [p if "://" in p or os.path.isabs(p) else os.path.join(root, p) for p in paths]
+
+
+def _read(source: str):
+    """Local paths are decoded in place; remote URIs are fetched as bytes first."""
+    if "://" not in source:
+        return source
+    try:
+        import fsspec
+    except ImportError as exc:
+        raise RuntimeError(
+            "fsspec (and gcsfs for gs://) is required to read remote images. "
+            "Add it to requirements.txt."
+        ) from exc
+    with fsspec.open(source, "rb") as f:
+        return f.read()
+
+
+def _decode_row(source: str, out: np.ndarray):
+    """Read + decode one image into its batch row; the error message on failure."""
+    try:
+        decode_into(_read(source), out)
+        return None
+    except Exception as exc:
+        return str(exc)
+
+
+# -- Decode pipeline --------------------------------------------------------------
+
+def iter_batches(sources: list, batch_size: int = 128, workers: int = None, prefetch: int = 2):
+    """
+    Yield (start, batch, errors) for consecutive slices of `sources`.
+
+    `batch` is a view into a reused buffer: it is only valid until the next
+    iteration, so consume (or copy) it before asking for more.
+    """
+    workers = workers or os.cpu_count() or 1
+    free    = queue.Queue()
+    ready   = queue.Queue(maxsize=prefetch)
+    for _ in range(prefetch + 2):
+        free.put(empty_batch(batch_size))
+    stop = threading.Event()
+
+    def produce():
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="decode") as pool:
+                for start in range(0, len(sources), batch_size):
+                    chunk  = sources[start:start + batch_size]
+                    buffer = free.get()
+                    if stop.is_set():
+                        return
+                    batch  = buffer[:len(chunk)]
+                    errors = list(pool.map(_decode_row, chunk, batch))
+                    ready.put((start, batch, errors, buffer))
+        except Exception as exc:       # surfaced in the consumer
+            ready.put(exc)
+        finally:
+            ready.put(_DONE)
+
+    producer = threading.Thread(target=produce, name="decode-pipeline", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = ready.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            start, batch, errors, buffer = item
+            yield start, batch, errors
+            free.put(buffer)
+    finally:
+        stop.set()
+        free.put(empty_batch(0))        # unblock a producer waiting for a buffer
+        while producer.is_alive():      # drain so it can finish putting
+            try:
+                ready.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+# -- Scoring ----------------------------------------------------------------------
+
+def score(model, sources: list, batch_size: int = 128, workers: int = None,
+          prefetch: int = 2, progress=None, top_k: int = 1) -> pd.DataFrame:
+    """
+    Score every image in `sources` with a loaded `api.registry.ServedModel`.
+
+    Returns one row per source: pred_dish, confidence, pred_* macros and
+    `error` (None, or why the image could not be decoded; its predictions are NaN).
+    With `top_k` > 1, `top_dishes` lists the k most likely dishes.
+    """
+    n       = len(sources)
+    dish    = np.empty(n, dtype=object)
+    columns = {name: np.full(n, np.nan, dtype=np.float64)
+               for name in ("confidence", "pred_fat_g", "pred_protein_g",
+                            "pred_carbs_g", "pred_calories")}
+    errors  = np.full(n, None, dtype=object)
+    top     = np.full(n, None, dtype=object)
+
+    for start, batch, batch_errors in iter_batches(sources, batch_size, workers, prefetch):
+        ok  = np.array([e is None for e in batch_errors])
+        idx = start + np.flatnonzero(ok)
+        errors[start:start + len(batch)] = batch_errors
+        if ok.any():
+            rows = batch if ok.all() else batch[ok]
+            label_probs, macros_scaled = model.run_models(rows)[:2]
+            out = model.postprocessor.decode(label_probs, macros_scaled, k=top_k)
+            dish[idx]                        = out["dish"]
+            columns["confidence"][idx]       = out["confidence"]
+            columns["pred_fat_g"][idx]       = out["fat_g"]
+            columns["pred_protein_g"][idx]   = out["protein_g"]
+            columns["pred_carbs_g"][idx]     = out["carbs_g"]
+            columns["pred_calories"][idx]    = out["calories"]
+            for i, dishes in zip(idx, out.get("top_dishes", ())):
+                top[i] = dishes.tolist()
+        if progress is not None:
+            progress(start + len(batch), n)
+
+    frame = pd.DataFrame({"pred_dish": dish, **columns, "error": errors})
+    if top_k > 1:
+        frame.insert(1, "top_dishes", top)
+    return frame
+
+
+# -- Metrics ----------------------------------------------------------------------
+
+def evaluate(scored: pd.DataFrame) -> dict:
+    """
+    MAE, median MAPE (%) and per-class bias (mean pred − truth) per target.
+
+    Rows without a prediction are skipped; MAPE skips zero truths (as in the
+    notebooks). Targets whose truth column is missing are left out.
+    """
+    targets = {name: cols for name, cols in TARGETS.items() if cols[0] in scored.columns}
+    scored  = scored[scored["pred_dish"].notna()]
+    if not targets or scored.empty:
+        return {"n": int(len(scored))}
+
+    truth = scored[[t for t, _ in targets.values()]].to_numpy(dtype=np.float64)
+    pred  = scored[[p for _, p in targets.values()]].to_numpy(dtype=np.float64)
+    error = pred - truth
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ape = np.where(truth != 0, np.abs(error) / np.abs(truth) * 100, np.nan)
+    mae  = np.nanmean(np.abs(error), axis=0)
+    mape = np.nanmedian(ape, axis=0)
+
+    report = {
+        "n":            int(len(scored)),
+        "mae":          {name: round(float(v), 3) for name, v in zip(targets, mae)},
+        "median_mape":  {name: round(float(v), 2) for name, v in zip(targets, mape)},
+    }
+    if "label" in scored.columns:
+        bias = pd.DataFrame(error, columns=list(targets), index=scored.index).groupby(scored["label"]).mean()
+        report["bias"] = {
+            name: {label: round(float(v), 3) for label, v in bias[name].items()}
+            for name in targets
+        }
+        report["accuracy"] = round(float((scored["pred_dish"] == scored["label"]).mean()), 4)
+        if "top_dishes" in scored.columns:
+            hits = [label in top for label, top in zip(scored["label"], scored["top_dishes"])]
+            report["top_k_accuracy"] = round(float(np.mean(hits)), 4)
+    return report
+
+
+def format_report(report: dict) -> str:
+    """Plain-text summary in the style of the experiments log."""
+    if "mae" not in report:
+        return f"{report['n']} images scored (no truth columns to evaluate)"
+    lines = [f"{report['n']} images"
+             + (f", dish accuracy {report['accuracy']:.1%}" if "accuracy" in report else "")
+             + (f" (top-k {report['top_k_accuracy']:.1%})" if "top_k_accuracy" in report else "")]
+    for name in report["mae"]:
+        lines.append(f"  {name:<9} MAE {report['mae'][name]:8.2f}   "
+                     f"Median MAPE {report['median_mape'][name]:6.1f}%")
+    for name, per_class in report.get("bias", {}).items():
+        worst = sorted(per_class.items(), key=lambda kv: -abs(kv[1]))[:3]
+        lines.append(f"  {name:<9} bias   " + ", ".join(f"{k} {v:+.2f}" for k, v in worst))
+    return "\n".join(lines)
+
+
+# -- Output -----------------------------------------------------------------------
+
+def write_parquet(frame: pd.DataFrame, path: str) -> None:
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as exc:
+        raise RuntimeError(
+            "pyarrow is required to write Parquet. Add it to requirements.txt."
+        ) from exc
+    frame.to_parquet(path, index=False)
+
+
+def score_labels(version: str, labels_path: str, output: str = None, *, root: str = None,
+                 batch_size: int = 128, workers: int = None, prefetch: int = 2,
+                 limit: int = None, top_k: int = 1):
+    """
+    Load `version`, score every image of `labels_path`, write `output` (Parquet).
+
+    Returns (scored frame: labels + predictions, metrics report).
+    """
+    # Imported here: TensorFlow is only needed once we actually score
+    from api.registry import ModelRegistry
+
+    labels = read_labels(labels_path)
+    if limit:
+        labels = labels.head(limit)
+    sources = resolve_sources(labels, labels_path, root)
+
+    model = ModelRegistry(default_version=version).load(version)
+    start = time.perf_counter()
+    last  = [start]
+
+    def progress(done, total):
+        now = time.perf_counter()
+        if now - last[0] >= 5 or done == total:
+            last[0] = now
+            print(f"[{version}] {done}/{total} images, "
+                  f"{done / (now - start):.1f} img/s")
+
+    try:
+        predictions = score(model, sources, batch_size, workers, prefetch, progress, top_k)
+    finally:
+        model.close()
+
+    scored = pd.concat([labels.reset_index(drop=True), predictions], axis=1)
+    scored.insert(0, "model_version", version)
+    failed = int(scored["error"].notna().sum())
+    if failed:
+        print(f"[{version}] WARNING: {failed} images could not be decoded (see `error`)")
+    if output:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        write_parquet(scored, output)
+        print(f"[{version}] Wrote {len(scored)} predictions to {output}")
+    return scored, evaluate(scored)
@@ -1,29 +1,10 @@
 import os
-from io import BytesIO
 import pandas as pd
-import requests
-from PIL import Image
 from tqdm import tqdm
 from params import DISHES, PER_CLASS, OUTPUT_DIR, OUTPUT_FILENAME, LABELS_FILENAME
 
-
-def download_image(url: str, save_path: str, timeout: int = 20) -> None:
-    """
-    Download image bytes from `url`, verify it's a valid image, and save to `save_path`.
-    Raises an exception if download fails or image is invalid.
-    """
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-
-    r = requests.get(url, timeout=timeout, headers={"User-Agent": "Mozilla/5.0"})
-    r.raise_for_status()
-
-    bio = BytesIO(r.content)
-
-    # verify integrity (requires reopen)
-    Image.open(bio).verify()
-    bio.seek(0)
-
-    Image.open(bio).convert("RGB").save(save_path, format="JPEG", quality=90)
+from dine.data.download import Downloader
+from dine.data.images import prepare_image
 
 
 def load_candidates() -> pd.DataFrame:
@@ -46,36 +27,50 @@ def download_subset(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
       OUTPUT_DIR/images/<label>/000000.jpg ...
     Returns (labels_df, failures_df).
     """
-    rows, failures = [], []
     images_root = os.path.join(OUTPUT_DIR, "images")
 
+    jobs = {}   # dish -> [(url, url), ...] in seeded candidate order
     for dish in [d.strip().lower() for d in DISHES]:
-        label = dish.replace(" ", "_")
         dish_df = df[df["dish_name"] == dish].sample(frac=1.0, random_state=42).reset_index(drop=True)
 
         if dish_df.empty:
             print(f"⚠️ No candidates for '{dish}'")
             continue
 
-        saved = 0
-        for url in tqdm(dish_df["image_url"], desc=label, total=len(dish_df)):
-            if saved >= PER_CLASS:
-                break
-
-            filename = f"{saved:06d}.jpg"
+        jobs[dish] = [(url, url) for url in dish_df["image_url"]]
+
+    # Dishes download side by side; each stops at PER_CLASS valid images, and the
+    # n-th valid candidate (in candidate order) is always saved as {n:06d}.jpg
+    rows = {dish: [] for dish in jobs}
+    failures = {dish: [] for dish in jobs}
+    with Downloader() as downloader, \
+            tqdm(total=PER_CLASS * len(jobs), desc="Downloading images") as pbar:
+        # prepare_image validates each download in its worker thread (see dine.data.images)
+        downloads = downloader.download(jobs, lambda dish, url, content: prepare_image(content),
+                                        limit=PER_CLASS)
+        for dish, url, image, error in downloads:
+            if error is not None:
+                failures[dish].append({"dish_name": dish, "image_url": url,
+                                       "error": f"{type(error).__name__}: {error}"})
+                continue
+
+            label = dish.replace(" ", "_")
+            filename = f"{len(rows[dish]):06d}.jpg"
             save_path = os.path.join(images_root, label, filename)
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            with open(save_path, "wb") as f:
+                f.write(image.data)
 
-            try:
-                download_image(url, save_path)
-                rows.append({"image_path": f"images/{label}/{filename}", "label": label})
-                saved += 1
-            except Exception:
-                failures.append({"dish_name": dish, "image_url": url})
+            rows[dish].append({"image_path": f"images/{label}/{filename}", "label": label,
+                               **image.describe()})
+            pbar.update(1)
 
-        if saved < PER_CLASS:
-            print(f"⚠️ {label}: only saved {saved}/{PER_CLASS}")
+    for dish, saved in rows.items():
+        if len(saved) < PER_CLASS:
+            print(f"⚠️ {dish.replace(' ', '_')}: only saved {len(saved)}/{PER_CLASS}")
 
-    return pd.DataFrame(rows), pd.DataFrame(failures)
+    return (pd.DataFrame([row for saved in rows.values() for row in saved]),
+            pd.DataFrame([row for failed in failures.values() for row in failed]))
 
 
 def main() -> None:
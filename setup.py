@@ -14,4 +14,5 @@ setup(name='dine',
       # include_package_data: to install data from MANIFEST.in
       include_package_data=True,
       scripts=['scripts/dine-run'],
+      entry_points={'console_scripts': ['dine=dine.cli:main']},
       zip_safe=False)
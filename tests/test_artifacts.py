@@ -0,0 +1,166 @@
+"""Artifact sync against a LocalStore standing in for the bucket."""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import api.artifacts as artifacts
+from api.artifacts import (
+    ChecksumMismatchError, LocalStore, fetch, maybe_download_from_gcs, sync_artifacts,
+)
+
+PREFIX = "models/test_v1"
+FILES  = {"classifier.keras": os.urandom(3 << 20), "macro_scaler.pkl": b"scaler bytes"}
+
+
+class CountingStore(LocalStore):
+    """LocalStore that records every download as (name, start)."""
+
+    def __init__(self, root, corrupt: bool = False):
+        super().__init__(root)
+        self.downloads = []
+        self.corrupt   = corrupt
+        self._lock     = threading.Lock()
+
+    def download(self, name, fileobj, start=0):
+        with self._lock:
+            self.downloads.append((name, start))
+        if self.corrupt:
+            fileobj.write(b"\0" * ((self.root / name).stat().st_size - start))
+            return
+        super().download(name, fileobj, start)
+
+
+@pytest.fixture
+def store(tmp_path):
+    for name, data in FILES.items():
+        path = tmp_path / "bucket" / PREFIX / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return CountingStore(tmp_path / "bucket")
+
+
+def _obj(store, name):
+    (obj,) = store.list(f"{PREFIX}/{name}")
+    return obj
+
+
+def test_resumes_a_leftover_part_file(store, tmp_path):
+    data = FILES["classifier.keras"]
+    dest = tmp_path / "model" / "classifier.keras"
+    dest.parent.mkdir()
+    dest.with_name("classifier.keras.part").write_bytes(data[:1000])
+
+    fetch(store, _obj(store, "classifier.keras"), dest)
+
+    assert dest.read_bytes() == data
+    assert store.downloads == [(f"{PREFIX}/classifier.keras", 1000)]
+    assert not dest.with_name("classifier.keras.part").exists()
+
+
+def test_checksum_mismatch_downloads_again(store, tmp_path):
+    data = FILES["classifier.keras"]
+    dest = tmp_path / "model" / "classifier.keras"
+    dest.parent.mkdir()
+    # Whole-size part from another object generation: fails verification
+    dest.with_name("classifier.keras.part").write_bytes(b"x" * len(data))
+
+    fetch(store, _obj(store, "classifier.keras"), dest)
+
+    assert dest.read_bytes() == data
+    assert store.downloads == [(f"{PREFIX}/classifier.keras", 0)]
+
+
+def test_persistent_mismatch_raises_and_leaves_no_file(store, tmp_path):
+    store.corrupt = True
+    dest = tmp_path / "model" / "classifier.keras"
+    dest.parent.mkdir()
+
+    with pytest.raises(ChecksumMismatchError):
+        fetch(store, _obj(store, "classifier.keras"), dest)
+    assert not dest.exists()
+
+
+def test_stale_local_files_are_not_served_when_the_sync_fails(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(artifacts, "MODEL_DIR", tmp_path / "model")
+    config = {"backend": "keras", "gcs_prefix": PREFIX,
+              "artifacts": {"classifier": "classifier.keras", "macro_scaler": "macro_scaler.pkl"}}
+    version_dir = tmp_path / "model" / "test_v1"
+    version_dir.mkdir(parents=True)
+    for name, data in FILES.items():
+        (version_dir / name).write_bytes(data[:10])      # truncated by an interrupted start
+    store.corrupt = True
+
+    with pytest.raises(ChecksumMismatchError):
+        maybe_download_from_gcs("test_v1", config, store=store, cache_dir=None, offline=False)
+
+    # Explicit offline mode serves them without touching the store
+    store.downloads.clear()
+    maybe_download_from_gcs("test_v1", config, store=store, cache_dir=None, offline=True)
+    assert store.downloads == []
+
+
+def test_sync_writes_a_manifest_and_skips_verified_files(store, tmp_path):
+    dest_dir = tmp_path / "model"
+    assert sorted(sync_artifacts(store, PREFIX, list(FILES), dest_dir)) == sorted(FILES)
+    assert sync_artifacts(store, PREFIX, list(FILES), dest_dir) == []
+    assert len(store.downloads) == len(FILES)
+
+
+def test_concurrent_fetches_download_once(store, tmp_path):
+    obj   = _obj(store, "classifier.keras")
+    cache = tmp_path / "cache"
+    dests = [tmp_path / f"v{i}" / "classifier.keras" for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda dest: fetch(store, obj, dest, cache_dir=cache), dests))
+
+    assert len(store.downloads) == 1
+    assert all(dest.read_bytes() == FILES["classifier.keras"] for dest in dests)
+
+
+def test_shared_cache_hard_links_each_version(store, tmp_path):
+    obj   = _obj(store, "classifier.keras")
+    cache = tmp_path / "cache"
+    a, b  = tmp_path / "v1" / "classifier.keras", tmp_path / "v2" / "classifier.keras"
+
+    fetch(store, obj, a, cache_dir=cache)
+    fetch(store, obj, b, cache_dir=cache)
+
+    (cached,) = [p for p in cache.iterdir() if not p.name.endswith(".lock")]
+    assert a.stat().st_ino == b.stat().st_ino == cached.stat().st_ino
+    assert cached.stat().st_nlink == 3
+    assert len(store.downloads) == 1
+
+
+def test_corrupt_cache_entry_of_the_right_size_is_replaced(store, tmp_path):
+    obj   = _obj(store, "classifier.keras")
+    cache = tmp_path / "cache"
+    fetch(store, obj, tmp_path / "v1" / "classifier.keras", cache_dir=cache)
+    (cached,) = [p for p in cache.iterdir() if not p.name.endswith(".lock")]
+    cached.unlink()
+    cached.write_bytes(b"x" * obj.size)
+
+    dest = tmp_path / "v2" / "classifier.keras"
+    fetch(store, obj, dest, cache_dir=cache)
+
+    assert dest.read_bytes() == FILES["classifier.keras"]
+    assert len(store.downloads) == 2
+
+
+def test_optional_artifact_missing_from_the_store(store, tmp_path):
+    dest_dir = tmp_path / "model"
+    names    = [*FILES, "backbone.weights.h5"]
+
+    with pytest.raises(FileNotFoundError):
+        sync_artifacts(store, PREFIX, names, dest_dir)
+
+    fetched = sync_artifacts(store, PREFIX, names, dest_dir, optional={"backbone.weights.h5"})
+    assert sorted(fetched) == sorted(FILES)
+
+    # Its absence is recorded, so the next start stays offline
+    store.downloads.clear()
+    assert sync_artifacts(store, PREFIX, names, dest_dir, optional={"backbone.weights.h5"}) == []
+    assert store.downloads == []
@@ -0,0 +1,133 @@
+"""MicroBatcher: coalescing, error propagation and cancellation of queued requests."""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from api.batching import MicroBatcher
+
+
+class RecordingModel:
+    """batch_fn that records batch sizes and can be held until released."""
+
+    def __init__(self, error: Exception = None):
+        self.batches = []               # items of every call, in order
+        self.error   = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, batch):
+        self.batches.append([int(x) for x in batch[:, 0]])
+        self.started.set()
+        self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return batch * 2, batch.sum(axis=1)
+
+
+def _item(i):
+    return np.full(3, i, dtype=np.float32)
+
+
+@pytest.fixture
+def held():
+    """A batcher whose first call blocks, so later submissions pile up in its queue."""
+    model   = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=200)
+    model.release.clear()
+    yield model, batcher
+    model.release.set()
+    batcher.close()
+
+
+def test_coalesces_up_to_max_batch_size(held):
+    model, batcher = held
+    first = batcher.submit(_item(0))
+    assert model.started.wait(5)
+
+    futures = [batcher.submit(_item(i)) for i in range(1, 10)]
+    model.release.set()
+    results = [f.result(timeout=5) for f in [first, *futures]]
+
+    # Full batches leave without waiting max_wait_ms; the tail waits for it
+    assert model.batches == [[0], [1, 2, 3, 4], [5, 6, 7, 8], [9]]
+    for i, (doubled, total) in enumerate(results):
+        np.testing.assert_array_equal(doubled, _item(i) * 2)
+        assert total == 3 * i
+
+
+def test_waits_at_most_max_wait_ms():
+    model   = RecordingModel()
+    batcher = MicroBatcher(model, max_batch_size=8, max_wait_ms=50)
+    try:
+        start = time.monotonic()
+        batcher.submit(_item(1)).result(timeout=5)
+        elapsed = time.monotonic() - start
+    finally:
+        batcher.close()
+
+    assert model.batches == [[1]]
+    assert 0.04 <= elapsed < 1.0
+
+
+def test_batch_error_reaches_every_future():
+    model   = RecordingModel(error=ValueError("bad batch"))
+    batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=200)
+    try:
+        futures = [batcher.submit(_item(i)) for i in range(3)]
+        for future in futures:
+            with pytest.raises(ValueError, match="bad batch"):
+                future.result(timeout=5)
+
+        # The worker survives the failure
+        model.error = None
+        assert batcher(_item(5))[1] == 15
+    finally:
+        batcher.close()
+    assert model.batches == [[0, 1, 2], [5]]
+
+
+def test_request_past_its_deadline_is_dropped_before_inference(held):
+    import api.fast as fast
+
+    class Connected:
+        async def is_disconnected(self):
+            return False
+
+    model, batcher = held
+    batcher.submit(_item(0))
+    assert model.started.wait(5)
+    late = batcher.submit(_item(1))
+    kept = batcher.submit(_item(2))
+
+    async def wait_briefly():
+        deadline = asyncio.get_running_loop().time() + 0.15
+        await fast._await_inference(Connected(), late, deadline)
+
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(wait_briefly())
+    assert exc.value.status_code == 504
+    assert late.cancelled()
+
+    model.release.set()
+    kept.result(timeout=5)
+    assert model.batches == [[0], [2]]
+
+
+def test_close_finishes_queued_work_and_refuses_more(held):
+    model, batcher = held
+    batcher.submit(_item(0))
+    assert model.started.wait(5)
+    queued = batcher.submit(_item(1))
+
+    model.release.set()
+    batcher.close()
+
+    assert queued.done() and queued.result()[1] == 3
+    with pytest.raises(RuntimeError):
+        batcher.submit(_item(2))
@@ -0,0 +1,156 @@
+"""PredictionCache: single-flight, TTL expiry and LRU eviction."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import api.cache as cache_module
+from api.cache import PredictionCache
+
+
+class Clock:
+    """Stand-in for time.monotonic / time.time, advanced by hand."""
+
+    def __init__(self):
+        self.now = time.time()          # disk entries are aged by their real mtime
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(monotonic=clock, time=clock))
+    return clock
+
+
+def test_concurrent_misses_compute_once():
+    cache   = PredictionCache()
+    calls   = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"dish": "ramen"}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        owner = pool.submit(cache.get_or_compute, "v1:abc", compute)
+        assert started.wait(5)
+        waiters = [pool.submit(cache.get_or_compute, "v1:abc", compute) for _ in range(7)]
+        while cache.stats()["inflight_joins"] < 7:
+            time.sleep(0.01)
+        assert cache.has_waiters("v1:abc")
+        release.set()
+        results = [f.result(timeout=5) for f in [owner, *waiters]]
+
+    assert len(calls) == 1
+    assert results == [{"dish": "ramen"}] * 8
+    results[0]["dish"] = "mutated"                      # callers get their own copies
+    assert cache.get("v1:abc") == {"dish": "ramen"}
+    assert cache.stats()["inflight"] == 0
+
+
+def test_concurrent_misses_compute_once_async():
+    cache = PredictionCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"dish": "sushi"}
+
+    async def main():
+        return await asyncio.gather(*(cache.get_or_compute_async("v1:abc", compute)
+                                      for _ in range(5)))
+
+    assert asyncio.run(main()) == [{"dish": "sushi"}] * 5
+    assert len(calls) == 1
+
+
+def test_errors_are_shared_but_not_cached():
+    cache   = PredictionCache()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("decode failed")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        owner = pool.submit(cache.get_or_compute, "v1:abc", failing)
+        assert started.wait(5)
+        waiter = pool.submit(cache.get_or_compute, "v1:abc", failing)
+        while cache.stats()["inflight_joins"] < 1:
+            time.sleep(0.01)
+        release.set()
+        for future in (owner, waiter):
+            with pytest.raises(ValueError, match="decode failed"):
+                future.result(timeout=5)
+
+    assert cache.get_or_compute("v1:abc", lambda: {"dish": "pizza"}) == {"dish": "pizza"}
+
+
+def test_entries_expire_after_the_ttl(clock, tmp_path):
+    cache = PredictionCache(ttl_s=60, disk_dir=tmp_path)
+    cache.put("v1:abc", {"dish": "apple"})
+
+    clock.now += 59
+    assert cache.get("v1:abc") == {"dish": "apple"}
+
+    clock.now += 2
+    assert cache.get("v1:abc") is None                  # expired in memory and on disk
+    assert list(tmp_path.iterdir()) == []
+
+    calls = []
+    cache.get_or_compute("v1:abc", lambda: calls.append(1) or {"dish": "apple"})
+    assert calls == [1]
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_entries=2)
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}                   # "b" is now least recently used
+
+    cache.put("c", {"n": 3})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"n": 1}
+    assert cache.get("c") == {"n": 3}
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_disk_tier_refills_memory(tmp_path):
+    PredictionCache(disk_dir=tmp_path).put("v1:abc", {"dish": "apple"})
+
+    cache = PredictionCache(disk_dir=tmp_path)           # a restart: empty memory tier
+    assert cache.get("v1:abc") == {"dish": "apple"}
+    assert cache.get("v1:abc") == {"dish": "apple"}
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["size"]) == (1, 1, 1)
+
+
+def test_hit_ratio_and_entries_per_label_set():
+    cache = PredictionCache(max_entries=3)
+    v1, v2 = ("demo_v11.0", "joint"), ("demo_v12.0", "per_macro")
+    cache.put("v1:a", {"n": 1}, v1)
+    cache.put("v1:b", {"n": 2}, v1)
+    cache.get("v1:a", v1)
+    cache.get("v1:c", v1)
+    cache.get_or_compute("v2:a", lambda: {"n": 3}, v2)
+    cache.get_or_compute("v2:b", lambda: {"n": 4}, v2)     # evicts v1:b, the oldest
+
+    assert cache.stats_by_labels() == {
+        v1: {"hit_rate": 0.5, "size": 1},
+        v2: {"hit_rate": 0.0, "size": 2},
+    }
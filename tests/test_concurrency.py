@@ -0,0 +1,95 @@
+"""LoadShedder admission and the 503 + Retry-After response."""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.concurrency import LoadShedder, Overloaded
+
+
+def test_sheds_past_max_pending():
+    shedder = LoadShedder(max_pending=2, concurrency=1)
+
+    with shedder.admit(), shedder.admit():
+        with pytest.raises(Overloaded) as exc:
+            with shedder.admit():
+                pass
+        assert exc.value.retry_after >= 1
+        assert shedder.stats()["pending"] == 2
+
+    assert shedder.stats()["pending"] == 0 and shedder.stats()["shed"] == 1
+    with shedder.admit():                       # slots are released on exit
+        pass
+
+
+def test_slot_is_released_when_the_request_fails():
+    shedder = LoadShedder(max_pending=1)
+    with pytest.raises(ValueError):
+        with shedder.admit():
+            raise ValueError("decode failed")
+    assert shedder.stats()["pending"] == 0
+
+
+def test_retry_after_scales_with_queue_and_latency():
+    shedder = LoadShedder(max_pending=100, concurrency=2)
+    shedder._latency_s = 0.8
+    shedder.pending    = 10
+    assert shedder.retry_after() == 4           # ceil(0.8 * 10 / 2)
+    shedder.pending    = 1
+    assert shedder.retry_after() == 1           # never below one second
+
+
+def test_overloaded_is_a_503_with_retry_after():
+    import api.fast as fast
+
+    app     = FastAPI()
+    shedder = LoadShedder(max_pending=0, concurrency=1)
+    app.add_exception_handler(Overloaded, fast.overloaded_handler)
+
+    @app.post("/predict")
+    def predict():
+        with shedder.admit():
+            return {"dish": "ramen"}
+
+    response = TestClient(app).post("/predict")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(shedder.retry_after())
+    assert "Inference queue full" in response.json()["detail"]
+
+
+def test_shed_requests_are_counted_per_version():
+    import api.fast as fast
+    from api.metrics import REGISTRY, SHED_REQUESTS
+
+    app     = FastAPI()
+    shedder = LoadShedder(max_pending=0, concurrency=1)
+    app.add_exception_handler(Overloaded, fast.overloaded_handler)
+
+    @app.post("/predict")
+    def predict():
+        with shedder.admit(("test_v1", "joint")):
+            return {"dish": "ramen"}
+
+    child  = SHED_REQUESTS.labels(model_version="test_v1", mode="joint")
+    before = child.value
+    client = TestClient(app)
+    for _ in range(3):
+        assert client.post("/predict").status_code == 503
+
+    assert child.value == before + 3
+    assert "# TYPE dine_shed_requests_total counter" in REGISTRY.render()
+
+
+def test_counts_per_label_set_share_one_limit():
+    shedder = LoadShedder(max_pending=2, concurrency=1)
+    v1, v2  = ("demo_v11.0", "joint"), ("demo_v12.0", "per_macro")
+
+    with shedder.admit(v1), shedder.admit(v1):
+        with pytest.raises(Overloaded):
+            with shedder.admit(v2):
+                pass
+        assert shedder.stats_by_labels() == {v1: {"pending": 2, "shed": 0},
+                                             v2: {"pending": 0, "shed": 1}}
+
+    assert shedder.stats_by_labels()[v1]["pending"] == 0
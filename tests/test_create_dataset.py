@@ -0,0 +1,189 @@
+"""Dataset build helpers, against a fake bucket and in-memory datasets."""
+
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("datasets")
+pytest.importorskip("google.cloud.storage")
+pytest.importorskip("tqdm")
+
+import dine.data.create_dataset as create_dataset    # noqa: E402
+from dine.data.create_dataset import cached_images   # noqa: E402
+
+VERSION = create_dataset.DATASET_VERSION
+
+
+class FakeBucket:
+    """In-memory bucket: list_blobs is paginated like GCS, per-object calls are forbidden."""
+
+    def __init__(self, objects: dict, page_size: int = 2):
+        self.objects   = objects          # name -> (size, metadata)
+        self.page_size = page_size
+        self.listings  = 0
+        self.pages     = 0
+
+    def list_blobs(self, prefix="", fields=None):
+        self.listings += 1
+        names = sorted(name for name in self.objects if name.startswith(prefix))
+        for start in range(0, len(names), self.page_size):
+            self.pages += 1
+            for name in names[start:start + self.page_size]:
+                size, metadata = self.objects[name]
+                yield SimpleNamespace(name=name, size=size, metadata=metadata)
+
+    def blob(self, name):
+        raise AssertionError(f"per-image request for {name}")
+
+
+def test_gcs_cache_check_is_one_listing_per_version():
+    meta = {"width": "640", "height": "480", "sha256": "ab" * 32}
+    bucket = FakeBucket({
+        f"{VERSION}/images/apple/000000.jpg":     (100, meta),
+        f"{VERSION}/images/apple/000002.jpg":     (101, None),       # uploaded before metadata
+        f"{VERSION}/images/sushi/000000.jpg":     (102, meta),
+        f"{VERSION}/images/sushi/notes.txt":      (3, None),
+        f"{VERSION}/images/sushi/sub/000001.jpg": (104, None),
+        f"{VERSION}/images/ramen/000000.jpg":     (105, None),       # dish not requested
+        f"{VERSION}/labels.csv":                  (106, None),
+        f"{VERSION}0/images/apple/000001.jpg":    (107, None),       # another version
+    })
+
+    cached = cached_images(["apple", "sushi", "pizza"], "gcs", bucket)
+
+    assert bucket.listings == 1 and bucket.pages > 1
+    assert {label: set(files) for label, files in cached.items()} == {
+        "apple": {"000000.jpg", "000002.jpg"},
+        "sushi": {"000000.jpg"},
+        "pizza": set(),
+    }
+    assert cached["apple"]["000000.jpg"] == {
+        "file_size": 100, "width": 640, "height": 480, "sha256": "ab" * 32,
+    }
+    assert cached["apple"]["000002.jpg"] == {
+        "file_size": 101, "width": None, "height": None, "sha256": None,
+    }
+
+
+class FakeBlob(SimpleNamespace):
+    """Bucket object that serves `data` and records the metadata patched onto it."""
+
+    def download_as_bytes(self):
+        self.downloads += 1
+        return self.data
+
+    def patch(self):
+        self.patched = dict(self.metadata)
+
+
+def test_gcs_objects_without_metadata_are_backfilled_once():
+    from io import BytesIO
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), "red").save(buffer, "JPEG")
+    blob = FakeBlob(data=buffer.getvalue(), metadata=None, downloads=0, patched=None)
+
+    bucket = SimpleNamespace(name="bucket", blob=lambda name: blob)
+    prefix = f"gs://bucket/{VERSION}/images/apple"
+    listed = {"file_size": 100, "width": 640, "height": 480, "sha256": "ab" * 32}
+    assert create_dataset.cached_image_info("gcs", f"{prefix}/000000.jpg", listed,
+                                            bucket=bucket) is listed
+    assert blob.downloads == 0
+
+    missing = {"file_size": len(blob.data), "width": None, "height": None, "sha256": None}
+    info    = create_dataset.cached_image_info("gcs", f"{prefix}/000002.jpg", missing,
+                                               bucket=bucket)
+
+    assert info == create_dataset.describe_image(blob.data)
+    assert (info["width"], info["height"], blob.downloads) == (64, 48, 1)
+    # Written back, so the next resume reads the columns from the listing again
+    assert blob.patched == {"width": "64", "height": "48", "sha256": info["sha256"]}
+
+
+def test_local_cache_check_is_one_scandir_per_dish(tmp_path, monkeypatch):
+    images = tmp_path / VERSION / "images"
+    for rel in ("apple/000000.jpg", "apple/000003.jpg", "apple/000001.jpg.part",
+                "sushi/000000.jpg", "ramen/000000.jpg"):
+        (images / rel).parent.mkdir(parents=True, exist_ok=True)
+        (images / rel).write_bytes(b"jpeg")
+    (images / "sushi" / "000001.jpg").mkdir()
+
+    scanned = []
+    real_scandir = os.scandir
+
+    def scandir(path):
+        scanned.append(os.path.basename(path))
+        return real_scandir(path)
+
+    monkeypatch.setattr(create_dataset, "BASE_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(create_dataset.os, "scandir", scandir)
+
+    cached = cached_images(["apple", "sushi", "pizza"], "local")
+
+    assert sorted(scanned) == ["apple", "pizza", "sushi"]
+    assert {label: set(files) for label, files in cached.items()} == {
+        "apple": {"000000.jpg", "000003.jpg"},
+        "sushi": {"000000.jpg"},
+        "pizza": set(),
+    }
+
+
+def test_local_resume_reuses_previous_labels(tmp_path, monkeypatch):
+    images = tmp_path / VERSION / "images" / "apple"
+    images.mkdir(parents=True)
+    for name in ("000000.jpg", "000001.jpg", "000002.jpg"):
+        (images / name).write_bytes(b"jpeg" * 10)
+    (images / "000001.jpg").write_bytes(b"replaced since the last build")
+    labels_csv = tmp_path / VERSION / "labels.csv"
+    labels_csv.write_text(
+        "image_path,label,file_size,width,height,sha256\n"
+        f"{VERSION}/images/apple/000000.jpg,apple,40,8,6,aa\n"
+        f"{VERSION}/images/apple/000001.jpg,apple,40,8,6,bb\n"
+    )
+
+    read = []
+    monkeypatch.setattr(create_dataset, "BASE_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(create_dataset, "describe_image",
+                        lambda data: read.append(data) or {"file_size": len(data)})
+
+    cached   = cached_images(["apple"], "local")["apple"]
+    previous = create_dataset.previous_image_info(labels_csv)
+    info = {
+        name: create_dataset.cached_image_info(
+            "local", f"{VERSION}/images/apple/{name}", cached[name], previous)
+        for name in sorted(cached)
+    }
+
+    assert info["000000.jpg"] == {"file_size": 40, "width": 8, "height": 6, "sha256": "aa"}
+    assert read == [b"replaced since the last build", b"jpeg" * 10]     # 000001 and 000002
+
+
+def _food_rows():
+    rows = []
+    for i in range(90):
+        dish = ("Apple", "sushi", "SUSHI", "ramen", None, "pizza")[i % 6]
+        rows.append({"dish_name": dish, "image_url": f"https://img.example/{i}.jpg", "row": i})
+    return rows
+
+
+def test_streaming_and_map_style_select_the_same_rows():
+    from datasets import Dataset
+
+    dataset = Dataset.from_list(_food_rows())
+    dishes  = ["apple", "sushi", "pizza", "mapo tofu"]
+
+    mapped   = create_dataset.select_subsets(dataset, dishes, per_class=8, seed=42)
+    streamed = create_dataset.select_subsets(dataset.to_iterable_dataset(), dishes,
+                                             per_class=8, seed=42)
+
+    for dish in dishes:
+        # Same rows as the per-dish filter/shuffle/select it replaced
+        before = dataset.filter(lambda row: create_dataset.normalize_dish(row["dish_name"]) == dish)
+        before = before.shuffle(seed=42).select(range(min(8, len(before))))
+        assert [row["row"] for row in mapped[dish]] == [row["row"] for row in before]
+        assert [row["row"] for row in streamed[dish]] == [row["row"] for row in before]
+
+    assert len(mapped["sushi"]) == 8                    # both spellings of sushi count
+    assert len(mapped["mapo tofu"]) == 0
@@ -0,0 +1,102 @@
+"""Downloader ordering, limit cut-off and per-host slots, with stub fetches."""
+
+import random
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("requests")
+
+from dine.data.download import Downloader      # noqa: E402
+
+
+class StubFetches:
+    """Downloader.fetch stand-in: random latency so fetches finish out of order."""
+
+    def __init__(self, downloader, failing=()):
+        self.downloader = downloader
+        self.failing    = set(failing)
+        self.fetched    = []
+        self.active     = {}            # host -> fetches holding a slot right now
+        self.peak       = {}
+        self._lock      = threading.Lock()
+        self._rng       = random.Random(0)
+
+    def __call__(self, url):
+        host = url.split("/")[2]
+        with self._lock:
+            delay = self._rng.uniform(0, 0.02)
+        with self.downloader._host_slot(host):
+            with self._lock:
+                self.fetched.append(url)
+                self.active[host] = self.active.get(host, 0) + 1
+                self.peak[host]   = max(self.peak.get(host, 0), self.active[host])
+            time.sleep(delay)
+            with self._lock:
+                self.active[host] -= 1
+        if url in self.failing:
+            raise ConnectionError(url)
+        return url.encode()
+
+
+def _jobs(groups=("apple", "sushi", "ramen"), per_group=20, hosts=2):
+    return {
+        group: [(i, f"https://h{i % hosts}.example/{group}/{i}.jpg") for i in range(per_group)]
+        for group in groups
+    }
+
+
+def _run(downloader, stub, jobs, limit=None):
+    downloader.fetch = stub
+    return list(downloader.download(jobs, lambda group, key, content: content.decode(), limit))
+
+
+def test_each_group_is_yielded_in_input_order():
+    with Downloader(workers=8, per_host=4) as downloader:
+        stub    = StubFetches(downloader)
+        jobs    = _jobs()
+        results = _run(downloader, stub, jobs)
+
+    for group, items in jobs.items():
+        yielded = [(key, result) for g, key, result, error in results if g == group]
+        assert yielded == [(key, url) for key, url in items]
+    assert all(error is None for *_, error in results)
+    # Completion order differed from submission order, so the reordering was exercised
+    assert stub.fetched != [url for items in jobs.values() for _, url in items]
+
+
+def test_limit_stops_a_group_after_enough_successes():
+    jobs    = _jobs(per_group=40)
+    failing = {jobs["apple"][i][1] for i in (1, 4)}
+
+    with Downloader(workers=8, per_host=4) as downloader:
+        stub    = StubFetches(downloader, failing=failing)
+        results = _run(downloader, stub, jobs, limit=5)
+
+    apple = [(key, error is None) for group, key, _, error in results if group == "apple"]
+    assert apple == [(0, True), (1, False), (2, True), (3, True), (4, False), (5, True), (6, True)]
+    for group in ("sushi", "ramen"):
+        assert [key for g, key, *_ in results if g == group] == [0, 1, 2, 3, 4]
+
+    # Only a small lookahead past the limit is ever fetched
+    assert len(stub.fetched) < 3 * 10
+
+
+def test_per_host_slots_cap_concurrent_fetches():
+    with Downloader(workers=16, per_host=3) as downloader:
+        stub = StubFetches(downloader)
+        _run(downloader, stub, _jobs(per_group=30, hosts=2))
+
+    assert stub.peak == {"h0.example": 3, "h1.example": 3}
+
+
+def test_a_failed_download_is_reported_not_raised():
+    jobs = _jobs(groups=("apple",), per_group=3)
+    with Downloader(workers=2) as downloader:
+        stub    = StubFetches(downloader, failing={jobs["apple"][1][1]})
+        results = _run(downloader, stub, jobs)
+
+    assert [(key, type(error).__name__ if error else None) for _, key, _, error in results] == [
+        (0, None), (1, "ConnectionError"), (2, None),
+    ]
@@ -0,0 +1,48 @@
+"""Training images decode to the same pixels as serving."""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+pytest.importorskip("gcsfs")
+pytest.importorskip("google.cloud.storage")
+
+import dine.data.load_dataset as load_dataset    # noqa: E402
+from dine.preprocessing import decode_image      # noqa: E402
+
+
+def _rotated_photo() -> bytes:
+    """A landscape-encoded 1600x1200 JPEG whose EXIF says to rotate it upright."""
+    rng = np.random.default_rng(0)
+    pixels = np.zeros((1200, 1600, 3), dtype=np.uint8)
+    pixels[:, :800] = (200, 40, 40)
+    pixels[:400] += rng.integers(0, 40, size=(400, 1600, 3), dtype=np.uint8)
+    exif = Image.Exif()
+    exif[0x0112] = 6                                 # rotate 90° clockwise to view
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, format="JPEG", quality=90, exif=exif)
+    return out.getvalue()
+
+
+class LocalFS:
+    def __init__(self, files: dict):
+        self.files = files
+
+    def open(self, path, mode="rb"):
+        return io.BytesIO(self.files[path])
+
+
+def test_training_and_serving_decode_identical_pixels(monkeypatch):
+    data = _rotated_photo()
+    uri  = "gs://mmfood/v1/images/apple/000000.jpg"
+    monkeypatch.setattr(load_dataset, "fs", LocalFS({uri: data}))
+
+    training = np.asarray(load_dataset.load_image_from_gcs(uri), dtype=np.float32)
+    serving  = decode_image(data)                     # what /predict feeds the model
+
+    assert training.shape == serving.shape == (224, 224, 3)
+    np.testing.assert_array_equal(training, serving)
+    # Upright: the red half of the landscape encoding ends up on top
+    assert training[:100, :, 0].mean() > 150 > training[-100:, :, 0].mean()
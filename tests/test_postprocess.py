@@ -0,0 +1,121 @@
+"""PostProcessor against the sklearn artifacts it is compiled from."""
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import (
+    LabelEncoder, MinMaxScaler, QuantileTransformer, RobustScaler, StandardScaler,
+)
+
+from api.model_config import ATWATER_CARBS, ATWATER_FAT, ATWATER_PROTEIN
+from api.postprocess import PostProcessor
+
+DISHES = ["apple", "egg tart", "hamburger", "mapo tofu", "pizza", "ramen", "sushi"]
+
+JOINT  = {"mode": "joint", "log_transform": True, "atwater": True}
+LINEAR = {"mode": "per_macro", "log_transform": False, "atwater": True}
+LEGACY = {"mode": "legacy"}
+
+
+def _fitted(scaler, columns, log_transform=False, seed=0):
+    """Scaler fitted on grams-like targets (log1p of them for log_transform versions)."""
+    targets = np.random.default_rng(seed).gamma(2.0, 10.0, size=(200, columns))
+    return scaler.fit(np.log1p(targets) if log_transform else targets)
+
+
+def _label_encoder():
+    return LabelEncoder().fit(DISHES[::-1])
+
+
+def _outputs(columns, n=32, seed=1):
+    rng   = np.random.default_rng(seed)
+    probs = rng.dirichlet(np.ones(len(DISHES)), size=n).astype(np.float32)
+    return probs, rng.normal(size=(n, columns)).astype(np.float32)
+
+
+def _sklearn_decode(config, scaler, encoder, label_probs, macros_scaled):
+    """The per-request sklearn path the post-processor replaces."""
+    macros = scaler.inverse_transform(macros_scaled)
+    if config["mode"] == "legacy":
+        fat, protein, calories, carbs = macros.T
+    else:
+        if config["log_transform"]:
+            macros = np.expm1(macros)
+        fat, protein, carbs = np.maximum(macros, 0.0).T
+        calories = ATWATER_FAT * fat + ATWATER_PROTEIN * protein + ATWATER_CARBS * carbs
+    best = np.argmax(label_probs, axis=1)
+    return {
+        "dish":       encoder.inverse_transform(best),
+        "confidence": label_probs[np.arange(len(best)), best],
+        "calories":   calories,
+        "protein_g":  protein,
+        "carbs_g":    carbs,
+        "fat_g":      fat,
+    }
+
+
+@pytest.mark.parametrize("scaler_cls", [StandardScaler, MinMaxScaler, RobustScaler])
+@pytest.mark.parametrize("config", [JOINT, LINEAR, LEGACY], ids=["joint", "linear", "legacy"])
+def test_decode_matches_sklearn(scaler_cls, config):
+    columns = 4 if config["mode"] == "legacy" else 3
+    scaler  = _fitted(scaler_cls(), columns, config.get("log_transform", False))
+    encoder = _label_encoder()
+    label_probs, macros_scaled = _outputs(columns)
+
+    decoded  = PostProcessor.from_artifacts(config, scaler, encoder).decode(label_probs, macros_scaled)
+    expected = _sklearn_decode(config, scaler, encoder, label_probs, macros_scaled)
+
+    np.testing.assert_array_equal(decoded["dish"], expected["dish"])
+    for column in ("confidence", "calories", "protein_g", "carbs_g", "fat_g"):
+        # sklearn inverts float32 outputs in float32; the post-processor in float64
+        np.testing.assert_allclose(decoded[column], expected[column], rtol=1e-5, atol=1e-4,
+                                   err_msg=column)
+
+
+def test_top_k_matches_sorted_probabilities():
+    scaler  = _fitted(StandardScaler(), 3, log_transform=True)
+    encoder = _label_encoder()
+    label_probs, macros_scaled = _outputs(3)
+    processor = PostProcessor.from_artifacts(JOINT, scaler, encoder)
+
+    for k in (1, 3, len(DISHES), len(DISHES) + 5):
+        dishes, probs = processor.top_k(label_probs, k)
+        order = np.argsort(-label_probs, axis=1, kind="stable")[:, :k]
+        expected = encoder.inverse_transform(order.ravel()).reshape(order.shape)
+        np.testing.assert_array_equal(dishes, expected)
+        np.testing.assert_array_equal(probs, np.take_along_axis(label_probs, order, axis=1))
+
+    decoded = processor.decode(label_probs, macros_scaled, k=3)
+    assert decoded["top_dishes"].shape == (len(label_probs), 3)
+    np.testing.assert_array_equal(decoded["top_dishes"][:, 0], decoded["dish"])
+
+
+def test_responses_round_like_the_api():
+    scaler  = _fitted(MinMaxScaler(), 3, log_transform=True)
+    encoder = _label_encoder()
+    label_probs, macros_scaled = _outputs(3, n=4)
+
+    responses = PostProcessor.from_artifacts(JOINT, scaler, encoder).responses(
+        label_probs, macros_scaled, "demo_v11.0")
+    expected = _sklearn_decode(JOINT, scaler, encoder, label_probs,
+                               macros_scaled.astype(np.float64))
+
+    assert [r["dish"] for r in responses] == list(expected["dish"])
+    for i, response in enumerate(responses):
+        assert response["model_version"] == "demo_v11.0"
+        assert response["confidence"] == round(float(expected["confidence"][i]), 3)
+        assert response["nutrition"] == {
+            "calories":  int(round(float(expected["calories"][i]))),
+            "protein_g": round(float(expected["protein_g"][i]), 1),
+            "carbs_g":   round(float(expected["carbs_g"][i]), 1),
+            "fat_g":     round(float(expected["fat_g"][i]), 1),
+        }
+
+
+def test_rejects_scalers_that_are_not_affine():
+    with pytest.raises(ValueError, match="Cannot compile"):
+        PostProcessor.from_artifacts(JOINT, _fitted(QuantileTransformer(n_quantiles=50), 3))
+
+
+def test_rejects_a_scaler_with_the_wrong_columns():
+    with pytest.raises(ValueError, match="3-column"):
+        PostProcessor.from_artifacts(JOINT, _fitted(StandardScaler(), 4))
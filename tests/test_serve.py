@@ -0,0 +1,24 @@
+"""Worker count sizing for the pre-fork server."""
+
+import pytest
+
+import api.serve as serve
+
+
+@pytest.mark.parametrize("cpus, memory_gib, expected", [
+    (8, 2, 1),          # small instance: memory, not CPUs, is the limit
+    (8, 6, 4),
+    (2, 64, 2),
+    (4, None, 4),       # unknown limit: CPUs only
+])
+def test_auto_workers_fit_cpus_and_memory(monkeypatch, cpus, memory_gib, expected):
+    monkeypatch.setattr(serve, "available_cpus", lambda: cpus)
+    monkeypatch.setattr(serve, "memory_limit_bytes",
+                        lambda: memory_gib and memory_gib * 2**30)
+    assert serve.auto_workers(memory_mb=1280) == expected
+
+
+def test_default_is_one_worker(monkeypatch):
+    monkeypatch.setattr(serve, "available_cpus", lambda: 8)
+    assert serve.SERVE_WORKERS == 1
+    assert len(serve.plan_workers(pin=False)) == 1